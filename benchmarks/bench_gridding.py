@@ -0,0 +1,51 @@
+"""Regridding model output and pulling it out at the CTD stations"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from ohw_lter_vis.model_tools import Regridder, extract_points, nga_grid
+
+from ohw_lter_vis.synthetic import seward_stations
+
+from .common import SCALES
+
+
+def model_field(steps, shape=(120, 160), seed=0):
+    """A curvilinear (ROMS-like) temperature field over the NGA LTER area"""
+    rng = np.random.RandomState(seed)
+    ny, nx = shape
+    j, i = np.meshgrid(np.linspace(0, 1, ny), np.linspace(0, 1, nx), indexing='ij')
+    # a grid rotated a little, as model grids along the coast usually are
+    lon = -155 + 14 * i + 0.5 * j
+    lat = 58 + 3.5 * j - 0.3 * i
+    temp = 8 + rng.standard_normal((steps, ny, nx))
+    return xr.DataArray(temp, dims=('time', 'eta_rho', 'xi_rho'), name='temp',
+                        coords={'time': pd.date_range('2012-05-01', periods=steps, freq='D'),
+                                'lon_rho': (('eta_rho', 'xi_rho'), lon),
+                                'lat_rho': (('eta_rho', 'xi_rho'), lat)})
+
+
+class Gridding:
+    params = SCALES
+    param_names = ['scale']
+
+    def setup(self, scale):
+        self.da = model_field(steps=scale)
+        self.dst_lon, self.dst_lat = nga_grid()
+        self.regrid = Regridder(self.da.lon_rho.values, self.da.lat_rho.values, self.dst_lon, self.dst_lat)
+        stations = seward_stations(40 * scale)
+        self.lon, self.lat = stations['longitude'].values, stations['latitude'].values
+        self.times = pd.date_range('2012-05-01', periods=40 * scale, freq='3h')
+
+    def time_regridder_weights(self, scale):
+        Regridder(self.da.lon_rho.values, self.da.lat_rho.values, self.dst_lon, self.dst_lat)
+
+    def time_regrid(self, scale):
+        self.regrid(self.da).values
+
+    def time_extract_points(self, scale):
+        extract_points(self.da, self.lon, self.lat, time=self.times).values
+
+    def time_extract_points_bilinear(self, scale):
+        extract_points(self.da, self.lon, self.lat, time=self.times, method='bilinear').values
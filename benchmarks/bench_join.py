@@ -0,0 +1,36 @@
+"""Matching zooplankton tows to CTD casts, as in the demo notebook"""
+
+import pandas as pd
+
+from ohw_lter_vis.load_Seward_CTD import make_CTD_dataframe
+from ohw_lter_vis.load_Seward_zooplankton import make_zooplankton_dataframe
+
+from .common import SCALES, write_files
+
+
+def match_tows_to_casts(zoo_df, ctd_df):
+    # calvets are vertically integrated, so each cast is averaged first
+    zoo_sorted = zoo_df.sort_values(by=['time'])
+    ctd_grouped = ctd_df.groupby(['time']).agg({'salinity': 'mean', 'temperature': 'mean'}).reset_index()
+    joined = pd.merge_asof(zoo_sorted, ctd_grouped, on='time', direction='nearest')
+    by_class = joined.groupby(['Class', 'temperature', 'salinity']).agg({'Abundance (no m-3)': 'mean'})
+    return by_class.reset_index()
+
+
+class TowToCast:
+    params = SCALES
+    param_names = ['scale']
+    timeout = 300
+
+    def setup_cache(self):
+        return write_files()
+
+    def setup(self, files, scale):
+        self.ctd = make_CTD_dataframe(files[scale]['ctd'], files[scale]['hdr'])
+        self.zoo = make_zooplankton_dataframe(dataurl=files[scale]['zooplankton'])
+
+    def time_match_tows_to_casts(self, files, scale):
+        match_tows_to_casts(self.zoo, self.ctd)
+
+    def peakmem_match_tows_to_casts(self, files, scale):
+        match_tows_to_casts(self.zoo, self.ctd)
@@ -0,0 +1,42 @@
+"""Parsing the Seward Line CTD and zooplankton files"""
+
+from ohw_lter_vis.load_Seward_CTD import load_data, load_header, make_CTD_dataframe
+from ohw_lter_vis.load_Seward_zooplankton import make_zooplankton_dataframe
+
+from .common import SCALES, write_files
+
+
+class CTD:
+    params = SCALES
+    param_names = ['scale']
+    timeout = 300
+
+    def setup_cache(self):
+        return write_files()
+
+    def time_load_data(self, files, scale):
+        load_data(files[scale]['ctd'])
+
+    def time_load_header(self, files, scale):
+        load_header(files[scale]['hdr'])
+
+    def time_make_CTD_dataframe(self, files, scale):
+        make_CTD_dataframe(files[scale]['ctd'], files[scale]['hdr'])
+
+    def peakmem_make_CTD_dataframe(self, files, scale):
+        make_CTD_dataframe(files[scale]['ctd'], files[scale]['hdr'])
+
+
+class Zooplankton:
+    params = SCALES
+    param_names = ['scale']
+    timeout = 300
+
+    def setup_cache(self):
+        return write_files()
+
+    def time_make_zooplankton_dataframe(self, files, scale):
+        make_zooplankton_dataframe(dataurl=files[scale]['zooplankton'])
+
+    def peakmem_make_zooplankton_dataframe(self, files, scale):
+        make_zooplankton_dataframe(dataurl=files[scale]['zooplankton'])
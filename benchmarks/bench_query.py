@@ -0,0 +1,54 @@
+"""Filtered reads: query() against loading every cruise and filtering in pandas"""
+
+import os
+
+import pandas as pd
+
+from ohw_lter_vis.query import query, update_stores
+
+from .common import ARCHIVES, write_archives
+
+# the filters the notebooks apply
+FILTERS = {
+    'surface': dict(pressure=0),
+    'one_cruise': dict(time=('2013-05-01', '2013-06-01')),
+    'box_upper_50m': dict(bbox=(-150., -148., 59., 60.), pressure=(0, 50)),
+}
+
+
+def pandas_filter(ctd, bbox=None, time=None, pressure=None):
+    keep = pd.Series(True, index=ctd.index)
+    if bbox is not None:
+        keep &= ctd['longitude'].between(bbox[0], bbox[1]) & ctd['latitude'].between(bbox[2], bbox[3])
+    if time is not None:
+        keep &= ctd['time'].between(*time)
+    if pressure is not None:
+        lo, hi = pressure if isinstance(pressure, tuple) else (pressure, pressure)
+        keep &= ctd['pressure'].between(lo, hi)
+    return ctd[keep]
+
+
+class FilteredReads:
+    params = (ARCHIVES, sorted(FILTERS))
+    param_names = ['cruises', 'filter']
+    timeout = 600
+
+    def setup_cache(self):
+        folder = write_archives()
+        for n in ARCHIVES:
+            update_stores(os.path.join(folder, str(n)))
+        return folder
+
+    def setup(self, folder, cruises, name):
+        self.root = os.path.join(folder, str(cruises))
+        self.tables = os.path.join(self.root, 'tables', 'ctd')
+
+    def time_query(self, folder, cruises, name):
+        query('ctd', variables=['temperature', 'salinity'], root=self.root, **FILTERS[name])
+
+    def time_pandas(self, folder, cruises, name):
+        ctd = pd.concat([pd.read_parquet(os.path.join(self.tables, f)) for f in os.listdir(self.tables)])
+        pandas_filter(ctd, **FILTERS[name])[['time', 'latitude', 'longitude', 'pressure', 'temperature', 'salinity']]
+
+    def peakmem_query(self, folder, cruises, name):
+        self.time_query(folder, cruises, name)
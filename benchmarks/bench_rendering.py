@@ -0,0 +1,35 @@
+"""Drawing the station maps"""
+
+import matplotlib
+matplotlib.use('Agg')
+
+import cartopy.crs as ccrs
+import matplotlib.pyplot as plt
+
+from ohw_lter_vis.load_Seward_CTD import make_CTD_dataframe
+from ohw_lter_vis.ohw_lter_vis import make_map, map_stations_data
+
+from .common import SCALES, write_files
+
+
+class StationMap:
+    params = SCALES
+    param_names = ['scale']
+    timeout = 300
+
+    def setup_cache(self):
+        return write_files()
+
+    def setup(self, files, scale):
+        ctd = make_CTD_dataframe(files[scale]['ctd'], files[scale]['hdr'])
+        self.surface = ctd[ctd['pressure'] == 0]
+
+    def teardown(self, files, scale):
+        plt.close('all')
+
+    def time_map_stations_data(self, files, scale):
+        # no coastlines: they would be downloaded on first use, and only time the markers here
+        fig, ax = make_map(projection=ccrs.PlateCarree())
+        ax.set_extent([-154, -142, 58.5, 61.], ccrs.PlateCarree())
+        map_stations_data(ax, self.surface, colorby='temperature')
+        fig.canvas.draw()
@@ -0,0 +1,34 @@
+"""Filtered aggregates across cruises: pandas on loaded frames against the SQL views"""
+
+import os
+
+import pandas as pd
+
+from ohw_lter_vis.sql import Database
+
+from .common import ARCHIVES, write_archives
+
+
+class CruiseAggregates:
+    params = (ARCHIVES, ['pandas', 'duckdb', 'sqlite'])
+    param_names = ['cruises', 'engine']
+    timeout = 600
+
+    def setup_cache(self):
+        return write_archives()
+
+    def setup(self, folder, cruises, engine):
+        self.root = os.path.join(folder, str(cruises))
+        self.tables = os.path.join(self.root, 'tables', 'ctd')
+
+    def time_surface_mean_by_cruise(self, folder, cruises, engine):
+        if engine == 'pandas':
+            ctd = pd.concat([pd.read_parquet(os.path.join(self.tables, name)) for name in os.listdir(self.tables)])
+            ctd[ctd['pressure'] < 10].groupby('cruise')['temperature'].mean()
+        else:
+            with Database(engine=engine) as db:
+                db.attach_cache(self.root)
+                db.sql('SELECT cruise, avg(temperature) FROM profiles WHERE pressure < 10 GROUP BY cruise')
+
+    def peakmem_surface_mean_by_cruise(self, folder, cruises, engine):
+        self.time_surface_mean_by_cruise(folder, cruises, engine)
@@ -0,0 +1,42 @@
+"""
+Shared setup for the benchmarks: the scales every benchmark is run at, and
+the synthetic files for each scale, written once per benchmark run.
+"""
+
+import os
+import tempfile
+
+from ohw_lter_vis.load_Seward_CTD import make_CTD_dataframe
+from ohw_lter_vis.synthetic import write_archive
+
+# numbers of cruises in the multi-cruise archives
+ARCHIVES = [2, 10, 40]
+
+# multiples of one Seward Line cruise (40 casts, a tow of 150 taxa at every third)
+SCALES = [1, 10, 100]
+
+
+def write_files(scales=SCALES, seed=0):
+    """Writes the CTD and zooplankton files for every scale; returns scale -> paths"""
+    folder = tempfile.mkdtemp(prefix='ohw_lter_vis_bench_')
+    files = {}
+    for scale in scales:
+        archive = write_archive(os.path.join(folder, str(scale)), n_stations=40 * scale, seed=seed)
+        ctd, hdr = archive['ctd'][0]
+        files[scale] = dict(ctd=ctd, hdr=hdr, zooplankton=archive['zooplankton'])
+    return files
+
+
+def write_archives(archives=ARCHIVES, seed=0):
+    """
+    Writes a cache directory per archive size, holding the parsed CTD table of every
+    cruise as load_cruise leaves it; returns the folder holding them, one per size
+    """
+    folder = tempfile.mkdtemp(prefix='ohw_lter_vis_bench_')
+    for n in archives:
+        root = os.path.join(folder, str(n))
+        files = write_archive(os.path.join(root, 'remote'), n_cruises=n, n_stations=40, seed=seed)
+        os.makedirs(os.path.join(root, 'tables', 'ctd'))
+        for cruise, (data, hdr) in zip(files['cruises'], files['ctd']):
+            make_CTD_dataframe(data, hdr).to_parquet(os.path.join(root, 'tables', 'ctd', cruise + '.parquet'))
+    return folder
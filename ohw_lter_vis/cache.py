@@ -0,0 +1,119 @@
+'''
+A small on-disk cache shared by the data loaders. Everything lives under a
+single directory, ~/.cache/ohw_lter_vis by default, which can be moved by
+setting the OHW_LTER_VIS_CACHE environment variable.
+'''
+
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+# seconds for which things fetched from catalogues and servers are reused by default
+CACHE_TTL = 24 * 3600
+
+
+def get_cache_dir(*subdirs):
+    '''
+    Returns (and creates if needed) a directory inside the cache
+    Input:
+        - subdirs (strings) - optional path components below the cache root
+    Output:
+        - string path
+    '''
+    root = os.environ.get('OHW_LTER_VIS_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'ohw_lter_vis'))
+    path = os.path.join(root, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def hash_key(*parts):
+    '''
+    Makes a stable file-name friendly key from any number of strings
+    Input:
+        - parts (strings or bytes)
+    Output:
+        - string (hex digest)
+    '''
+    sha = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode('utf-8')
+        sha.update(part)
+        sha.update(b'\x1f')
+    return sha.hexdigest()
+
+
+def is_fresh(path, ttl):
+    '''
+    Checks that a cached file exists and is younger than ttl
+    Input:
+        - path (string)
+        - ttl (float) - maximum age in seconds, None for no limit
+    Output:
+        - boolean
+    '''
+    if not os.path.exists(path):
+        return False
+    if ttl is None:
+        return True
+    return time.time() - os.path.getmtime(path) < ttl
+
+
+def table_path(name):
+    '''
+    Location of a parsed table in the cache
+    Input:
+        - name (string) - e.g. 'ctd/TXS12'
+    Output:
+        - string path of the Parquet file
+    '''
+    folder, base = os.path.split(name)
+    return os.path.join(get_cache_dir('tables', folder), base + '.parquet')
+
+
+def table_source(name):
+    '''
+    The urls or files a cached table was built from, as given to cached_table
+    Input:
+        - name (string) - e.g. 'ctd/TXS12'
+    Output:
+        - list(strings), None if they weren't recorded
+    '''
+    path = os.path.splitext(table_path(name))[0] + '.source.json'
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def cached_table(name, build, refresh=False, source=None):
+    '''
+    Reads a table parsed earlier from the cache, or builds and stores it
+    Input:
+        - name (string) - e.g. 'ctd/TXS12'
+        - build (callable) - makes the pandas.DataFrame when it isn't cached
+        - refresh (boolean) - flag for building it again anyway
+        - source (list(strings)) - the urls or files the table is built from, kept next to it; a
+          table cached from other sources is built again. None to take the table as it is.
+    Output:
+        - pandas.DataFrame
+    '''
+    path = table_path(name)
+    source = None if source is None else list(source)
+    if not refresh and os.path.exists(path) and (source is None or table_source(name) == source):
+        return pd.read_parquet(path)
+    df = build()
+    tmp = path + '.partial'
+    df.to_parquet(tmp)
+    os.replace(tmp, path)
+    if source is not None:
+        # written after the table, so a table without the matching sources is never taken as current
+        sources = os.path.splitext(path)[0] + '.source.json'
+        with open(sources + '.partial', 'w') as f:
+            json.dump(source, f)
+        os.replace(sources + '.partial', sources)
+    return df
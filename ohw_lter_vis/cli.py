@@ -0,0 +1,272 @@
+'''
+The ohw-lter-vis command. It fetches the configured cruises, the zooplankton
+file and IOOS queries ahead of time, parsing them into the tables the loaders
+read from the cache (load_cruise, load_zooplankton, DataScraper.load_state),
+and packs the whole cache into one file for machines that shouldn't fetch at
+run time:
+
+    ohw-lter-vis warm                         # everything in DEFAULT_CONFIG
+    ohw-lter-vis warm --config seward.json --no-ioos --report warm.json
+    ohw-lter-vis bundle seward.tar.gz         # warm, then pack the cache
+    ohw-lter-vis unpack seward.tar.gz         # on the compute node
+
+A config file is JSON with any of the keys of DEFAULT_CONFIG. Cruises are
+given either as names from load_Seward_CTD.CRUISES, or as a mapping of names
+to [data url, header url]. IOOS queries may also give a cache_ttl, the seconds
+for which their snapshot is reused (cache.CACHE_TTL by default), and a
+csw_endpoint to search instead of the DataScraper default.
+'''
+
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from .cache import CACHE_TTL, get_cache_dir, is_fresh, table_path
+from .instrument import tracing
+from .load_Seward_CTD import CRUISES, load_cruise
+from .load_Seward_zooplankton import ZOOPLANKTON_URL, load_zooplankton
+from .query import update_stores
+from .version import __version__
+
+DEFAULT_CONFIG = {
+    'cruises': sorted(CRUISES),
+    # a single file holds every year
+    'zooplankton': ZOOPLANKTON_URL,
+    'ioos': [{'name': 'nga_temperature', 'roi': [-154., -142., 58.5, 61.], 'start': '2018-07-01',
+              'stop': '2018-07-15', 'target': ['sea_water_temperature'], 'models_only': False,
+              'run_timeout': 600}],
+}
+
+# cache directories left out of bundles: temporary stream files
+TRANSIENT = ('streams',)
+
+# the spans that count the bytes coming over the network (others, e.g. decoding, count them again)
+TRANSFERS = ('http.get', 'sos.stream', 'csw.page')
+
+
+def load_config(path=None):
+    '''
+    Reads a config file over DEFAULT_CONFIG, adding any cruises it defines to CRUISES
+    Input:
+        - path (string) - JSON file, None for the defaults
+    Output:
+        - dict
+    '''
+    config = dict(DEFAULT_CONFIG)
+    if path is not None:
+        with open(path) as f:
+            config.update(json.load(f))
+    if isinstance(config['cruises'], dict):
+        CRUISES.update((name, tuple(urls)) for name, urls in config['cruises'].items())
+        config['cruises'] = sorted(config['cruises'])
+    return config
+
+
+def ioos_snapshot(name):
+    '''
+    Output:
+        - string path of the DataScraper snapshot kept for a configured IOOS query
+    '''
+    return os.path.join(get_cache_dir('ioos'), name)
+
+
+def _disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(folder, name))
+               for folder, _, names in os.walk(path) for name in names)
+
+
+def _warm_ioos(query, refresh=False):
+    # ioos_lib pulls in the geospatial stack, so only import it when a query is warmed
+    from .ioos_lib import DataScraper
+    path = ioos_snapshot(query['name'])
+    ttl = query.get('cache_ttl', CACHE_TTL)
+    if not refresh and is_fresh(os.path.join(path, 'state.json'), ttl):
+        # a snapshot left by an interrupted run carries on from its last step
+        scraper = DataScraper.load_state(path, run_timeout=query.get('run_timeout'))
+        scraper.resume(checkpoint=path)
+    else:
+        scraper = DataScraper(query['roi'], datetime.fromisoformat(query['start']),
+                              datetime.fromisoformat(query['stop']), query.get('target'),
+                              models_only=query.get('models_only', False), cache_ttl=ttl,
+                              run_timeout=query.get('run_timeout'), csw_endpoint=query.get('csw_endpoint'))
+        scraper.discover()
+        scraper.save_state(path)
+    return scraper.df if hasattr(scraper, 'df') else None
+
+
+def run_task(kind, name, func, path):
+    '''
+    Runs one warming task, timing it and counting what it downloaded
+    Input:
+        - kind (string) - 'ctd', 'zooplankton' or 'ioos'
+        - name (string)
+        - func (callable) - does the work, returning a pandas.DataFrame (or None)
+        - path (string) - file or directory the task leaves in the cache
+    Output:
+        - dict with kind, name, seconds, rows, downloaded and stored (bytes) and error
+    '''
+    error = ''
+    df = None
+    with tracing() as tracer:
+        tic = time.perf_counter()
+        try:
+            df = func()
+        except Exception as err:
+            error = '{}: {}'.format(type(err).__name__, err)
+        seconds = time.perf_counter() - tic
+    downloaded = sum(span['bytes'] for span in tracer.spans if span['name'] in TRANSFERS)
+    stored = _disk_size(path) if os.path.exists(path) else 0
+    return dict(kind=kind, name=name, seconds=round(seconds, 3), rows=0 if df is None else len(df),
+                downloaded=downloaded, stored=stored, error=error)
+
+
+def warm(config, refresh=False, ioos=True):
+    '''
+    Fetches and parses everything in a config that isn't in the cache yet, and
+    brings the query stores up to date
+    Input:
+        - config (dict) - as from load_config
+        - refresh (boolean) - fetch everything again
+        - ioos (boolean) - flag for warming the IOOS queries
+    Output:
+        - pandas.DataFrame with one row per task (see run_task)
+    '''
+    report = []
+    for cruise in config['cruises']:
+        report.append(run_task('ctd', cruise, lambda: load_cruise(cruise, refresh), table_path('ctd/' + cruise)))
+    if config.get('zooplankton'):
+        report.append(run_task('zooplankton', 'calvet',
+                               lambda: load_zooplankton(refresh=refresh, dataurl=config['zooplankton']),
+                               table_path('zooplankton/calvet')))
+    if ioos:
+        for query in config.get('ioos', []):
+            report.append(run_task('ioos', query['name'], lambda: _warm_ioos(query, refresh),
+                                   ioos_snapshot(query['name'])))
+    # so query() doesn't have to build the stores on first use
+    update_stores()
+    return pd.DataFrame(report, columns=['kind', 'name', 'seconds', 'rows', 'downloaded', 'stored', 'error'])
+
+
+def bundle(output, config=None):
+    '''
+    Packs the cache into a single tar file, with a MANIFEST.json describing it
+    Input:
+        - output (string) - file to write; compressed if it ends in .gz or .tgz
+        - config (dict) - recorded in the manifest
+    Output:
+        - dict - the manifest
+    '''
+    root = get_cache_dir()
+    files = []
+    for folder, dirs, names in os.walk(root):
+        if folder == root:
+            dirs[:] = [d for d in dirs if d not in TRANSIENT]
+        for name in names:
+            if not name.endswith('.partial'):
+                files.append(os.path.relpath(os.path.join(folder, name), root))
+    manifest = dict(version=__version__, created=datetime.now().isoformat(timespec='seconds'),
+                    config=config, files=len(files),
+                    bytes=sum(os.path.getsize(os.path.join(root, name)) for name in files))
+    tmp = output + '.partial'
+    mode = 'w:gz' if output.endswith(('.gz', '.tgz')) else 'w'
+    with tarfile.open(tmp, mode) as tar:
+        for name in sorted(files):
+            tar.add(os.path.join(root, name), arcname=name)
+        text = json.dumps(manifest, indent=1).encode('utf-8')
+        info = tarfile.TarInfo('MANIFEST.json')
+        info.size = len(text)
+        info.mtime = time.time()
+        tar.addfile(info, io.BytesIO(text))
+    os.replace(tmp, output)
+    return manifest
+
+
+def unpack(path, root=None):
+    '''
+    Unpacks a bundle into the cache, so the loaders find everything without fetching
+    Input:
+        - path (string) - bundle written by bundle()
+        - root (string) - where to unpack, the cache directory by default
+    Output:
+        - dict - the bundle's manifest
+    '''
+    root = get_cache_dir() if root is None else root
+    with tarfile.open(path) as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(root, filter='data')
+        else:
+            # Pythons without extraction filters: only take plain files and folders that stay inside root
+            top = os.path.realpath(root)
+            for member in tar.getmembers():
+                target = os.path.realpath(os.path.join(top, member.name))
+                if not (member.isfile() or member.isdir()) or os.path.commonpath([top, target]) != top:
+                    raise ValueError('{} is not a bundle: it holds {}'.format(path, member.name))
+            tar.extractall(root)
+    with open(os.path.join(root, 'MANIFEST.json')) as f:
+        return json.load(f)
+
+
+def _print_report(report):
+    table = report.copy()
+    for col in ('downloaded', 'stored'):
+        table[col] = (table[col] / 2 ** 20).round(2)
+    table = table.rename(columns={'downloaded': 'downloaded (MB)', 'stored': 'stored (MB)'})
+    print(table.to_string(index=False))
+    print('total {:.1f} s, {:.1f} MB downloaded, {:.1f} MB stored'.format(
+        report['seconds'].sum(), report['downloaded'].sum() / 2 ** 20, report['stored'].sum() / 2 ** 20))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='ohw-lter-vis',
+                                     description='Prefetch the Seward Line and IOOS data, and pack it for offline use.')
+    parser.add_argument('--version', action='version', version=__version__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, helptext in (('warm', 'fetch and parse the configured data into the cache'),
+                           ('bundle', 'warm the cache, then pack it into one file')):
+        sub = commands.add_parser(name, help=helptext)
+        if name == 'bundle':
+            sub.add_argument('output', help='bundle to write (.tar, .tar.gz)')
+            sub.add_argument('--no-warm', dest='warm', action='store_false', help='pack the cache as it is')
+        sub.add_argument('--config', help='JSON config file')
+        sub.add_argument('--refresh', action='store_true', help='fetch everything again')
+        sub.add_argument('--no-ioos', dest='ioos', action='store_false', help='skip the IOOS queries')
+        sub.add_argument('--report', help='also write the timing report to this JSON file')
+
+    sub = commands.add_parser('unpack', help='unpack a bundle into the cache')
+    sub.add_argument('bundle')
+    sub.add_argument('--root', help='directory to unpack into, the cache directory by default')
+
+    args = parser.parse_args(argv)
+    if args.command == 'unpack':
+        manifest = unpack(args.bundle, args.root)
+        print('unpacked {files} files ({bytes} bytes) made by ohw_lter_vis {version} on {created}'.format(**manifest))
+        return 0
+
+    config = load_config(args.config)
+    failed = False
+    if args.command == 'warm' or args.warm:
+        report = warm(config, refresh=args.refresh, ioos=args.ioos)
+        _print_report(report)
+        if args.report:
+            report.to_json(args.report, orient='records', indent=1)
+        failed = (report['error'] != '').any()
+    if args.command == 'bundle':
+        tic = time.perf_counter()
+        manifest = bundle(args.output, config)
+        print('packed {} files, {:.1f} MB, into {} in {:.1f} s'.format(
+            manifest['files'], os.path.getsize(args.output) / 2 ** 20, args.output, time.perf_counter() - tic))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
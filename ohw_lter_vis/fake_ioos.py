@@ -0,0 +1,381 @@
+'''
+Local stand-ins for the IOOS services DataScraper talks to, so that it can be
+run (and timed) without data.ioos.us. A single HTTP server on localhost plays
+three parts:
+
+    /csw           a CSW catalogue answering GetRecords with Dublin Core records
+    /sos           an SOS server answering GetObservation with CSV time series
+    /files/*.nc    a file server for model output, with HTTP range requests so
+                   netCDF can open the files remotely ('#mode=bytes')
+
+Everything served is synthetic and generated from a seed, and every request
+can be delayed or failed on purpose to mimic slow or flaky endpoints.
+run_benchmark times the DataScraper steps end to end against it.
+'''
+
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+CSW_NAMESPACES = ('xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
+                  'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+                  'xmlns:dct="http://purl.org/dc/terms/" '
+                  'xmlns:ows="http://www.opengis.net/ows"')
+
+# region the synthetic stations and model grids cover (min_lon, max_lon, min_lat, max_lat)
+EXTENT = (-154., -142., 58.5, 61.)
+
+
+class FakeIOOS():
+    '''
+    A local CSW/SOS/file server with synthetic content. Use as a context manager,
+    or call start() and stop().
+    Inputs:
+        - n_stations (int) - number of SOS stations in the catalogue
+        - n_models (int) - number of model files in the catalogue
+        - names (list(strings)) - standard names each station measures
+        - latency (float or dict) - seconds added to every request, or a dict of seconds
+          per service ('csw', 'sos', 'files')
+        - failure_rate (float or dict) - share of requests answered with a server error,
+          overall or per service
+        - duplicates (int) - number of extra records listing the same endpoints, as the
+          real catalogue often does
+        - seed (int) - seed for the synthetic values and the failures
+        - root (string) - directory for the model files, a temporary one by default
+    '''
+
+    def __init__(self, n_stations=10, n_models=2, names=('sea_water_temperature', 'sea_water_salinity'),
+                 latency=0., failure_rate=0., duplicates=0, seed=0, root=None):
+        self.n_stations = n_stations
+        self.n_models = n_models
+        self.names = list(names)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.duplicates = duplicates
+        self.seed = seed
+        self.root = root
+        self.requests = {'csw': 0, 'sos': 0, 'files': 0}
+        # bytes of the response bodies sent, per service
+        self.sent = {'csw': 0, 'sos': 0, 'files': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        '''
+        Writes the model files and starts serving on a free port of localhost
+        '''
+        self._own_root = self.root is None
+        self.root = tempfile.mkdtemp() if self.root is None else self.root
+        self.model_files = [write_model_file(os.path.join(self.root, 'model_{}.nc'.format(i)), seed=self.seed + i)
+                            for i in range(self.n_models)]
+        handler = type('Handler', (_Handler,), {'fake': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.csw_url = self.url + '/csw'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the server and removes the files it wrote
+        '''
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self._own_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
+    def stations(self):
+        '''
+        Output:
+            - list of (station id, longitude, latitude), always the same for a seed
+        '''
+        rng = np.random.RandomState(self.seed)
+        lon = rng.uniform(EXTENT[0], EXTENT[1], self.n_stations)
+        lat = rng.uniform(EXTENT[2], EXTENT[3], self.n_stations)
+        return [('urn:ioos:station:fake:st{:03d}'.format(i), lon[i], lat[i]) for i in range(self.n_stations)]
+
+    def records(self):
+        '''
+        The catalogue: one record per station (with an SOS url per standard name) and one
+        per model file, plus the duplicate records, sorted by title like the real one
+        Output:
+            - list of dicts with the keys identifier, title, subjects and references
+        '''
+        records = []
+        for station, lon, lat in self.stations():
+            refs = [('OGC:SOS', '{}/sos?service=SOS&request=GetObservation&version=1.0.0'
+                     '&offering={}&observedProperty=http://mmisw.org/ont/cf/parameter/{}'
+                     '&responseFormat=text/csv&eventTime=latest'.format(self.url, station, name))
+                    for name in self.names]
+            records.append(dict(identifier=station, title='Station ' + station.split(':')[-1],
+                                subjects=self.names, references=refs))
+        for i, path in enumerate(self.model_files):
+            url = '{}/files/{}#mode=bytes'.format(self.url, os.path.basename(path))
+            records.append(dict(identifier='fake-model-{}'.format(i), title='Forecast model {}'.format(i),
+                                subjects=['sea_water_temperature', 'forecast'],
+                                references=[('OPeNDAP:OPeNDAP', url)]))
+        for i in range(self.duplicates):
+            original = records[i % len(records)]
+            records.append(dict(original, identifier='{}-copy-{}'.format(original['identifier'], i),
+                                title=original['title'] + ' (copy {})'.format(i)))
+        return sorted(records, key=lambda rec: rec['title'])
+
+    def _should_fail(self, service):
+        rate = self.failure_rate.get(service, 0.) if isinstance(self.failure_rate, dict) else self.failure_rate
+        with self._lock:
+            self.requests[service] += 1
+            return rate > 0 and self._random.random() < rate
+
+    def _delay(self, service):
+        latency = self.latency.get(service, 0.) if isinstance(self.latency, dict) else self.latency
+        if latency > 0:
+            time.sleep(latency)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _service(self):
+        path = urlparse(self.path).path
+        for service in ('csw', 'sos', 'files'):
+            if path.startswith('/' + service):
+                return service
+
+    def _reply(self, status, body, content_type='text/plain', headers=()):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+            service = self._service()
+            if service is not None:
+                with self.fake._lock:
+                    self.fake.sent[service] += len(body)
+
+    def _start(self):
+        service = self._service()
+        if service is None:
+            self._reply(404, 'not found')
+            return None
+        self.fake._delay(service)
+        if self.fake._should_fail(service):
+            self._reply(500, 'injected failure')
+            return None
+        return service
+
+    def do_POST(self):
+        if self._start() != 'csw':
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        start = int(_xml_attribute(body, 'startPosition', 1))
+        count = int(_xml_attribute(body, 'maxRecords', 10))
+        match = re.search(r'ElementSetName[^>]*>\s*(\w+)', body)
+        element_set = 'summary' if match is None else match.group(1)
+        self._reply(200, csw_response(self.fake.records(), start, count, element_set), 'application/xml')
+
+    def do_GET(self):
+        service = self._start()
+        if service == 'sos':
+            query = parse_qs(urlparse(self.path).query)
+            self._reply(200, sos_csv(self.fake, query), 'text/csv')
+        elif service == 'files':
+            self._send_file()
+
+    do_HEAD = do_GET
+
+    def _send_file(self):
+        name = os.path.basename(urlparse(self.path).path)
+        path = os.path.join(self.fake.root, name)
+        if not os.path.exists(path):
+            self._reply(404, 'not found')
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match is None:
+            self._reply(200, data, 'application/x-netcdf', [('Accept-Ranges', 'bytes')])
+            return
+        first = int(match.group(1))
+        last = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+        self._reply(206, data[first:last + 1], 'application/x-netcdf',
+                    [('Accept-Ranges', 'bytes'), ('Content-Range', 'bytes {}-{}/{}'.format(first, last, len(data)))])
+
+
+def _xml_attribute(xml, name, default):
+    match = re.search(r'{}="(\d+)"'.format(name), xml)
+    return default if match is None else match.group(1)
+
+
+def csw_response(records, start, count, element_set='summary'):
+    '''
+    A CSW 2.0.2 GetRecords response for one page of records
+    Input:
+        - records (list(dict)) - as made by FakeIOOS.records
+        - start (int) - position of the first record, counting from 1
+        - count (int) - page size
+        - element_set (string) - 'brief', 'summary' or 'full', as asked for in the request
+    Output:
+        - string (XML)
+    '''
+    tag = {'brief': 'csw:BriefRecord', 'summary': 'csw:SummaryRecord'}.get(element_set, 'csw:Record')
+    page = records[start - 1:start - 1 + count]
+    after = start + len(page)
+    items = []
+    for rec in page:
+        parts = ['<dc:identifier>{}</dc:identifier>'.format(escape(rec['identifier'])),
+                 '<dc:title>{}</dc:title>'.format(escape(rec['title']))]
+        parts += ['<dc:subject>{}</dc:subject>'.format(escape(name)) for name in rec['subjects']]
+        parts += ['<dct:references scheme="{}">{}</dct:references>'.format(escape(scheme), escape(url))
+                  for scheme, url in rec['references']]
+        items.append('<{0}>{1}</{0}>'.format(tag, ''.join(parts)))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<csw:GetRecordsResponse {} version="2.0.2">'
+            '<csw:SearchStatus timestamp="{}"/>'
+            '<csw:SearchResults numberOfRecordsMatched="{}" numberOfRecordsReturned="{}" nextRecord="{}" '
+            'elementSet="{}">{}</csw:SearchResults></csw:GetRecordsResponse>'
+            ).format(CSW_NAMESPACES, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), len(records), len(page),
+                     after if after <= len(records) else 0, element_set, ''.join(items))
+
+
+def sos_csv(fake, query, step=timedelta(hours=1)):
+    '''
+    The CSV answer to a GetObservation request: a smooth, seeded series at the station,
+    hourly within eventTime (the last day for 'latest')
+    Input:
+        - fake (FakeIOOS)
+        - query (dict) - parsed query string
+        - step (timedelta) - time between values
+    Output:
+        - string (CSV)
+    '''
+    station = query.get('offering', ['unknown'])[0]
+    name = query.get('observedProperty', ['unknown'])[0].rstrip('/').split('/')[-1]
+    window = query.get('eventTime', ['latest'])[0]
+    if '/' in window:
+        start, stop = [pd.Timestamp(t.rstrip('Z')) for t in window.split('/')]
+    else:
+        stop = pd.Timestamp(datetime(2018, 8, 1))
+        start = stop - timedelta(days=1)
+    positions = dict((st, (lon, lat)) for st, lon, lat in fake.stations())
+    lon, lat = positions.get(station, (np.nan, np.nan))
+    times = pd.date_range(start.ceil('h'), stop, freq=step)
+    hours = (times - pd.Timestamp('2000-01-01')) / pd.Timedelta(hours=1)
+    phase = sum(map(ord, station + name)) % 24
+    values = 10 + 2 * np.sin(2 * np.pi * (np.asarray(hours) + phase) / 24.)
+    df = pd.DataFrame({'station_id': station, 'sensor_id': station + ':' + name,
+                       'latitude (degree)': lat, 'longitude (degree)': lon,
+                       'date_time': times.strftime('%Y-%m-%dT%H:%M:%SZ'), 'depth (m)': 0.,
+                       '{} (C)'.format(name): values.round(3)})
+    return df.to_csv(index=False)
+
+
+def write_model_file(path, seed=0, shape=(4, 20, 30), start=datetime(2018, 7, 1)):
+    '''
+    Writes a small CF-compliant forecast file: sea water temperature on a regular
+    longitude/latitude grid over EXTENT, daily
+    Input:
+        - path (string)
+        - seed (int)
+        - shape (tuple(int)) - (time, lat, lon)
+        - start (datetime) - first time step
+    Output:
+        - path
+    '''
+    rng = np.random.RandomState(seed)
+    nt, ny, nx = shape
+    lon = np.linspace(EXTENT[0], EXTENT[1], nx)
+    lat = np.linspace(EXTENT[2], EXTENT[3], ny)
+    temp = 8 + rng.standard_normal(shape).astype('float32')
+    ds = xr.Dataset({'temp': (('time', 'lat', 'lon'), temp,
+                              dict(standard_name='sea_water_temperature', units='degC'))},
+                    coords={'time': pd.date_range(start, periods=nt, freq='D'),
+                            'lat': ('lat', lat, dict(standard_name='latitude', units='degrees_north')),
+                            'lon': ('lon', lon, dict(standard_name='longitude', units='degrees_east'))},
+                    attrs=dict(title='Fake forecast {}'.format(seed), Conventions='CF-1.6'))
+    # gridgeo finds the grid through the variable's coordinates attribute
+    ds['temp'].encoding['coordinates'] = 'time lat lon'
+    ds.to_netcdf(path, format='NETCDF4_CLASSIC')
+    return path
+
+
+def run_benchmark(repeat=3, roi=(-154., -142., 58.5, 61.), start=datetime(2018, 7, 1),
+                  stop=datetime(2018, 7, 15), target=('sea_water_temperature',), warm=True, **fake):
+    '''
+    Times the DataScraper steps end to end against a FakeIOOS server
+    Input:
+        - repeat (int) - number of cold runs, each with an empty cache
+        - roi, start, stop, target - passed to DataScraper
+        - warm (boolean) - also time a second pass over each cold run's cache
+        - fake - passed to FakeIOOS (latency, failure_rate, n_stations, ...)
+    Output:
+        - pandas.DataFrame with one row per run and step: run, cache, step, seconds, and the
+          number of requests that reached each service
+    '''
+    # ioos_lib pulls in the whole mapping stack, so only load it when it is needed
+    from .ioos_lib import DataScraper
+
+    rows = []
+    with FakeIOOS(**fake) as server:
+        for run in range(repeat):
+            cache = tempfile.mkdtemp()
+            previous = os.environ.get('OHW_LTER_VIS_CACHE')
+            os.environ['OHW_LTER_VIS_CACHE'] = cache
+            DataScraper._dap_probes.clear()
+            try:
+                for state in ['cold', 'warm'] if warm else ['cold']:
+                    for models_only, steps in [(False, ['get_records', 'create_database', 'get_observations']),
+                                               (True, ['get_records', 'create_database', 'get_models'])]:
+                        scraper = DataScraper(list(roi), start, stop, list(target), models_only=models_only,
+                                              csw_endpoint=server.csw_url)
+                        for step in steps:
+                            before = dict(server.requests)
+                            tic = time.perf_counter()
+                            getattr(scraper, step)()
+                            rows.append(dict(run=run, cache=state, step=step, seconds=time.perf_counter() - tic,
+                                             **dict((service, server.requests[service] - before[service])
+                                                    for service in before)))
+            finally:
+                if previous is None:
+                    del os.environ['OHW_LTER_VIS_CACHE']
+                else:
+                    os.environ['OHW_LTER_VIS_CACHE'] = previous
+                shutil.rmtree(cache, ignore_errors=True)
+    return pd.DataFrame(rows, columns=['run', 'cache', 'step', 'seconds', 'csw', 'sos', 'files'])
+
+
+if __name__ == '__main__':
+    report = run_benchmark(latency=0.05)
+    print(report.groupby(['cache', 'step'], sort=False)['seconds'].describe())
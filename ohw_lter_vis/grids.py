@@ -0,0 +1,211 @@
+'''
+Probing the OPeNDAP endpoints found by ioos_lib.DataScraper: does an endpoint
+hold one of the target variables, and on what grid. Grid geometry is kept on
+disk (CachedGrid), so it is only built once per endpoint.
+
+The netCDF C library is not thread safe, so probes can't run side by side in
+threads. ProbePool runs them in worker processes instead, each with a library
+of its own; only this module (and not the mapping stack of ioos_lib) is loaded
+in the workers. As with any multiprocessing code, scripts that probe have to
+keep their work under an `if __name__ == '__main__':` guard, since the workers
+import the main script (keeping its top-level imports light keeps them quick
+to start).
+'''
+
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+import gridgeo
+import shapely.wkb
+from netCDF4 import Dataset
+
+from .cache import get_cache_dir, hash_key
+
+# serializes the use of the netCDF C library by the threads of one process (see probe_dap_url)
+_netcdf_lock = threading.Lock()
+
+
+class CachedGrid():
+    '''
+    The parts of a gridgeo.GridGeo that get_models needs (cell geometry, outline and mesh type),
+    stored on disk so that a grid is only built once per endpoint.
+    Inputs:
+        - geometry (shapely MultiPolygon) - the grid cells
+        - outline (shapely Polygon) - the outline of the grid
+        - mesh (string) - the mesh topology, as in GridGeo.mesh
+    '''
+
+    def __init__(self, geometry, outline, mesh):
+        self.geometry = geometry
+        self.outline = outline
+        self.mesh = mesh
+
+    def __repr__(self):
+        return '<CachedGrid mesh={}>'.format(self.mesh)
+
+    @property
+    def __geo_interface__(self):
+        return self.geometry.__geo_interface__
+
+    @staticmethod
+    def _paths(key, folder=None):
+        folder = get_cache_dir('grids') if folder is None else folder
+        return os.path.join(folder, key + '.json'), os.path.join(folder, key + '.wkb')
+
+    @classmethod
+    def load(cls, key, folder=None):
+        '''
+        Returns the grid stored under key (in the cache, or in folder), or None
+        '''
+        meta, geom = cls._paths(key, folder)
+        if not (os.path.exists(meta) and os.path.exists(geom)):
+            return None
+        with open(meta) as f:
+            meta = json.load(f)
+        with open(geom, 'rb') as f:
+            geometry = shapely.wkb.loads(f.read())
+        outline = shapely.wkb.loads(bytes.fromhex(meta['outline']))
+        return cls(geometry, outline, meta['mesh'])
+
+    @classmethod
+    def save(cls, key, grid, folder=None):
+        '''
+        Stores the geometry of a GridGeo (or CachedGrid) under key, in the cache or in folder
+        Output:
+            - CachedGrid holding what was stored
+        '''
+        meta, geom = cls._paths(key, folder)
+        with open(geom, 'wb') as f:
+            f.write(shapely.wkb.dumps(grid.geometry))
+        with open(meta, 'w') as f:
+            json.dump(dict(mesh=grid.mesh, outline=shapely.wkb.dumps(grid.outline, hex=True)), f)
+        return grid if isinstance(grid, cls) else cls(grid.geometry, grid.outline, grid.mesh)
+
+
+def grid_fingerprint(url, nc, var):
+    '''
+    Makes a key that changes whenever the grid behind a variable might have changed:
+    the url plus the names, dimensions and shapes of the variable and its coordinates.
+    Only metadata is used, so nothing is downloaded.
+    Input:
+        - url (string)
+        - nc (netCDF4.Dataset)
+        - var (netCDF4.Variable)
+    Output:
+        - string
+    '''
+    names = [var.name] + getattr(var, 'coordinates', '').split() + list(var.dimensions)
+    parts = [(name, nc.variables[name].dimensions, nc.variables[name].shape)
+             for name in names if name in nc.variables]
+    return hash_key(url, json.dumps(parts))
+
+
+def probe_dap_url(url, target):
+    '''
+    Opens an OPeNDAP url and checks that it holds one of the target variables on a usable grid.
+    Within a process, the netCDF library is only held while it is used: the grid cache is read
+    and written without it, and on a cache hit the grid isn't built at all.
+    Input:
+        - url (string)
+        - target (list(strings)) - standard names to look for
+    Output:
+        - dict with the keys valid (boolean), title, standard_name and grid (CachedGrid)
+    Raises whatever netCDF4 raises if the url cannot be opened or read, so that a
+    failed probe is not taken for an answer.
+    '''
+    probe = dict(valid=False, title=url, standard_name=None, grid=None)
+    with _netcdf_lock:
+        nc = Dataset(url)
+    try:
+        with _netcdf_lock:
+            # Some files may not contain relevant information, even after filtering. Ignore them.
+            variables = nc.get_variables_by_attributes(standard_name=lambda x: x in target)
+            if len(variables) == 0:
+                return probe
+            probe['standard_name'] = variables[0].standard_name
+            probe['title'] = getattr(nc, 'title', url)
+            key = grid_fingerprint(url, nc, variables[0])
+
+        # Building the grid means downloading the coordinates, so reuse one built before if the grid is unchanged
+        probe['grid'] = CachedGrid.load(key)
+        if probe['grid'] is None:
+            # Some files may not properly convert to a geo-object. Ignore them, but not
+            # failures to read them, which may well be gone next time.
+            try:
+                with _netcdf_lock:
+                    grid = gridgeo.GridGeo(nc, standard_name=probe['standard_name'])
+            except (OSError, RuntimeError):
+                raise
+            except Exception:
+                probe['title'] = url
+                return probe
+            # keep only what is stored, so a grid looks the same whether it was just built or not
+            probe['grid'] = CachedGrid.save(key, grid)
+    finally:
+        with _netcdf_lock:
+            nc.close()
+    probe['valid'] = True
+    return probe
+
+
+class ProbePool():
+    '''
+    Worker processes running probe_dap_url, so that endpoints are really probed side by side.
+    The processes are started on first use, by a fork server that has loaded this module once.
+    Use as a context manager, or call close().
+    Inputs:
+        - max_workers (int) - number of probes run at the same time
+    '''
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                context = multiprocessing.get_context(method)
+                if method == 'forkserver':
+                    context.set_forkserver_preload([__name__])
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._executor
+
+    def probe(self, url, target, deadline=None):
+        '''
+        Runs probe_dap_url(url, target) in a worker process
+        Input:
+            - url (string)
+            - target (list(strings)) - standard names to look for
+            - deadline (remote.Deadline) - time budget for the probe; a probe that runs out of
+              time is abandoned, not stopped
+        Output:
+            - as for probe_dap_url; raises TimeoutError if the deadline passes first
+        '''
+        if deadline is not None and deadline.expired:
+            raise TimeoutError('the {} s deadline has passed'.format(deadline.seconds))
+        future = self._pool().submit(probe_dap_url, url, list(target))
+        try:
+            return future.result(timeout=None if deadline is None else deadline.remaining())
+        except FutureTimeout:
+            future.cancel()
+            raise TimeoutError('the {} s deadline has passed'.format(deadline.seconds))
+
+    def close(self):
+        '''
+        Lets the workers go, without waiting for probes that were abandoned
+        '''
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,240 @@
+'''
+Lightweight instrumentation. The loaders and DataScraper mark their stages as
+spans; while a Tracer is active every span records its wall time, the bytes
+and rows it handled and, optionally, the peak Python memory of the process
+while the outermost span of the main thread was open. With no Tracer active a
+span costs next to nothing.
+
+Turn it on around a piece of code:
+
+    with tracing('run.trace.json'):
+        make_CTD_dataframe()
+
+or for a whole process, without touching the code, by setting the environment
+variable OHW_LTER_VIS_TRACE to the file to write when the process exits, or to
+1 to only collect spans (see current_tracer). OHW_LTER_VIS_TRACE_MEMORY=1 adds
+memory tracking. Traces are written in the Chrome trace format (open them in
+chrome://tracing or https://ui.perfetto.dev), or as a plain JSON list of spans
+for file names ending in .spans.json.
+'''
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# the active tracers, innermost last; spans go to the innermost
+_tracers = []
+
+
+class Span():
+    '''
+    One timed stage. Counters are added to while the span is open.
+    '''
+
+    def __init__(self, name, category, attrs):
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.bytes = 0
+        self.rows = 0
+        self.peak_memory = None
+
+    def add(self, bytes=0, rows=0):
+        '''
+        Counts bytes transferred and rows parsed
+        '''
+        self.bytes += bytes
+        self.rows += rows
+
+
+class _NoSpan():
+
+    def add(self, bytes=0, rows=0):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer():
+    '''
+    Collects the spans of everything run while it is active (see tracing).
+    Inputs:
+        - memory (boolean) - also record the peak traced memory, using tracemalloc. The peak is that
+          of the whole process, so it is only recorded for the outermost spans of the main thread
+          (peak_memory is None for the others). This slows Python allocations down noticeably.
+    '''
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._started_tracemalloc = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        _tracers.append(self)
+
+    def stop(self):
+        if self in _tracers:
+            _tracers.remove(self)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def span(self, name, category='', **attrs):
+        '''
+        Times the code inside the with block as a span
+        Input:
+            - name (string) - e.g. 'ctd.read_table'
+            - category (string) - e.g. 'ctd', 'csw', 'sos', 'dap', 'http'
+            - attrs - anything else worth keeping, e.g. url=url
+        Output:
+            - Span, to add bytes and rows to
+        '''
+        span = Span(name, category, attrs)
+        stack = self._local.__dict__.setdefault('stack', [])
+        # tracemalloc keeps a single peak for the process, so it is only reset for one span at a time
+        memory = (self.memory and tracemalloc.is_tracing() and len(stack) == 0
+                  and threading.current_thread() is threading.main_thread())
+        if memory:
+            tracemalloc.reset_peak()
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            if memory:
+                span.peak_memory = tracemalloc.get_traced_memory()[1]
+            record = dict(name=name, category=category, start=start - self._origin, duration=end - start,
+                          thread=threading.get_ident(), bytes=span.bytes, rows=span.rows,
+                          peak_memory=span.peak_memory, attrs=attrs)
+            with self._lock:
+                self.spans.append(record)
+
+    def summary(self):
+        '''
+        Output:
+            - pandas.DataFrame with one row per span name: count, seconds (total), bytes, rows and
+              peak_memory (largest)
+        '''
+        df = pd.DataFrame(self.spans, columns=['name', 'duration', 'bytes', 'rows', 'peak_memory'])
+        return df.groupby('name').agg(count=('duration', 'size'), seconds=('duration', 'sum'),
+                                      bytes=('bytes', 'sum'), rows=('rows', 'sum'),
+                                      peak_memory=('peak_memory', 'max')).sort_values('seconds', ascending=False)
+
+    def to_json(self, path):
+        '''
+        Writes the spans as a JSON list, times in seconds from the start of the tracer
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.spans, f, indent=1, default=str)
+
+    def to_chrome_trace(self, path):
+        '''
+        Writes the spans in the Chrome trace event format
+        '''
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = dict(span['attrs'], bytes=span['bytes'], rows=span['rows'])
+            if span['peak_memory'] is not None:
+                args['peak_memory'] = span['peak_memory']
+            events.append(dict(name=span['name'], cat=span['category'] or 'default', ph='X', pid=pid,
+                               tid=span['thread'], ts=span['start'] * 1e6, dur=span['duration'] * 1e6,
+                               args=dict((k, v if isinstance(v, (int, float, str, bool)) or v is None else str(v))
+                                         for k, v in args.items())))
+        with open(path, 'w') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+    def save(self, path, format=None):
+        '''
+        Writes the spans to path, as a Chrome trace unless format is 'json'
+        '''
+        if format == 'json':
+            self.to_json(path)
+        else:
+            self.to_chrome_trace(path)
+
+
+@contextmanager
+def tracing(path=None, memory=False, format='chrome'):
+    '''
+    Collects spans while the with block runs
+    Input:
+        - path (string) - file to write the trace to at the end, None to only keep it in memory
+        - memory (boolean) - also record peak memory per span
+        - format (string) - 'chrome' or 'json'
+    Output:
+        - Tracer
+    '''
+    tracer = Tracer(memory=memory)
+    tracer.start()
+    try:
+        yield tracer
+    finally:
+        tracer.stop()
+        if path is not None:
+            tracer.save(path, format)
+
+
+def current_tracer():
+    '''
+    Output:
+        - the Tracer spans currently go to, or None
+    '''
+    return _tracers[-1] if len(_tracers) > 0 else None
+
+
+@contextmanager
+def span(name, category='', **attrs):
+    '''
+    Marks the with block as a span of the active tracer, if there is one (see Tracer.span)
+    '''
+    if len(_tracers) == 0:
+        yield _NO_SPAN
+        return
+    with _tracers[-1].span(name, category, **attrs) as s:
+        yield s
+
+
+def traced(name, category=''):
+    '''
+    Decorator turning every call of a function into a span
+    '''
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if len(_tracers) == 0:
+                return func(*args, **kwargs)
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _trace_from_environment():
+    path = os.environ.get('OHW_LTER_VIS_TRACE')
+    if not path:
+        return
+    tracer = Tracer(memory=os.environ.get('OHW_LTER_VIS_TRACE_MEMORY', '') not in ('', '0'))
+    tracer.start()
+    if path != '1':
+        atexit.register(tracer.save, path, 'json' if path.endswith('.spans.json') else 'chrome')
+
+
+_trace_from_environment()
@@ -13,19 +13,52 @@ import matplotlib
 import folium
 import shapely.geometry as shpgeom 
 import cartopy.crs as ccrs
-from cartopy.io.img_tiles import StamenTerrain
 from owslib import fes
 from datetime import datetime, timedelta
-from ioos_tools.ioos import fes_date_filter, get_csw_records
-from owslib.csw import CatalogueServiceWeb
+from ioos_tools.ioos import fes_date_filter
+from owslib.csw import CatalogueServiceWeb, CswRecord
+from owslib.etree import etree
 from geolinks import sniff_link
+from functools import lru_cache
 import re
 from itertools import cycle
+from concurrent.futures import ThreadPoolExecutor
 import altair as alt
-from netCDF4 import Dataset
-import gridgeo
 import copy
 import xarray as xr
+import asyncio
+import json
+import os
+import shutil
+import sys
+import warnings
+from collections import OrderedDict
+
+# the notebooks import ioos_lib on its own, with the package directory on sys.path; its helpers
+# are then imported through the package, from the directory above
+if __package__:
+    from .cache import CACHE_TTL, get_cache_dir, hash_key, is_fresh
+    from .grids import CachedGrid, ProbePool, grid_fingerprint, probe_dap_url  # noqa: F401
+    from .model_tools import DatasetPool, add_roms_depth, cached_slices, extract_points, regridder, select_roi, find_lonlat
+    from .pipeline import StagedPipeline
+    from .obs_store import ObservationStore, ParquetSink, combine_windows, plan_windows, sos_keys, stream_sos_csv
+    from .remote import Deadline, canonical_url, fetch_concurrently, fetch_report, open_remote
+    from .skill import evaluate_skill
+    from .instrument import span, traced
+    from .standard_names import catalogue_names, fetch_labels, narrow_labels, remember_catalogue_names
+else:
+    _parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if _parent not in sys.path:
+        sys.path.insert(0, _parent)
+    from ohw_lter_vis.cache import CACHE_TTL, get_cache_dir, hash_key, is_fresh
+    from ohw_lter_vis.grids import CachedGrid, ProbePool, grid_fingerprint, probe_dap_url  # noqa: F401
+    from ohw_lter_vis.model_tools import DatasetPool, add_roms_depth, cached_slices, extract_points, regridder, select_roi, find_lonlat
+    from ohw_lter_vis.pipeline import StagedPipeline
+    from ohw_lter_vis.obs_store import ObservationStore, ParquetSink, combine_windows, plan_windows, sos_keys, stream_sos_csv
+    from ohw_lter_vis.remote import Deadline, canonical_url, fetch_concurrently, fetch_report, open_remote
+    from ohw_lter_vis.skill import evaluate_skill
+    from ohw_lter_vis.instrument import span, traced
+    from ohw_lter_vis.standard_names import catalogue_names, fetch_labels, narrow_labels, remember_catalogue_names
 
 class DataScraper():
     '''
@@ -36,15 +69,37 @@ class DataScraper():
         - stop (datetime) - stop date of the temporal range to study
         - target (list(strings)) - the labels to filter for
         - models_only (boolean) - flag for scraping for observational or model data
+        - cache_ttl (float) - seconds for which catalogue results cached on disk are reused (0 to disable)
+        - csw_endpoint (string) - the catalogue to search, DataScraper.csw_endpoint by default
+          (e.g. a fake_ioos.FakeIOOS server for testing)
+        - run_timeout (float) - time budget in seconds for each run (get_records, get_observations, discover,
+          resume, open_models, ...), counted from the start of the run. Endpoints still working when it
+          runs out are abandoned. None for no limit.
     '''
 
-    def __init__(self, roi, start, stop, target=None, models_only=False):
+    # the catalogue searched by default
+    csw_endpoint = 'https://data.ioos.us/csw'
+
+    # outcome of get_models probes, keyed by (url, target), shared by all scrapers
+    _dap_probes = {}
+
+    def __init__(self, roi, start, stop, target=None, models_only=False, cache_ttl=CACHE_TTL, run_timeout=None,
+                 csw_endpoint=None):
         self.roi = roi
         self.min_lon, self.max_lon, self.min_lat, self.max_lat = roi[0], roi[1], roi[2], roi[3]
         self.start = start
         self.stop = stop
         self.target = target
         self.models = models_only
+        self.cache_ttl = cache_ttl
+        self.run_timeout = run_timeout
+        if csw_endpoint is not None:
+            self.csw_endpoint = csw_endpoint
+        # the catalogue client of the last search; None when the records came from the cache
+        self.csw = None
+        self.pool = DatasetPool()
+        # the last step completed: None, 'records', 'database', 'observations' or 'models'
+        self.stage = None
 
         # Make the filter
         self.make_bbox()
@@ -54,6 +109,8 @@ class DataScraper():
         '''
         Helper function for seeing the region of interest being queried
         '''
+        # newer cartopy releases dropped the Stamen tiles, so only ask for them when drawing
+        from cartopy.io.img_tiles import StamenTerrain
 
         fig, ax = plt.subplots(1, figsize=(8,8), subplot_kw={'projection': ccrs.PlateCarree()})
         ax.set_extent((self.min_lon-1, self.max_lon+1, self.min_lat-1, self.max_lat+1))
@@ -122,79 +179,261 @@ class DataScraper():
         '''
         Generates the filter for querying the IOOS database
         '''
+        self.filter_list = self._fes_filter(self.target)
+
+    def _fes_filter(self, labels):
         begin, end = fes_date_filter(self.start, self.stop)
         kw = dict(wildCard='*',escapeChar='\\',singleChar='?',propertyname='apiso:AnyText')
-        if len(self.target) > 1:
-            prop_filt = fes.Or([fes.PropertyIsLike(literal=('*%s*' % val), **kw) for val in self.target])
+        if len(labels) > 1:
+            prop_filt = fes.Or([fes.PropertyIsLike(literal=('*%s*' % val), **kw) for val in labels])
         else:
-            prop_filt = fes.PropertyIsLike(literal=(self.target[0]), **kw)
+            prop_filt = fes.PropertyIsLike(literal=('*%s*' % labels[0]), **kw)
 
         if self.models == True:
-            self.filter_list = [fes.And([self.bbox_crs, begin, end, prop_filt, fes.PropertyIsLike(literal=('*%s*' % 'forecast'), **kw), fes.Not([fes.PropertyIsLike(literal='*cdip',**kw)]),fes.Not([fes.PropertyIsLike(literal='*grib*', **kw)])])]
+            return [fes.And([self.bbox_crs, begin, end, prop_filt, fes.PropertyIsLike(literal=('*%s*' % 'forecast'), **kw), fes.Not([fes.PropertyIsLike(literal='*cdip',**kw)]),fes.Not([fes.PropertyIsLike(literal='*grib*', **kw)])])]
         else:
-            self.filter_list = [fes.And([self.bbox_crs, begin, end, prop_filt, fes.Not([fes.PropertyIsLike(literal='*cdip',**kw)]),fes.Not([fes.PropertyIsLike(literal='*grib*', **kw)])])]
+            return [fes.And([self.bbox_crs, begin, end, prop_filt, fes.Not([fes.PropertyIsLike(literal='*cdip',**kw)]),fes.Not([fes.PropertyIsLike(literal='*grib*', **kw)])])]
+
+    @traced('csw.get_records', 'csw')
+    def get_records(self, pagesize=100, maxrecords=1000, max_workers=4, deadline=None):
+        '''
+        Pulls the catalog of data through the few filter to generate a list of matching records.
+        The records are cached on disk under a hash of the filter, so the same query repeated
+        within self.cache_ttl seconds does not go back to the catalogue.
+        Input:
+            - pagesize (int) - number of records requested per page
+            - maxrecords (int) - upper limit on the number of records retrieved
+            - max_workers (int) - number of pages requested at the same time
+            - deadline (remote.Deadline) - time budget to run in; a new one of run_timeout seconds by default
+        '''
+        if self._cached_records():
+            return
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
+        self.csw = fetch_csw_records(self.csw_endpoint, self._query_filter(), pagesize=pagesize,
+                                     maxrecords=maxrecords, max_workers=max_workers, deadline=deadline)
+        self._set_records(self.csw.records)
+
+    def _query_filter(self):
+        '''
+        The filter sent to the catalogue: self.filter_list, less the labels that earlier searches
+        found no records for and the labels already matched by another label's wildcard. The
+        records found are the same, and are cached under self.filter_list.
+        '''
+        if not self.cache_ttl:
+            return self.filter_list
+        labels = narrow_labels(self.target, *catalogue_names(self._catalogue_key(), self.cache_ttl))
+        return self.filter_list if labels == list(self.target) else self._fes_filter(labels)
+
+    def _catalogue_key(self):
+        # what the catalogue is known to hold depends on where and when is asked for
+        return hash_key(self.csw_endpoint, self.roi, self.start, self.stop, self.models)
+
+    def _records_cache(self):
+        self.cache_key = hash_key(self.csw_endpoint, *[etree.tostring(filt.toXML()) for filt in self.filter_list])
+        return os.path.join(get_cache_dir('csw'), self.cache_key + '.json')
+
+    def _references_cache(self):
+        return os.path.join(get_cache_dir('csw'), self.cache_key + '_references.csv')
 
-    def get_records(self):
+    def _cached_records(self):
         '''
-        Pulls the catalog of data through the few filter to generate a list of matching records
+        Takes the records of this search from the cache, if they are fresh enough
+        Output:
+            - boolean - False if the catalogue has to be asked
+        '''
+        cached = self._records_cache()
+        if not (self.cache_ttl and is_fresh(cached, self.cache_ttl)):
+            return False
+        self.csw = None
+        self.csw_records = load_csw_records(cached)
+        self._records_done()
+        return True
+
+    def _set_records(self, records):
         '''
-        endpoint = 'https://data.ioos.us/csw'
-        self.csw = CatalogueServiceWeb(endpoint, timeout=60)
-        get_csw_records(self.csw, self.filter_list, pagesize=10, maxrecords=1000)
-        self.records= '\n'.join(self.csw.records.keys())
-        print('Found {} records.\n'.format(len(self.csw.records.keys())))
+        Keeps records fresh from the catalogue (self.csw), in the cache too
+        '''
+        self.csw_records = records
+        if self.cache_ttl:
+            save_csw_records(self._records_cache(), records)
+            # a truncated search says nothing about the labels it did not reach
+            matches = self.csw.results.get('matches')
+            if matches is not None and len(records) >= int(matches):
+                remember_catalogue_names(self._catalogue_key(), self.target, records)
+            # the references table built from the old records is now out of date
+            if os.path.exists(self._references_cache()):
+                os.remove(self._references_cache())
+        self._records_done()
+
+    def _records_done(self):
+        self.records= '\n'.join(self.csw_records.keys())
+        self.stage = 'records'
+        print('Found {} records.\n'.format(len(self.csw_records.keys())))
 
     def pretty_print_records(self):
         '''
         Helper function for printing the record names to terminal
         '''
-        for rec in self.csw.records.keys():
+        for rec in self.csw_records.keys():
             print(str(rec)+'\n')
 
+    @traced('csw.create_database', 'csw')
     def create_database(self):
         '''
         Creates a PANDAS dataframe of URLs from which to query data. Checks for geolinking.
+        The same endpoint is often listed under several records, so the table carries a canonical
+        form of each url and is de-duplicated on it; every endpoint is then contacted only once.
+        The table is cached alongside the records it was made from.
         '''
-        df = []
-        for k,v in self.csw.records.items():
-            df.append(pd.DataFrame(v.references))
+        if not self._cached_database():
+            self._set_database([ref for rec in self.csw_records.values() for ref in rec.references])
 
-        df = pd.concat(df, ignore_index=True)
-        df['geolink'] = [sniff_link(url) for url in df['url']]
+    def _cached_database(self):
+        '''
+        Takes the references table from the cache, if it is fresh enough
+        Output:
+            - boolean - False if it has to be built
+        '''
+        cached = self._references_cache()
+        if not (self.cache_ttl and is_fresh(cached, self.cache_ttl)):
+            return False
+        self.df = pd.read_csv(cached)
+        self.stage = 'database'
+        return True
+
+    def _set_database(self, references):
+        '''
+        Builds the references table from the references of the records, in record order
+        '''
+        df = pd.DataFrame(references, columns=['scheme', 'url'])
+        df['canonical'] = [canonical_url(url) for url in df['url']]
+        df = dedupe_references(df)
+        df['geolink'] = [cached_sniff_link(url) for url in df['url']]
         self.df = df
+        self.stage = 'database'
+        if self.cache_ttl:
+            df.to_csv(self._references_cache(), index=False)
 
-    def get_observations(self, silent=True):
+    @traced('sos.get_observations', 'sos')
+    def get_observations(self, silent=True, max_workers=8, per_host=4, chunk=timedelta(days=30), deadline=None):
         '''
-        Accesses the url list from the database and pulls the data. 
+        Accesses the url list from the database and pulls the data. The urls are fetched
+        concurrently, and a per-url report of timings and errors is kept in self.fetch_report.
+        Unless caching is turned off (cache_ttl=0), observations are kept in a local store per
+        station and sensor, and only the parts of the time window not already held are fetched.
+        Long windows are split into chunks that are requested side by side and put back together.
         Input:
             - silent (boolean) Flag for setting whether or not to print the verbose status of the process
+            - max_workers (int) - number of urls to fetch at the same time
+            - per_host (int) - maximum number of simultaneous requests to a single host
+            - chunk (timedelta) - longest time window asked for in a single request (None for no limit)
+            - deadline (remote.Deadline) - time budget to run in; a new one of run_timeout seconds by default
         Output:
             - returns a massive dataframe from all sources
         '''
-        sos_urls = [fix_series(url, self.start, self.stop) for url in self.df.url.values if 'GetObservation' in url and 'text/csv' in url]
-        self.observations = []
-        for url in sos_urls:
-            if silent == False:
-                print('Processing: '+str(url))
-            try:
-                self.observations.append(pd.read_csv(url, index_col='date_time', parse_dates=True))
-            except:
-                pass
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
+        sos_urls = [url for url in self.df.url.values if is_sos_csv(url)]
+        store = ObservationStore(ttl=self.cache_ttl) if self.cache_ttl else None
+        windows = [window for url in sos_urls for window in self._sos_windows(url, store, chunk)]
+        results = fetch_concurrently(lambda url: read_sos_csv(url, deadline=deadline),
+                                     [fix_series(url, lo, hi) for url, lo, hi in windows], max_workers=max_workers,
+                                     per_host=per_host, timeout=deadline.remaining(), span_name='sos.fetch')
+        self.fetch_report = fetch_report(results)
+        if silent == False:
+            for res in results:
+                status = 'ok' if res['error'] is None else 'failed ({!r})'.format(res['error'])
+                print('Processed in {:.1f} s, {}: {}'.format(res['elapsed'], status, res['url']))
+
+        return self._collect_observations(sos_urls, store, [window + (res,) for window, res in zip(windows, results)])
+
+    def _sos_windows(self, url, store, chunk):
+        '''
+        The (url, start, stop) windows to request for an SOS url: the gaps in the local store,
+        or the whole date range without one, split so no single response gets too big for the server
+        '''
+        gaps = store.gaps(*sos_keys(url), self.start, self.stop) if store is not None else [(self.start, self.stop)]
+        return [(url, lo, hi) for gap in gaps for lo, hi in plan_windows(*gap, chunk=chunk)]
+
+    def _collect_observations(self, sos_urls, store, fetched):
+        '''
+        Puts the fetched (url, start, stop, report) windows of each url back together into
+        self.observations, going through the local store if there is one, and returns them in one frame
+        '''
+        pieces = OrderedDict((url, []) for url in sos_urls)
+        for url, lo, hi, res in fetched:
+            if res['error'] is None:
+                pieces[url].append((lo, hi, res['result']))
+        if store is not None:
+            for url, parts in pieces.items():
+                if len(parts) > 0:
+                    store.add(*sos_keys(url), combine_windows([df for lo, hi, df in parts]),
+                              [(lo, hi) for lo, hi, df in parts])
+            self.observations = [store.read(*sos_keys(url), self.start, self.stop) for url in sos_urls]
+        else:
+            self.observations = [combine_windows([df for lo, hi, df in parts]) for parts in pieces.values()]
+        self.observations = [df for df in self.observations if len(df) > 0]
+        self.stage = 'observations'
+        return self._observations_frame()
+
+    def _observations_frame(self):
+        '''
+        Combines the successfully created dataframes into a single frame in one go
+        '''
         if len(self.observations) == 0:
             print('Unfortunately, no valid data targets have been found.')
             return
-
-        # Combine the successfully created dataframes into a single appended frame
-        obs_df = pd.DataFrame()
-        for df in self.observations:
-            obs_df = obs_df.append(df)
-        obs_df['time'] = pd.to_datetime(obs_df.index, infer_datetime_format=True)
+        obs_df = pd.concat(self.observations)
+        obs_df['time'] = pd.to_datetime(obs_df.index)
         return obs_df
 
-    def get_models(self):
+    @traced('sos.stream_observations', 'sos')
+    def stream_observations(self, sink=None, chunksize=50000, max_workers=8, per_host=4, chunk=timedelta(days=30),
+                            deadline=None):
         '''
-        Function for pulling models from the url queries.
+        Like get_observations, but with bounded memory: each SOS response is parsed in chunks that go
+        straight to a sink instead of being kept. Nothing is stored in self.observations.
+        Input:
+            - sink (callable) - called as sink(chunk, url) with every parsed chunk. By default the chunks
+              are written to Parquet files by an obs_store.ParquetSink.
+            - chunksize (int) - rows per chunk
+            - max_workers (int) - number of urls to fetch at the same time
+            - per_host (int) - maximum number of simultaneous requests to a single host
+            - chunk (timedelta) - longest time window asked for in a single request (None for no limit)
+            - deadline (remote.Deadline) - time budget to run in; a new one of run_timeout seconds by default
+        Output:
+            - the sink; a ParquetSink reads the data back lazily with iter_chunks() or read(), and
+              the default one removes its files when closed
+        '''
+        sink = ParquetSink() if sink is None else sink
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
+        sos_urls = [url for url in self.df.url.values if is_sos_csv(url)]
+        urls = [fix_series(url, lo, hi) for url in sos_urls for lo, hi in plan_windows(self.start, self.stop, chunk=chunk)]
+        results = fetch_concurrently(lambda url: stream_sos_csv(url, sink, chunksize=chunksize, deadline=deadline),
+                                     urls, max_workers=max_workers, per_host=per_host, timeout=deadline.remaining(),
+                                     span_name='sos.fetch')
+        self.fetch_report = fetch_report(results)
+        # a response that broke off would leave part of a series behind
+        if hasattr(sink, 'discard'):
+            for res in results:
+                if res['error'] is not None:
+                    sink.discard(res['url'])
+        return sink
+
+    @traced('dap.get_models', 'dap')
+    def get_models(self, max_workers=8, per_host=4, timeout=300, deadline=None):
+        '''
+        Function for pulling models from the url queries. The candidate urls are probed
+        concurrently, in worker processes (see grids.ProbePool), and the outcome of each probe is remembered so that repeated searches
+        skip endpoints that have already been classified. Grid geometry is cached on disk per endpoint
+        (see CachedGrid), so after the first run each endpoint costs a single metadata request.
+        Input:
+            - max_workers (int) - number of urls to probe at the same time
+            - per_host (int) - maximum number of simultaneous requests to a single host
+            - timeout (float) - seconds to wait for the probes before giving up on the stragglers
+              (less if the deadline runs out first)
+            - deadline (remote.Deadline) - time budget to run in; a new one of run_timeout seconds by default
         '''
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
         self.dap_urls = []
         self.grids = {}
         self.model_urls = []
@@ -202,46 +441,378 @@ class DataScraper():
         # Query each url in the database
         for i, df_row in self.df.iterrows():
             row = df_row.to_dict()
-            # Handle the presenece of "opendap" in the NOAA NOS-COOPS obs domain
-            url = row['url']
-            if row['scheme'] == 'OPeNDAP:OPeNDAP' or 'dodsC' in url:
-                if not '.html' in url:
-                    self.dap_urls.append(url)
-    
-        # for the valid URLs, try to pull the data
+            if is_dap(row['url'], row['scheme']):
+                self.dap_urls.append(row['url'])
+
+        # for the valid URLs that haven't been seen before, try to pull the data
+        target = tuple(sorted(self.target))
+        todo = [url for url in self.dap_urls if (url, target) not in self._dap_probes]
+        with ProbePool(min(max_workers, max(len(todo), 1))) as pool:
+            results = fetch_concurrently(lambda url: pool.probe(url, self.target, deadline), todo,
+                                         max_workers=max_workers, per_host=per_host,
+                                         timeout=deadline.remaining(timeout), span_name='dap.probe')
+        self.probe_report = fetch_report(results)
+        self._collect_models(results)
+        self.stage = 'models'
+        print(self.grids)
+
+    def _collect_models(self, results):
+        '''
+        Remembers the outcome of the DAP probes and fills self.model_urls and self.grids,
+        which maps model titles to their CachedGrid
+        '''
+        # Only remember definite answers; unreachable urls get another chance next time
+        target = tuple(sorted(self.target))
+        for res in results:
+            if res['error'] is None:
+                self._dap_probes[(res['url'], target)] = res['result']
+
         for url in self.dap_urls:
-            # Some files may not be in the proper format. Ignore them.
+            probe = self._dap_probes.get((url, target))
+            if probe is not None and probe['valid']:
+                self.model_urls.append(url)
+                self.grids.update({probe['title']: probe['grid']})
+
+    @traced('discover', 'discover')
+    def discover(self, **kwargs):
+        '''
+        Runs the whole search (records, database, observations or models) as one pipeline; see
+        discover_async. From inside a running event loop (e.g. a notebook), await discover_async instead.
+        '''
+        return asyncio.run(self.discover_async(**kwargs))
+
+    async def discover_async(self, pagesize=100, maxrecords=1000, max_workers=8, per_host=4, chunk=timedelta(days=30),
+                             deadline=None):
+        '''
+        Does the work of get_records, create_database and get_observations (or get_models, for
+        models_only scrapers) as one asyncio pipeline. The references of each catalogue page are
+        handed to the observation or model fetchers as soon as the page arrives, so nothing waits
+        for the last page, and the fetches run side by side with at most per_host requests per host.
+        The results end up in the same attributes, and the same caches, as with the separate steps:
+        fresh cached records and references are fed to the fetchers without asking the catalogue.
+        Input:
+            - pagesize (int) - number of records requested per page
+            - maxrecords (int) - upper limit on the number of records retrieved
+            - max_workers (int) - number of fetches running at the same time
+            - per_host (int) - maximum number of simultaneous requests to a single host
+            - chunk (timedelta) - longest time window asked for in a single SOS request
+            - deadline (remote.Deadline) - time budget to run in; a new one of run_timeout seconds by default
+        Output:
+            - the observations as a single dataframe, or None for models_only scrapers
+        '''
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
+        endpoint = self.csw_endpoint
+        filter_list = self._query_filter()
+        store = ObservationStore(ttl=self.cache_ttl) if self.cache_ttl else None
+        target = tuple(sorted(self.target))
+        pages = {}
+        cached = self._cached_records()
+        if cached and not self._cached_database():
+            self._set_database([ref for rec in self.csw_records.values() for ref in rec.references])
+
+        def route(item):
+            if item['stage'] == 'sos' and not self.models:
+                return 'sos'
+            if item['stage'] == 'dap' and self.models and (item['url'], target) not in self._dap_probes:
+                return 'dap'
+
+        async def put_references(references):
+            for ref in references:
+                if is_sos_csv(ref['url']):
+                    for url, lo, hi in self._sos_windows(ref['url'], store, chunk):
+                        await pipe.put(dict(stage='sos', url=fix_series(url, lo, hi), source=url, lo=lo, hi=hi))
+                elif is_dap(ref['url'], ref['scheme']):
+                    await pipe.put(dict(stage='dap', url=ref['url']))
+
+        async def put_page(start, csw):
+            pages[start] = csw
+            await put_references([ref for rec in csw.records.values() for ref in rec.references])
+
+        async def produce(pipe):
+            if cached:
+                await put_references(self.df.to_dict('records'))
+                return
+            first = await pipe.call(deadline.call, fetch_csw_page, endpoint, filter_list, 1,
+                                    min(pagesize, maxrecords))
+            await put_page(1, first)
+
+            async def page(start):
+                csw = await pipe.call(deadline.call, fetch_csw_page, endpoint, filter_list, start,
+                                      min(pagesize, maxrecords - start + 1))
+                await put_page(start, csw)
+            await asyncio.gather(*[page(start) for start in csw_page_starts(first, pagesize, maxrecords)])
+
+            # every page is in: leave the records and references where the step by step methods
+            # would have, in page order whatever order the pages came in
+            records = OrderedDict()
+            for start in sorted(pages):
+                records.update(pages[start].records)
+            self.csw = first
+            self.csw.records = records
+            self._set_records(records)
+            self._set_database([ref for rec in records.values() for ref in rec.references])
+
+        # the same SOS window or DAP endpoint is often listed under several records
+        probes = ProbePool(max_workers)
+        pipe = StagedPipeline({'sos': lambda item: read_sos_csv(item['url'], deadline=deadline),
+                               'dap': lambda item: probes.probe(item['url'], self.target, deadline)},
+                              route, key=lambda item: (canonical_url(item.get('source', item['url'])),
+                                                       item.get('lo'), item.get('hi')),
+                              max_workers=max_workers, per_host=per_host)
+        try:
+            results = await pipe.run(produce)
+        finally:
+            probes.close()
+
+        if self.models:
+            self.dap_urls = [url for url, scheme in zip(self.df['url'], self.df['scheme']) if is_dap(url, scheme)]
+            self.grids = {}
+            self.model_urls = []
+            self.probe_report = fetch_report(results['dap'])
+            self._collect_models(results['dap'])
+            self.stage = 'models'
+            return
+
+        self.fetch_report = fetch_report(results['sos'])
+        sos_urls = [url for url in self.df.url.values if is_sos_csv(url)]
+        fetched = [(res['item']['source'], res['item']['lo'], res['item']['hi'], res) for res in results['sos']]
+        # only urls whose canonical form was kept are collected; their windows were fetched under that form
+        by_canonical = dict((canonical_url(url), url) for url in sos_urls)
+        fetched = [(by_canonical.get(canonical_url(url), url), lo, hi, res) for url, lo, hi, res in fetched]
+        return self._collect_observations(sos_urls, store, fetched)
+
+    def save_state(self, path):
+        '''
+        Writes everything the scraper has found so far to a snapshot directory, without pickling:
+        the settings and url lists as JSON (state.json), the catalogue records as their XML in JSON,
+        the references table and observations as Parquet, and the model grids as WKB. The snapshot
+        is written next to path first, the previous one is moved aside to path.old, and only then is
+        the new one moved into place and the old one deleted, so an interrupted save always leaves a
+        whole snapshot for load_state to find.
+        Input:
+            - path (string) - directory of the snapshot, replaced if it exists
+        '''
+        path = path.rstrip(os.sep)
+        tmp = path + '.partial'
+        old = path + '.old'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        state = dict(version=1, stage=self.stage, roi=list(self.roi), start=self.start.isoformat(),
+                     stop=self.stop.isoformat(), target=self.target, models_only=self.models,
+                     cache_ttl=self.cache_ttl, csw_endpoint=self.csw_endpoint,
+                     cache_key=getattr(self, 'cache_key', None))
+        if hasattr(self, 'csw_records'):
+            save_csw_records(os.path.join(tmp, 'records.json'), self.csw_records)
+        if hasattr(self, 'df'):
+            self.df.to_parquet(os.path.join(tmp, 'references.parquet'), index=False)
+        if hasattr(self, 'observations'):
+            os.makedirs(os.path.join(tmp, 'observations'))
+            for i, df in enumerate(self.observations):
+                df.to_parquet(os.path.join(tmp, 'observations', '{:04d}.parquet'.format(i)))
+            state['observations'] = len(self.observations)
+        if hasattr(self, 'model_urls'):
+            state['dap_urls'] = self.dap_urls
+            state['model_urls'] = self.model_urls
+            state['grids'] = list(self.grids.keys())
+            folder = os.path.join(tmp, 'grids')
+            os.makedirs(folder)
+            for i, grid in enumerate(self.grids.values()):
+                CachedGrid.save('{:04d}'.format(i), grid, folder=folder)
+        with open(os.path.join(tmp, 'state.json'), 'w') as f:
+            json.dump(state, f, indent=1)
+        if os.path.exists(path):
+            shutil.rmtree(old, ignore_errors=True)
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load_state(cls, path, run_timeout=None):
+        '''
+        Rebuilds a scraper from a snapshot written by save_state; call resume() on it to carry on
+        from the last completed step.
+        Input:
+            - path (string) - directory of the snapshot; if a save was interrupted while swapping
+              snapshots, the previous one (path.old) is read instead
+            - run_timeout (float) - time budget for the resumed run, as in DataScraper
+        Output:
+            - DataScraper
+        '''
+        path = path.rstrip(os.sep)
+        if not os.path.exists(os.path.join(path, 'state.json')) and os.path.exists(path + '.old'):
+            path = path + '.old'
+        with open(os.path.join(path, 'state.json')) as f:
+            state = json.load(f)
+        scraper = cls(state['roi'], datetime.fromisoformat(state['start']), datetime.fromisoformat(state['stop']),
+                      state['target'], models_only=state['models_only'], cache_ttl=state['cache_ttl'],
+                      run_timeout=run_timeout, csw_endpoint=state['csw_endpoint'])
+        scraper.stage = state['stage']
+        if state['cache_key'] is not None:
+            scraper.cache_key = state['cache_key']
+        if os.path.exists(os.path.join(path, 'records.json')):
+            scraper.csw_records = load_csw_records(os.path.join(path, 'records.json'))
+            scraper.records = '\n'.join(scraper.csw_records.keys())
+        if os.path.exists(os.path.join(path, 'references.parquet')):
+            scraper.df = pd.read_parquet(os.path.join(path, 'references.parquet'))
+        if 'observations' in state:
+            scraper.observations = [pd.read_parquet(os.path.join(path, 'observations', '{:04d}.parquet'.format(i)))
+                                    for i in range(state['observations'])]
+        if 'model_urls' in state:
+            scraper.dap_urls = state['dap_urls']
+            scraper.model_urls = state['model_urls']
+            folder = os.path.join(path, 'grids')
+            scraper.grids = dict((title, CachedGrid.load('{:04d}'.format(i), folder=folder))
+                                 for i, title in enumerate(state['grids']))
+        return scraper
+
+    def resume(self, checkpoint=None, deadline=None):
+        '''
+        Runs the steps that come after the last completed one: get_records, create_database, and
+        get_observations or get_models, all within one time budget.
+        Input:
+            - checkpoint (string) - snapshot directory to save_state to after every step
+            - deadline (remote.Deadline) - time budget to run in; a new one of run_timeout seconds by default
+        Output:
+            - the observations as a single dataframe, or None for models_only scrapers
+        '''
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
+        steps = ['get_records', 'create_database', 'get_models' if self.models else 'get_observations']
+        done = [None, 'records', 'database'].index(self.stage) if self.stage in (None, 'records', 'database') else 3
+        for step in steps[done:]:
+            if step == 'create_database':
+                self.create_database()
+            else:
+                getattr(self, step)(deadline=deadline)
+            if checkpoint is not None:
+                self.save_state(checkpoint)
+        if not self.models:
+            return self._observations_frame()
+
+    def sample_models(self, param_of_interest, lon, lat, time=None, depth=None, method='nearest', deadline=None):
+        '''
+        Function for pulling model values at a set of stations (e.g. CTD casts) from every model,
+        with one vectorized lookup per model instead of one per station.
+        Input:
+            - param_of_interest (string) - model variable to sample
+            - lon, lat (arrays) - station positions
+            - time (array of datetimes) - station times, matched to the nearest model time
+            - depth (array of floats) - station depths (m) for models with a depth axis, or ROMS
+              models whose s-levels can be put at depths; if None, or for models where depths
+              can't be matched (with a warning), the surface level is used as in open_models
+            - method (string) - 'nearest' or 'bilinear'
+            - deadline (remote.Deadline) - time budget to run in; a new one of run_timeout seconds by default
+        Output:
+            - dict of xarray.DataArray along a 'station' dimension, keyed by model url; models not
+              sampled when the deadline runs out are left out, with a warning
+        '''
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
+        samples = {}
+        for url in self.model_urls:
             try:
-                nc = Dataset(url)
-            except:
+                mod = self.pool.get(url, deadline=deadline)
+            except TimeoutError:
+                warnings.warn('ran out of time before sampling {}'.format(url))
+                break
+            except Exception as err:
+                warnings.warn('could not open {}, skipping it: {!r}'.format(url, err))
                 continue
-            # Some files may not contain relevant information, even after filtering. Ignore them.
-            try:
-                temp = nc.get_variables_by_attributes(standard_name=lambda x: x in self.target)[0]
-                standard_name = temp.standard_name
-            except:
+            if param_of_interest not in mod.variables:
                 continue
-            # Some files may not properly convert to a geo-object. Ignore them.
+            var = add_roms_depth(mod[param_of_interest], mod)
+            at = depth
+            if depth is not None and 'depth' not in var.dims and 'depth_rho' not in var.coords:
+                warnings.warn('{} has no depths to match the stations to; using its surface instead'.format(url))
+                at = None
+            if at is None:
+                var = surface_level(var)
             try:
-                grid = gridgeo.GridGeo(nc, standard_name=standard_name)
-                title = getattr(nc, 'title', url)
-                self.model_urls.append(url)
-            except Exception:
+                samples[url] = deadline.call(extract_points(var, lon, lat, time=time, depth=at, method=method).load)
+            except TimeoutError:
+                warnings.warn('ran out of time before sampling {}'.format(url))
+                break
+        return samples
+
+    def model_skill(self, param_of_interest, obs, obs_column, start=None, stop=None, time_tolerance=timedelta(hours=3),
+                    method='nearest', deadline=None, **columns):
+        '''
+        Function for scoring every model against observations (CTD casts or the output of get_observations)
+        over a date range. Each model is read in a single pass, one time step at a time.
+        Input:
+            - param_of_interest (string) - model variable to score
+            - obs (pandas.DataFrame) - observations with station, time, longitude and latitude columns
+            - obs_column (string) - column of obs holding the values to compare with
+            - start, stop (datetime) - date range to score, the scraper's range by default
+            - time_tolerance (timedelta) - largest allowed gap between an observation and its model time
+            - method (string) - 'nearest' or 'bilinear'
+            - columns - station_col, time_col, lon_col, lat_col and depth_col to override the column
+              names of obs (see skill.evaluate_skill). Without depth_col the model surface is used;
+              with it, models whose depths can't be matched are skipped with a warning.
+            - deadline (remote.Deadline) - time budget to run in; a new one of run_timeout seconds by default
+        Output:
+            - None (in the event of failure)
+            - pandas.DataFrame of n, bias, rmse and corr indexed by model url, station, depth and variable;
+              models not scored when the deadline runs out are left out, with a warning
+        '''
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
+        scores = {}
+        for url in self.model_urls:
+            try:
+                mod = self.pool.get(url, deadline=deadline)
+            except TimeoutError:
+                warnings.warn('ran out of time before scoring {}'.format(url))
+                break
+            except Exception as err:
+                warnings.warn('could not open {}, skipping it: {!r}'.format(url, err))
                 continue
-            self.grids.update({title: grid})
-        print(self.grids)
+            if param_of_interest not in mod.variables:
+                continue
+            var = add_roms_depth(mod[param_of_interest], mod)
+            if columns.get('depth_col') is None:
+                var = surface_level(var)
+            elif 'depth' not in var.dims and 'depth_rho' not in var.coords:
+                warnings.warn('{} has no depths to match the observations to; skipping it'.format(url))
+                continue
+            try:
+                acc = evaluate_skill(var, obs, obs_column, variable=param_of_interest,
+                                     start=self.start if start is None else start,
+                                     stop=self.stop if stop is None else stop,
+                                     time_tolerance=time_tolerance, method=method, deadline=deadline, **columns)
+            except TimeoutError:
+                warnings.warn('ran out of time before scoring {}'.format(url))
+                break
+            scores[url] = acc.result()
 
-    def open_models(self, param_of_interest='salt', date_of_interest=None):
+        if len(scores) == 0:
+            print('Sorry, none of the models have {}.'.format(param_of_interest))
+            return
+        return pd.concat(scores, names=['model'])
+
+    @traced('dap.open_models', 'dap')
+    def open_models(self, param_of_interest='salt', date_of_interest=None, time_tolerance=timedelta(days=1), subset_roi=True,
+                    regrid_to=None, deadline=None):
         '''
         Function for a user to more specifically query for different aspects of the model of interest.
         Assumes that the surface is the more interesting parameter on which to slice the targets.
+        The datasets stay open in self.pool between calls, and the slices are lazy: nothing beyond
+        metadata and coordinates is read until the values are used. Unless caching is turned off
+        (cache_ttl=0), the slices are kept in a local Zarr store and only time steps that have not
+        been pulled in the last cache_ttl seconds are read from the server.
         Input:
             - param_of_interest (string) - label on which to slice the model
             - date_of_interest (datetime) - date on which to query the model values
+            - time_tolerance (timedelta) - how far the nearest model time may be from date_of_interest
+            - subset_roi (boolean) - flag for cutting the slices down to the region of interest
+            - regrid_to (tuple(arrays)) - 1D longitudes and latitudes of a common analysis grid
+              (e.g. from model_tools.nga_grid) to interpolate every slice onto, so they can be
+              stacked and differenced
+            - deadline (remote.Deadline) - time budget for opening the models and filling the cache; a new
+              one of run_timeout seconds by default
         Output:
             - None (in the event of failure)
-            - List of models slices on the input parameters
+            - List of models slices on the input parameters; models not reached when the deadline runs
+              out are left out, with a warning
         '''
+        deadline = Deadline(self.run_timeout) if deadline is None else deadline
         models = []
         if date_of_interest is None:
             date_of_interest = self.start
@@ -249,15 +820,39 @@ class DataScraper():
         # For each model url, open the dataset and check to see if it has the parameters we care about
         for url in self.model_urls:
             try:
-                mod = xr.open_dataset(url)
+                mod = self.pool.get(url, deadline=deadline)
+            except TimeoutError:
+                warnings.warn('ran out of time before opening {}'.format(url))
+                break
             except:
                 continue
-            
-            if param_of_interest in mod.keys() and np.datetime64(date_of_interest) in mod.time.values:
-                if 's_rho' in mod.keys():
-                    models.append(mod[param_of_interest].isel(time=np.where(mod.time.values == np.datetime64(date_of_interest))[0], s_rho=-1))
-                elif 'depth' in mod.keys():
-                    models.append(mod[param_of_interest].isel(time=np.where(mod.time.values == np.datetime64(date_of_interest))[0], depth=1))
+
+            if param_of_interest not in mod.variables or 'time' not in mod[param_of_interest].dims:
+                continue
+            try:
+                var = mod[param_of_interest].sel(time=[np.datetime64(date_of_interest)], method='nearest',
+                                                 tolerance=np.timedelta64(time_tolerance))
+            except KeyError:
+                continue
+
+            var = surface_level(var)
+            if subset_roi:
+                var = select_roi(var, self.roi)
+                # the model doesn't reach the region of interest
+                if var.size == 0:
+                    continue
+            if self.cache_ttl:
+                # steps held past the ttl may have been rewritten by a newer forecast run
+                try:
+                    var = deadline.call(cached_slices, var, key='{} {} {} surface'.format(
+                        url, param_of_interest, self.roi if subset_roi else None), ttl=self.cache_ttl)
+                except TimeoutError:
+                    warnings.warn('ran out of time before caching {}'.format(url))
+                    break
+            if regrid_to is not None:
+                lon_name, lat_name = find_lonlat(var)
+                var = regridder(var[lon_name].values, var[lat_name].values, *regrid_to)(var)
+            models.append(var)
 
         # Inform user that the models are not compatible for the search criteria
         if len(models) == 0:
@@ -283,29 +878,168 @@ def fix_series(url, start, stop):
     new_url = []
     for line in url_split:
         if line.startswith('eventTime='):
-            line = f'eventTime={start:%Y-%m-%dT%H:%m:00}/{stop:%Y-%m-%dT%H:%m:00}'
+            line = f'eventTime={start:%Y-%m-%dT%H:%M:00}/{stop:%Y-%m-%dT%H:%M:00}'
         new_url.append(line)
 
     return "{}?{}".format(new_url[0], '&'.join(new_url[1:]))
 
-def fetch_labels(keyword):
+@lru_cache(maxsize=None)
+def cached_sniff_link(url):
+    '''
+    geolinks.sniff_link, remembered per url
+    '''
+    return sniff_link(url)
+
+def is_sos_csv(url):
+    '''
+    Helper function for spotting SOS GetObservation urls that return CSV
+    '''
+    return 'GetObservation' in url and 'text/csv' in url
+
+def is_dap(url, scheme):
+    '''
+    Helper function for spotting OPeNDAP urls
+    '''
+    # Handle the presenece of "opendap" in the NOAA NOS-COOPS obs domain
+    return (scheme == 'OPeNDAP:OPeNDAP' or 'dodsC' in url) and not '.html' in url
+
+def dedupe_references(df):
+    '''
+    Keeps one row per canonical url of a references table. When the same endpoint is listed
+    under several schemes (e.g. as OPeNDAP and as a plain link), the OPeNDAP or SOS row is the
+    one kept, since that is the one data are read through.
+    Input:
+        - df (pandas.DataFrame) - with the columns scheme, url and canonical, and a default index
+    Output:
+        - pandas.DataFrame, in the original order
+    '''
+    usable = np.array([is_dap(url, scheme) or is_sos_csv(url) for url, scheme in zip(df['url'], df['scheme'])],
+                      dtype=bool)
+    first = df.iloc[np.argsort(~usable, kind='stable')].drop_duplicates('canonical')
+    return first.sort_index().reset_index(drop=True)
+
+def surface_level(var):
+    '''
+    Helper function for picking the level that open_models treats as the surface
+    Input:
+        - var (xarray.DataArray) - model variable
+    Output:
+        - xarray.DataArray
+    '''
+    if 's_rho' in var.dims:
+        return var.isel(s_rho=-1)
+    elif 'depth' in var.dims:
+        return var.isel(depth=1)
+    return var
+
+def fetch_csw_records(endpoint, filter_list, pagesize=100, maxrecords=1000, max_workers=4, timeout=60, deadline=None):
+    '''
+    Pages through a CSW catalogue. The first page also tells us how many records match, so
+    all of the remaining pages can then be requested at the same time. Records are sorted by
+    title on the server and merged in page order, so the result does not depend on which
+    page happens to arrive first.
+    Input:
+        - endpoint (string) - url of the catalogue
+        - filter_list (list) - owslib fes constraints
+        - pagesize (int) - number of records per page
+        - maxrecords (int) - upper limit on the number of records retrieved
+        - max_workers (int) - number of pages requested at the same time
+        - timeout (float) - seconds to wait for each page
+        - deadline (remote.Deadline) - overall budget; a TimeoutError is raised if the pages take longer
+    Output:
+        - the CatalogueServiceWeb of the first page, holding the records of every page (an
+          OrderedDict of CswRecord objects keyed by identifier) in .records
+    '''
+    deadline = Deadline() if deadline is None else deadline
+
+    def fetch_page(startposition):
+        return fetch_csw_page(endpoint, filter_list, startposition, min(pagesize, maxrecords - startposition + 1),
+                              deadline.remaining(timeout))
+
+    # CSW counts records from 1
+    first = deadline.call(fetch_page, 1)
+    records = OrderedDict(first.records)
+    first.records = records
+
+    starts = csw_page_starts(first, pagesize, maxrecords)
+    if len(starts) > 0:
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(starts)))
+        try:
+            for page in pool.map(fetch_page, starts, timeout=deadline.remaining()):
+                records.update(page.records)
+        finally:
+            # pages still queued after a timeout are not wanted any more
+            pool.shutdown(wait=False, cancel_futures=True)
+    return first
+
+def fetch_csw_page(endpoint, filter_list, startposition, pagesize, timeout=60):
+    '''
+    Requests one page of title-sorted records from a CSW catalogue
+    Input:
+        - endpoint (string) - url of the catalogue
+        - filter_list (list) - owslib fes constraints
+        - startposition (int) - position of the first record (counting from 1)
+        - pagesize (int) - number of records
+        - timeout (float) - seconds to wait for the page
+    Output:
+        - CatalogueServiceWeb holding the page in .records and the number of matches in .results
+    '''
+    # every page gets its own client because getrecords2 keeps its results on the object
+    with span('csw.page', 'csw', start=startposition) as s:
+        csw = CatalogueServiceWeb(endpoint, timeout=timeout, skip_caps=True)
+        csw.getrecords2(constraints=filter_list, startposition=startposition, maxrecords=pagesize,
+                        sortby=fes.SortBy([fes.SortProperty('dc:title', 'ASC')]))
+        s.add(bytes=len(csw.response or b''), rows=len(csw.records))
+    return csw
+
+def csw_page_starts(first, pagesize, maxrecords):
+    '''
+    Start positions of the pages that follow a first page of CSW results
+    Input:
+        - first (CatalogueServiceWeb) - the client holding the first page
+        - pagesize (int) - number of records per page
+        - maxrecords (int) - upper limit on the number of records retrieved
+    Output:
+        - list(int)
+    '''
+    matches = min(first.results['matches'], maxrecords)
+    return list(range(1 + pagesize, matches + 1, pagesize))
+
+def save_csw_records(path, records):
+    '''
+    Writes CSW records to a JSON file as their original XML
+    Input:
+        - path (string)
+        - records (dict) - CswRecord objects keyed by identifier, as in CatalogueServiceWeb.records
+    '''
+    records = [[key, rec.xml.decode('utf-8') if isinstance(rec.xml, bytes) else rec.xml]
+               for key, rec in records.items()]
+    with open(path, 'w') as f:
+        json.dump(records, f)
+
+def load_csw_records(path):
+    '''
+    Reads CSW records written by save_csw_records
+    Input:
+        - path (string)
+    Output:
+        - OrderedDict of CswRecord objects keyed by identifier
+    '''
+    with open(path) as f:
+        records = json.load(f)
+    return OrderedDict((key, CswRecord(etree.fromstring(xml.encode('utf-8')))) for key, xml in records)
+
+def read_sos_csv(url, timeout=None, deadline=None):
     '''
-    Helper function for accessing relevant labels in the CF standards
+    Reads the CSV response of an SOS GetObservation request
     Input:
-        - keyword (string) 
+        - url (string)
+        - timeout (float or tuple(float)) - seconds, or (connect, read) seconds, to wait for the server
+        - deadline (remote.Deadline) - overall budget the request has to fit in
     Output:
-        - list(string)
+        - pandas.DataFrame indexed by date_time
     '''
-    if keyword == 'temperature':
-        return ['sea_water_temperature','sea_surface_temperature', 'sea_water_potential_temperature','equivalent_potential_temperature','sea_water_conservative_temperature','pseudo_equivalent_potential_temperature']
-    elif keyword == 'salinity':
-        return ['sea_water_salinity', 'sea_surface_salinity', 'sea_water_absolute_salinity', 'sea_water_cox_salinity', 'sea_water_knudsen_salinity', 'sea_water_practical_salinity', 'sea_water_preformed_salinity']
-    elif keyword == 'oxygen':
-        return ['volume_fraction_of_oxygen_in_sea_water', 'apparent_oxygen_utilization', 'fractional_saturation_of_oxygen_in_sea_water', 'mass_concentration_of_oxygen_in_sea_water', 'mole_concentration_of_dissolved_molecular_oxygen_in_sea_water', 'moles_of_oxygen_per_unit_mass_in_sea_water', 'photolysis_rate_of_molecular_oxygen', 'surface_downward_mole_flux_of_molecular_oxygen']
-    elif keyword == 'co2':
-        return ['tendency_of_atmosphere_moles_of_carbon_dioxide','atmosphere_mass_content_of_carbon_dioxide','atmosphere_mass_of_carbon_dioxide','atmosphere_moles_of_carbon_dioxide','partial_pressure_of_carbon_dioxide_in_sea_water']
-    elif keyword == 'methane':
-        return ['partial_pressure_of_methane_in_sea_water','atmosphere_mass_content_of_methane','atmosphere_mole_content_of_methane','atmosphere_moles_of_methane']
+    return pd.read_csv(open_remote(url, timeout=timeout, deadline=deadline), index_col='date_time', parse_dates=True)
 
 def fetch_dates(start_year, start_month, start_day, duration):
     '''
@@ -12,12 +12,37 @@ Created on Wed Aug 22 16:23:35 2018
 @author: EDobbins
 """
 
+import io
+import os
+import sys
 import pandas as pd
 import csv
-import requests
 
-
-def count_header_lines(url):
+# the notebooks import load_Seward_CTD on its own, with the package directory on sys.path; its helpers
+# are then imported through the package, from the directory above
+if __package__:
+    from .cache import cached_table
+    from .instrument import span, traced
+    from .remote import open_remote, read_text
+else:
+    _parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if _parent not in sys.path:
+        sys.path.insert(0, _parent)
+    from ohw_lter_vis.cache import cached_table
+    from ohw_lter_vis.instrument import span, traced
+    from ohw_lter_vis.remote import open_remote, read_text
+
+# TXS12 file URLs were copied from links in the AOOS portal:
+# https://portal.aoos.org/old/gulf-of-alaska.php#metadata/e25fe1f2-1c98-44f6-856f-5d61c87c0384/project
+TXS12_HEADER = 'https://workspace.aoos.org/published/file/6be0d8f6-5ddc-4ad9-90d3-8a63d5d58752/TXS12.hdr'
+TXS12_DATA = 'https://workspace.aoos.org/published/file/62874c7d-d4ac-4d59-b349-cc402d872d7f/TXS12.ascii'
+
+# cruise name -> (data url, header url). The urls include a hash that cannot be
+# predicted, so other cruises have to be added here by hand.
+CRUISES = {'TXS12': (TXS12_DATA, TXS12_HEADER)}
+
+
+def count_header_lines(url, text=None):
     """ Counts header lines in a CTD file.
     Seward Line CTD files have a variable number of header lines at the top of
     the file.  This function count the header rows by looking for the 'END' string
@@ -25,27 +50,25 @@ def count_header_lines(url):
     
     Args:
         url : the URL of the CTD data file (string)
+        text : the contents of the file, if already downloaded (string)
     Returns:
         the number of header lines that need to be skipped when reading (int)
     """
     
     nhdr=0
-    with requests.Session() as s:
-        download = s.get(url)
-
-        decoded_content = download.content.decode('utf-8')
-
-        cr = csv.reader(decoded_content.splitlines(), delimiter=',')
-        my_list = list(cr)
-        for row in my_list:
-            nhdr+=1
-            if row[0].find('END')>1:  # Warning: I've seen cases with "END" in station name
-                #print(row[0])
-                break
+    decoded_content = read_text(url) if text is None else text
+
+    cr = csv.reader(decoded_content.splitlines(), delimiter=',')
+    my_list = list(cr)
+    for row in my_list:
+        nhdr+=1
+        if row[0].find('END')>1:  # Warning: I've seen cases with "END" in station name
+            #print(row[0])
+            break
     return(nhdr)
 
 
-def get_column_names(url):    # start the list of column headers
+def get_column_names(url, text=None):    # start the list of column headers
     """ Gets column names from the header.
     Seward Line CTD files have a section in the header lines that define
     what the columns are in the file.  This function parses those by
@@ -59,6 +82,7 @@ def get_column_names(url):    # start the list of column headers
     
     Args:
         url : the URL of the CTD data file (string)
+        text : the contents of the file, if already downloaded (string)
     Returns:
         a tuple containing 2 lists of strings:
             the SBE variable names that came from the .cnv files
@@ -69,23 +93,19 @@ def get_column_names(url):    # start the list of column headers
     varnames = []
     vartitles = []
     
-    # with open(datafile, 'r') as csvfile:
-    with requests.Session() as s:
-        download = s.get(url)
-
-        decoded_content = download.content.decode('utf-8')
+    decoded_content = read_text(url) if text is None else text
 
-        cr = csv.reader(decoded_content.splitlines(), delimiter=':')
-        for row in cr:
-            if NAMES and row[0][1] == '%':  # names section ends with row of %
-                break
-            if NAMES:
-                index = row[0].replace('% ', '')   # the first column is the index
-                varnames.append(row[1].strip())
-                vartitles.append(row[-1].strip())
-                if int(index) != len(varnames):    # if the index doesn't match number of variables
-                    print('you gotta problem')
-            if row[0].find('Data File Column Contents')>1: NAMES = True
+    cr = csv.reader(decoded_content.splitlines(), delimiter=':')
+    for row in cr:
+        if NAMES and row[0][1] == '%':  # names section ends with row of %
+            break
+        if NAMES:
+            index = row[0].replace('% ', '')   # the first column is the index
+            varnames.append(row[1].strip())
+            vartitles.append(row[-1].strip())
+            if int(index) != len(varnames):    # if the index doesn't match number of variables
+                print('you gotta problem')
+        if row[0].find('Data File Column Contents')>1: NAMES = True
     
     # before return it, make some variable names like they were before so 
     # notebooks don't break
@@ -97,6 +117,7 @@ def get_column_names(url):    # start the list of column headers
     return (varnames, vartitles)
 
 
+@traced('ctd.load_data', 'ctd')
 def load_data(url):
     """  Reads data from an online CSV into a pandas dataframe.  
     Note: the columns 
@@ -116,13 +137,19 @@ def load_data(url):
 #           'altimeter', 'latitude', 'longitude', 'density', 'density2',
 #           'salinity', 'salinity2', 'nbin', 'flag']
     
-    # Get some data from the header lines that are used as arguments to read 
-    nhdr = count_header_lines(url)
-    (colnames, vartitles) = get_column_names(url)
+    # Download once, then get some data from the header lines that are used as arguments to read
+    text = read_text(url)
+    with span('ctd.parse_header', 'ctd'):
+        nhdr = count_header_lines(url, text)
+        (colnames, vartitles) = get_column_names(url, text)
 
-    return pd.read_table(url, skiprows=nhdr, names=colnames, delim_whitespace=True)
+    with span('ctd.read_table', 'ctd') as s:
+        data = pd.read_table(io.StringIO(text), skiprows=nhdr, names=colnames, sep=r'\s+')
+        s.add(rows=len(data))
+    return data
 
 
+@traced('ctd.load_header', 'ctd')
 def load_header(url):
     """ Reads station information into a pandas dataframe.
     Read station information from an online CSV (called a header file) and put
@@ -141,12 +168,12 @@ def load_header(url):
            'agency', 'region', 'junk2']
     
     # read the data and set the index
-    hdata = pd.read_csv(url, delimiter=',', names=hcolnames)
+    hdata = pd.read_csv(open_remote(url), delimiter=',', names=hcolnames)
     hdata = hdata.set_index('id')
     return hdata
 
 
-def make_CTD_dataframe():
+def make_CTD_dataframe(dataurl=TXS12_DATA, hdrurl=TXS12_HEADER):
     """ Returns CTD data from the Seward Line.
     Read data and station info from online CSV files and combines them into 
     to make a single pandas dataframes.
@@ -156,28 +183,44 @@ def make_CTD_dataframe():
      other years by recording all the required URLs.
     
     Args:
-        none
+        dataurl : the URL (or local path) of the CTD data file, TXS12 by default (string)
+        hdrurl : the URL (or local path) of the matching header file (string)
     Returns:
         a pandas.DataFrame that combines the CTD data and station information
     """
 
-    # data file URLs were copied from links in the AOOS portal:
-    # https://portal.aoos.org/old/gulf-of-alaska.php#metadata/e25fe1f2-1c98-44f6-856f-5d61c87c0384/project
-    hdrurl = 'https://workspace.aoos.org/published/file/6be0d8f6-5ddc-4ad9-90d3-8a63d5d58752/TXS12.hdr'
-    dataurl = 'https://workspace.aoos.org/published/file/62874c7d-d4ac-4d59-b349-cc402d872d7f/TXS12.ascii'
-
     # load the two separate files
     data= load_data(dataurl)
     hdata = load_header(hdrurl)
 
     # join these two together so that data are associated with positions
-    df = pd.merge(data,hdata, on='id')
-    df['time'] = pd.to_datetime(df['date'])
-    df = df.drop(columns=['latitude_x','longitude_x'])
-    df = df.rename(columns={'latitude_y':'latitude','longitude_y': 'longitude'})
+    with span('ctd.merge', 'ctd') as s:
+        df = pd.merge(data,hdata, on='id')
+        df['time'] = pd.to_datetime(df['date'])
+        df = df.drop(columns=['latitude_x','longitude_x'])
+        df = df.rename(columns={'latitude_y':'latitude','longitude_y': 'longitude'})
+        s.add(rows=len(df))
     return df
 
 
+def load_cruise(cruise='TXS12', refresh=False):
+    """ Returns CTD data for one of the known cruises, fetching it only once.
+    The first call downloads and parses the files like make_CTD_dataframe and
+    keeps the result as a Parquet table in the cache; later calls (and other
+    machines given the same cache, see the ohw-lter-vis command) read the table,
+    unless the urls of the cruise in CRUISES have changed since.
+
+    Args:
+        cruise : a key of CRUISES, e.g. 'TXS12' (string)
+        refresh : download and parse the files again (boolean)
+    Returns:
+        a pandas.DataFrame, as from make_CTD_dataframe
+    """
+    dataurl, hdrurl = CRUISES[cruise]
+    return cached_table('ctd/' + cruise, lambda: make_CTD_dataframe(dataurl, hdrurl), refresh,
+                        source=[dataurl, hdrurl])
+
+
 def main():
     make_CTD_dataframe()
 
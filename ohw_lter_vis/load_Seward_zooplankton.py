@@ -12,10 +12,28 @@ Created on Wed Aug 22 16:23:35 2018
 """
 
 #import the necessary libraries
+import os
+import sys
 import pandas as pd
 from datetime import datetime
 
-def make_zooplankton_dataframe(year=None):
+# the notebooks import load_Seward_zooplankton on its own, with the package directory on sys.path; its helpers
+# are then imported through the package, from the directory above
+if __package__:
+    from .cache import cached_table
+    from .instrument import span
+    from .remote import open_remote
+else:
+    _parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if _parent not in sys.path:
+        sys.path.insert(0, _parent)
+    from ohw_lter_vis.cache import cached_table
+    from ohw_lter_vis.instrument import span
+    from ohw_lter_vis.remote import open_remote
+
+ZOOPLANKTON_URL = 'https://workspace.aoos.org/published/file/6c544f8c-6662-4298-bdcf-52029d113c61/Seward_ZooData_Calvet_2012-2016_final.csv'
+
+def make_zooplankton_dataframe(year=None, dataurl=ZOOPLANKTON_URL):
     """ Makes a pandas dataframe from zooplankton data.
     Will collect the CSV file from a URL, clean it, and put it in a pandas 
     DataFrame for use in further visualization.
@@ -23,14 +41,17 @@ def make_zooplankton_dataframe(year=None):
     Args:
         year : int (optional) Limit the return dataframe to a single year
                Must be in the 2012 - 2016 timeframe
+        dataurl : the URL (or local path) of the zooplankton CSV (string)
     Returns:
         a pandas.DataFrame that is the cleaned zooplankton abundance
     """
        
     # read the data
-    dataurl = 'https://workspace.aoos.org/published/file/6c544f8c-6662-4298-bdcf-52029d113c61/Seward_ZooData_Calvet_2012-2016_final.csv'
-    zooplankton_data = pd.read_csv(dataurl, header=0, index_col=0, 
-                                   encoding='latin_1')
+    source = open_remote(dataurl)
+    with span('zooplankton.read_csv', 'zooplankton') as s:
+        zooplankton_data = pd.read_csv(source, header=0, index_col=0,
+                                       encoding='latin_1')
+        s.add(rows=len(zooplankton_data))
     
     # trim off the excess columns that may appear due the CSV formatting
     keep_columns = zooplankton_data.columns[:32]
@@ -50,14 +71,48 @@ def make_zooplankton_dataframe(year=None):
                                         int(x[1]['Time (hh:mm:ss AM/PM)'].split(':')[1]),
                                         ) for x in zooplankton_data_trimmed.iterrows()]
     
-    # trim by year
+    return select_year(zooplankton_data_trimmed, year)
+
+
+def select_year(zooplankton_data, year=None):
+    """ Limits a zooplankton dataframe to a single year.
+
+    Args:
+        zooplankton_data : a pandas.DataFrame from make_zooplankton_dataframe
+        year : int (optional) Must be in the 2012 - 2016 timeframe
+    Returns:
+        the rows of that year, all of them if no year is given, or None for
+        years outside the dataset
+    """
     if year:
         if 2012 <= int(year) <= 2016:
-            zooplankton_data_trimmed = zooplankton_data_trimmed.groupby('Year').get_group(int(year))
+            zooplankton_data = zooplankton_data.groupby('Year').get_group(int(year))
         else:
             print('That year is not included in the dataset')
-            zooplankton_data_trimmed = None
+            zooplankton_data = None
     
-    return zooplankton_data_trimmed
+    return zooplankton_data
+
+
+def load_zooplankton(year=None, refresh=False, dataurl=None):
+    """ Returns the zooplankton data, fetching the file only once.
+    The first call downloads and cleans the whole file like 
+    make_zooplankton_dataframe and keeps it as a Parquet table in the cache;
+    later calls read the table.
+
+    Args:
+        year : int (optional) Limit the return dataframe to a single year
+        refresh : download and clean the file again (boolean)
+        dataurl : the file to read; a table cached from another file is built
+                  again. None for whichever file is cached, ZOOPLANKTON_URL if
+                  none is (string)
+    Returns:
+        a pandas.DataFrame, as from make_zooplankton_dataframe
+    """
+    build_from = ZOOPLANKTON_URL if dataurl is None else dataurl
+    zooplankton_data = cached_table('zooplankton/calvet',
+                                    lambda: make_zooplankton_dataframe(dataurl=build_from), refresh,
+                                    source=None if dataurl is None else [dataurl])
+    return select_year(zooplankton_data, year)
     
 
@@ -0,0 +1,558 @@
+'''
+Helpers for working with the model output found by ioos_lib.DataScraper.
+Models come on either regular grids (HYCOM style 1D lon/lat) or
+curvilinear ones (ROMS style 2D lon_rho/lat_rho), and the functions here try
+to treat both the same way.
+'''
+
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from .cache import get_cache_dir, hash_key
+
+
+class DatasetPool():
+    '''
+    A least-recently-used pool of open xarray datasets, keyed by url. Reopening a
+    remote dataset means reading all of its metadata again, so it pays to keep a
+    few of them around. Datasets are opened with chunks so nothing but the
+    metadata and coordinates is read until a slice is actually used.
+    Inputs:
+        - maxsize (int) - number of datasets to keep open
+        - chunks (dict) - dask chunks passed to xr.open_dataset
+    '''
+
+    def __init__(self, maxsize=8, chunks=None):
+        self.maxsize = maxsize
+        self.chunks = {'time': 1} if chunks is None else chunks
+        self._datasets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, url):
+        return url in self._datasets
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def get(self, url, deadline=None):
+        '''
+        Returns the open dataset for url, opening it if needed
+        Input:
+            - url (string)
+            - deadline (remote.Deadline) - time budget for opening it; a TimeoutError is raised if it runs out
+        Output:
+            - xarray.Dataset
+        '''
+        with self._lock:
+            if url in self._datasets:
+                self._datasets.move_to_end(url)
+                return self._datasets[url]
+
+        if deadline is None:
+            ds = xr.open_dataset(url, chunks=self.chunks)
+        else:
+            ds = deadline.call(xr.open_dataset, url, chunks=self.chunks)
+        with self._lock:
+            self._datasets[url] = ds
+            self._datasets.move_to_end(url)
+            while len(self._datasets) > self.maxsize:
+                _, oldest = self._datasets.popitem(last=False)
+                oldest.close()
+        return ds
+
+    def close(self):
+        '''
+        Closes every dataset in the pool
+        '''
+        with self._lock:
+            while self._datasets:
+                _, ds = self._datasets.popitem()
+                ds.close()
+
+
+def find_lonlat(obj):
+    '''
+    Finds the longitude and latitude coordinates of a model dataset or variable
+    Input:
+        - obj (xarray.Dataset or xarray.DataArray)
+    Output:
+        - tuple(string) - names of the longitude and latitude coordinates
+    '''
+    names = {}
+    for name, coord in obj.coords.items():
+        units = coord.attrs.get('units', '')
+        standard_name = coord.attrs.get('standard_name', '')
+        if standard_name == 'longitude' or units in ('degrees_east', 'degree_east') or name in ('lon', 'longitude', 'lon_rho'):
+            names.setdefault('lon', name)
+        elif standard_name == 'latitude' or units in ('degrees_north', 'degree_north') or name in ('lat', 'latitude', 'lat_rho'):
+            names.setdefault('lat', name)
+    if len(names) != 2:
+        raise ValueError('Could not find longitude and latitude coordinates in {}'.format(list(obj.coords)))
+    return names['lon'], names['lat']
+
+
+def select_roi(obj, roi):
+    '''
+    Slices a model dataset or variable down to a region of interest. Only the
+    coordinates are read; the data stays lazy.
+    Input:
+        - obj (xarray.Dataset or xarray.DataArray)
+        - roi (list(floats)) - (min_lon, max_lon, min_lat, max_lat)
+    Output:
+        - the same type as obj, covering the smallest index box that holds the roi
+    '''
+    min_lon, max_lon, min_lat, max_lat = roi
+    lon_name, lat_name = find_lonlat(obj)
+    lon = obj[lon_name].values
+    lat = obj[lat_name].values
+    # some models (HYCOM) count longitude from 0 to 360
+    if np.nanmax(lon) > 180:
+        min_lon, max_lon = min_lon % 360, max_lon % 360
+
+    if lon.ndim == 1:
+        indexers = {}
+        for name, values, lo, hi in ((lon_name, lon, min_lon, max_lon), (lat_name, lat, min_lat, max_lat)):
+            idx = np.where((values >= lo) & (values <= hi))[0]
+            indexers[obj[name].dims[0]] = slice(idx.min(), idx.max() + 1) if len(idx) else slice(0, 0)
+        return obj.isel(**indexers)
+
+    # curvilinear grids: keep the rows and columns that touch the roi
+    inside = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+    ydim, xdim = obj[lon_name].dims
+    rows = np.where(inside.any(axis=1))[0]
+    cols = np.where(inside.any(axis=0))[0]
+    if len(rows) == 0:
+        return obj.isel(**{ydim: slice(0, 0), xdim: slice(0, 0)})
+    return obj.isel(**{ydim: slice(rows.min(), rows.max() + 1), xdim: slice(cols.min(), cols.max() + 1)})
+
+
+class GridLocator():
+    '''
+    Turns longitude/latitude positions into fractional (row, column) indices of a
+    model grid. Regular grids are searched along each axis; curvilinear grids use
+    a KD-tree to find the nearest grid point and then invert the local cell
+    geometry to get the fractional position inside the cell.
+    Inputs:
+        - lon (numpy.ndarray) - 1D (regular) or 2D (curvilinear) grid longitudes
+        - lat (numpy.ndarray) - grid latitudes, same layout as lon
+    '''
+
+    def __init__(self, lon, lat):
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.east360 = np.nanmax(self.lon) > 180
+        if self.lon.ndim == 2:
+            self.shape = self.lon.shape
+            # squash longitude so distances in the tree are roughly isotropic
+            self.coslat = np.cos(np.deg2rad(np.nanmean(self.lat)))
+            good = np.isfinite(self.lon) & np.isfinite(self.lat)
+            self.points = np.flatnonzero(good)
+            self.tree = cKDTree(np.column_stack([self.lon[good] * self.coslat, self.lat[good]]))
+        else:
+            self.shape = (len(self.lat), len(self.lon))
+
+    def locate(self, lon, lat):
+        '''
+        Input:
+            - lon (array like) - point longitudes
+            - lat (array like) - point latitudes
+        Output:
+            - tuple(numpy.ndarray) - fractional row and column indices, NaN outside the grid
+        '''
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        if self.east360:
+            lon = lon % 360
+        if self.lon.ndim == 1:
+            return _axis_position(self.lat, lat), _axis_position(self.lon, lon)
+
+        ny, nx = self.shape
+        _, nearest = self.tree.query(np.column_stack([lon * self.coslat, lat]))
+        j, i = np.unravel_index(self.points[nearest], self.shape)
+        # one-sided differences across the cell the nearest point belongs to
+        i0 = np.clip(i, 0, nx - 2)
+        j0 = np.clip(j, 0, ny - 2)
+        dlon_di = self.lon[j, i0 + 1] - self.lon[j, i0]
+        dlat_di = self.lat[j, i0 + 1] - self.lat[j, i0]
+        dlon_dj = self.lon[j0 + 1, i] - self.lon[j0, i]
+        dlat_dj = self.lat[j0 + 1, i] - self.lat[j0, i]
+        rlon = lon - self.lon[j, i]
+        rlat = lat - self.lat[j, i]
+        det = dlon_di * dlat_dj - dlon_dj * dlat_di
+        with np.errstate(divide='ignore', invalid='ignore'):
+            di = (rlon * dlat_dj - rlat * dlon_dj) / det
+            dj = (rlat * dlon_di - rlon * dlat_di) / det
+        fy = j + dj
+        fx = i + di
+        outside = (np.abs(di) > 1) | (np.abs(dj) > 1) | (fx < -0.5) | (fx > nx - 0.5) | (fy < -0.5) | (fy > ny - 0.5)
+        fy[outside] = np.nan
+        fx[outside] = np.nan
+        return np.clip(fy, 0, ny - 1), np.clip(fx, 0, nx - 1)
+
+
+def _axis_position(axis, values):
+    '''
+    Fractional position of values along a monotonic 1D coordinate, NaN outside of it
+    '''
+    order = np.argsort(axis)
+    return np.interp(values, axis[order], order.astype(float), left=np.nan, right=np.nan)
+
+
+# GridLocators are expensive to build for big curvilinear grids, so keep them around
+_locators = OrderedDict()
+
+
+def grid_locator(lon, lat, maxsize=16):
+    '''
+    Returns a (cached) GridLocator for a grid
+    Input:
+        - lon (numpy.ndarray) - grid longitudes
+        - lat (numpy.ndarray) - grid latitudes
+        - maxsize (int) - number of locators to remember
+    Output:
+        - GridLocator
+    '''
+    lon = np.ascontiguousarray(lon, dtype=float)
+    lat = np.ascontiguousarray(lat, dtype=float)
+    key = hash_key(lon.shape, lon.tobytes(), lat.shape, lat.tobytes())
+    if key in _locators:
+        _locators.move_to_end(key)
+    else:
+        _locators[key] = GridLocator(lon, lat)
+        while len(_locators) > maxsize:
+            _locators.popitem(last=False)
+    return _locators[key]
+
+
+def roms_depth(ds):
+    '''
+    Works out the depth of every s-level of a ROMS model from its stretching parameters
+    (h, hc, Cs_r and Vtransform), leaving out the free surface
+    Input:
+        - ds (xarray.Dataset) - ROMS output
+    Output:
+        - xarray.DataArray of depths (m, positive down) on (s_rho, eta_rho, xi_rho),
+          or None if the dataset doesn't have what it takes
+    '''
+    if not all(name in ds.variables for name in ('s_rho', 'h', 'hc', 'Cs_r')):
+        return None
+    h = ds['h'].load()
+    hc = float(ds['hc'])
+    s = ds['s_rho'].load()
+    cs = ds['Cs_r'].load()
+    vtransform = int(ds['Vtransform']) if 'Vtransform' in ds.variables else 1
+    if vtransform == 2:
+        z = h * (hc * s + h * cs) / (hc + h)
+    else:
+        z = hc * s + (h - hc) * cs
+    return (-z).transpose('s_rho', *h.dims).reset_coords(drop=True)
+
+
+def add_roms_depth(var, ds):
+    '''
+    Attaches the depths of the s-levels (see roms_depth) to a ROMS variable as a depth_rho
+    coordinate, which extract_points uses to match station depths
+    Input:
+        - var (xarray.DataArray) - model variable
+        - ds (xarray.Dataset) - the dataset it comes from
+    Output:
+        - xarray.DataArray, unchanged if it has no s_rho levels or their depths are unknown
+    '''
+    if 's_rho' not in var.dims or 'depth_rho' in var.coords:
+        return var
+    depth = roms_depth(ds)
+    if depth is None or not set(depth.dims) <= set(var.dims):
+        return var
+    return var.assign_coords(depth_rho=depth)
+
+
+def _grid_dims(da, lon_name, lat_name):
+    # the (row, column) dimensions of the horizontal grid
+    if da[lon_name].ndim == 2:
+        return da[lon_name].dims
+    return da[lat_name].dims[0], da[lon_name].dims[0]
+
+
+def station_window(da, lon, lat, pad=1):
+    '''
+    Cuts a model variable down to the smallest index box around a set of stations, with
+    pad more grid cells on every side so that bilinear interpolation keeps its corners.
+    Only the coordinates are read; the data stays lazy.
+    Input:
+        - da (xarray.DataArray) - model variable on a regular or curvilinear grid
+        - lon, lat (array like) - station positions
+        - pad (int) - grid cells added around the box
+    Output:
+        - xarray.DataArray, unchanged if none of the stations is on the grid
+    '''
+    lon_name, lat_name = find_lonlat(da)
+    locator = grid_locator(da[lon_name].values, da[lat_name].values)
+    fy, fx = locator.locate(lon, lat)
+    on_grid = np.isfinite(fy) & np.isfinite(fx)
+    if not on_grid.any():
+        return da
+    box = {}
+    for dim, index, size in zip(_grid_dims(da, lon_name, lat_name), (fy[on_grid], fx[on_grid]), locator.shape):
+        box[dim] = slice(max(int(np.floor(index.min())) - pad, 0), min(int(np.ceil(index.max())) + pad + 1, size))
+    return da.isel(**box)
+
+
+def extract_points(da, lon, lat, time=None, depth=None, method='nearest'):
+    '''
+    Pulls model values at many stations in a single vectorized indexing operation,
+    rather than one lookup (and possibly one remote read) per station.
+    Input:
+        - da (xarray.DataArray) - model variable on a regular or curvilinear grid
+        - lon (array like) - station longitudes
+        - lat (array like) - station latitudes
+        - time (array like) - station times, matched to the nearest model time
+        - depth (array like) - station depths (m), matched to the nearest model depth.
+          Only for models with a depth coordinate, or ROMS variables with the depths of
+          their s-levels attached (see add_roms_depth); these are matched to the levels
+          at the grid point nearest each station.
+        - method (string) - 'nearest' or 'bilinear'
+    Output:
+        - xarray.DataArray with a 'station' dimension, NaN for stations off the grid
+    '''
+    if method not in ('nearest', 'bilinear'):
+        raise ValueError("method must be 'nearest' or 'bilinear', not {!r}".format(method))
+    lon_name, lat_name = find_lonlat(da)
+    locator = grid_locator(da[lon_name].values, da[lat_name].values)
+    fy, fx = locator.locate(lon, lat)
+    ydim, xdim = _grid_dims(da, lon_name, lat_name)
+
+    def station(values):
+        return xr.DataArray(np.asarray(values), dims='station')
+
+    indexers = {}
+    if time is not None:
+        times = pd.to_datetime(np.atleast_1d(time))
+        indexers['time'] = station(da.indexes['time'].get_indexer(times, method='nearest'))
+    if depth is not None and 'depth' in da.dims:
+        indexers['depth'] = station(da.indexes['depth'].get_indexer(np.atleast_1d(depth), method='nearest'))
+    elif depth is not None and 'depth_rho' not in da.coords:
+        raise ValueError('{} has no depth coordinate to match station depths to'.format(da.name))
+
+    valid = station(np.isfinite(fy) & np.isfinite(fx))
+    fy = np.where(valid, fy, 0.)
+    fx = np.where(valid, fx, 0.)
+    ny, nx = locator.shape
+    if depth is not None and 'depth' not in da.dims:
+        # s-levels sit at different depths everywhere, so pick each station's level at its nearest grid point
+        levels = da['depth_rho']
+        zdim = levels.dims[0]
+        column = levels.isel({ydim: station(np.rint(fy).astype(int)), xdim: station(np.rint(fx).astype(int))})
+        wanted = station(np.broadcast_to(np.asarray(depth, dtype=float), fy.shape))
+        indexers[zdim] = station(abs(column - wanted).fillna(np.inf).argmin(zdim).values)
+    if method == 'nearest':
+        indexers.update({ydim: station(np.rint(fy).astype(int)), xdim: station(np.rint(fx).astype(int))})
+        return da.isel(**indexers).where(valid)
+
+    y0 = np.clip(np.floor(fy).astype(int), 0, max(ny - 2, 0))
+    x0 = np.clip(np.floor(fx).astype(int), 0, max(nx - 2, 0))
+    wy = station(fy - y0)
+    wx = station(fx - x0)
+    total = 0.
+    weights = 0.
+    for dy, dx, weight in ((0, 0, (1 - wy) * (1 - wx)), (0, 1, (1 - wy) * wx),
+                           (1, 0, wy * (1 - wx)), (1, 1, wy * wx)):
+        corner = dict(indexers)
+        corner.update({ydim: station(np.minimum(y0 + dy, ny - 1)), xdim: station(np.minimum(x0 + dx, nx - 1))})
+        values = da.isel(**corner)
+        # leave land (NaN) corners out and share their weight among the wet ones
+        total = total + (values * weight).fillna(0)
+        weights = weights + weight.where(values.notnull(), 0)
+    return (total / weights).where(valid & (weights > 0))
+
+
+def nga_grid(resolution=0.05, extent=(-154, -142, 58.5, 61.)):
+    '''
+    Makes a regular analysis grid, by default over the NGA LTER study area used by map_ngalter
+    Input:
+        - resolution (float) - grid spacing in degrees
+        - extent (tuple(floats)) - (min_lon, max_lon, min_lat, max_lat)
+    Output:
+        - tuple(numpy.ndarray) - 1D longitudes and latitudes
+    '''
+    min_lon, max_lon, min_lat, max_lat = extent
+    lon = np.arange(min_lon, max_lon + resolution / 2, resolution)
+    lat = np.arange(min_lat, max_lat + resolution / 2, resolution)
+    return lon, lat
+
+
+class Regridder():
+    '''
+    Bilinear interpolation from a model grid onto a regular analysis grid. The
+    weights are worked out once and kept as a sparse matrix, so regridding a
+    time slice is a single matrix product. Use regridder() to get one, which
+    reuses weights already computed for the same pair of grids.
+    Inputs:
+        - src_lon, src_lat (numpy.ndarray) - model grid, 1D (regular) or 2D (curvilinear)
+        - dst_lon, dst_lat (numpy.ndarray) - 1D axes of the analysis grid
+        - weights (scipy.sparse matrix) - precomputed weights, skips the computation
+    '''
+
+    def __init__(self, src_lon, src_lat, dst_lon, dst_lat, weights=None):
+        self.dst_lon = np.asarray(dst_lon, dtype=float)
+        self.dst_lat = np.asarray(dst_lat, dtype=float)
+        if weights is None:
+            weights = self._weights(src_lon, src_lat)
+        self.weights = weights.tocsr()
+
+    def _weights(self, src_lon, src_lat):
+        locator = grid_locator(src_lon, src_lat)
+        ny, nx = locator.shape
+        lon, lat = np.meshgrid(self.dst_lon, self.dst_lat)
+        fy, fx = locator.locate(lon.ravel(), lat.ravel())
+        valid = np.flatnonzero(np.isfinite(fy) & np.isfinite(fx))
+        fy, fx = fy[valid], fx[valid]
+        y0 = np.clip(np.floor(fy).astype(int), 0, max(ny - 2, 0))
+        x0 = np.clip(np.floor(fx).astype(int), 0, max(nx - 2, 0))
+        wy, wx = fy - y0, fx - x0
+        rows, cols, vals = [], [], []
+        for dy, dx, weight in ((0, 0, (1 - wy) * (1 - wx)), (0, 1, (1 - wy) * wx),
+                               (1, 0, wy * (1 - wx)), (1, 1, wy * wx)):
+            rows.append(valid)
+            cols.append(np.minimum(y0 + dy, ny - 1) * nx + np.minimum(x0 + dx, nx - 1))
+            vals.append(weight)
+        shape = (lon.size, ny * nx)
+        return sparse.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=shape)
+
+    def regrid_values(self, values):
+        '''
+        Regrids a numpy array whose last two axes are the model grid. Land (NaN)
+        points are left out and their weight shared among the wet neighbours.
+        Input:
+            - values (numpy.ndarray)
+        Output:
+            - numpy.ndarray whose last two axes are (lat, lon) of the analysis grid
+        '''
+        lead = values.shape[:-2]
+        flat = values.reshape(-1, values.shape[-2] * values.shape[-1]).T
+        wet = np.isfinite(flat)
+        total = self.weights @ np.where(wet, flat, 0.)
+        norm = self.weights @ wet.astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = np.where(norm > 0, total / norm, np.nan)
+        return out.T.reshape(lead + (len(self.dst_lat), len(self.dst_lon)))
+
+    def __call__(self, da):
+        '''
+        Regrids a model variable, lazily if it is backed by dask
+        Input:
+            - da (xarray.DataArray) - on the source grid of this Regridder
+        Output:
+            - xarray.DataArray on the analysis grid with lat and lon dimensions
+        '''
+        lon_name, lat_name = find_lonlat(da)
+        if da[lon_name].ndim == 2:
+            ydim, xdim = da[lon_name].dims
+        else:
+            ydim, xdim = da[lat_name].dims[0], da[lon_name].dims[0]
+        out = xr.apply_ufunc(self.regrid_values, da,
+                             input_core_dims=[[ydim, xdim]], output_core_dims=[['lat', 'lon']],
+                             exclude_dims={ydim, xdim}, dask='parallelized', output_dtypes=[float],
+                             dask_gufunc_kwargs={'output_sizes': {'lat': len(self.dst_lat), 'lon': len(self.dst_lon)}})
+        return out.assign_coords(lat=self.dst_lat, lon=self.dst_lon)
+
+
+# Regridders in memory, keyed by the hash of the source and target grids
+_regridders = OrderedDict()
+
+
+def regridder(src_lon, src_lat, dst_lon, dst_lat, use_disk=True, maxsize=16):
+    '''
+    Returns a Regridder between two grids, reusing weights computed before. Weights
+    are kept in memory and, unless use_disk is False, in the cache directory.
+    Input:
+        - src_lon, src_lat (numpy.ndarray) - model grid, 1D (regular) or 2D (curvilinear)
+        - dst_lon, dst_lat (numpy.ndarray) - 1D axes of the analysis grid
+        - use_disk (boolean) - flag for storing weights on disk
+        - maxsize (int) - number of regridders kept in memory
+    Output:
+        - Regridder
+    '''
+    arrays = [np.ascontiguousarray(a, dtype=float) for a in (src_lon, src_lat, dst_lon, dst_lat)]
+    key = hash_key(*[part for a in arrays for part in (a.shape, a.tobytes())])
+    if key in _regridders:
+        _regridders.move_to_end(key)
+        return _regridders[key]
+
+    path = os.path.join(get_cache_dir('regrid'), key + '.npz') if use_disk else None
+    if path is not None and os.path.exists(path):
+        regrid = Regridder(*arrays, weights=sparse.load_npz(path))
+    else:
+        regrid = Regridder(*arrays)
+        if path is not None:
+            sparse.save_npz(path, regrid.weights)
+    _regridders[key] = regrid
+    while len(_regridders) > maxsize:
+        _regridders.popitem(last=False)
+    return regrid
+
+
+def _zarr_steps(da, times, name, fetched):
+    # the given time steps of da, loaded, with the time they were fetched
+    new = da.sel(time=times).load().to_dataset(name=name)
+    new['fetched'] = ('time', np.full(len(times), fetched))
+    # encodings carried over from the remote netCDF don't apply to zarr
+    for var in new.variables.values():
+        var.encoding = {}
+    return new
+
+
+def cached_slices(da, key, ttl=None):
+    '''
+    Serves the time steps of a (lazy, remote) model selection from a local Zarr
+    store. Time steps the store doesn't have yet are pulled from da and appended,
+    so widening the dates only downloads the new steps. Forecast runs rewrite the
+    steps they overlap, so with a ttl, steps held for longer than that are pulled
+    again and written over.
+    Input:
+        - da (xarray.DataArray) - model selection with a time dimension, e.g. a
+          surface slice over the region of interest
+        - key (string) - identifies the selection (url, variable, roi, level); one store per key.
+          Single values the selection was cut at (e.g. a depth) are added to it.
+        - ttl (float) - seconds a stored step stays valid, None for ever
+    Output:
+        - xarray.DataArray read from the local store
+    '''
+    name = da.name or 'values'
+    levels = sorted((coord, str(values.values)) for coord, values in da.coords.items() if values.ndim == 0)
+    path = os.path.join(get_cache_dir('zarr'), hash_key(key, name, levels) + '.zarr')
+    times = da['time'].values
+    now = time.time()
+    held = np.array([], dtype=times.dtype)
+    if os.path.exists(path):
+        store = xr.open_zarr(path)
+        if 'fetched' in store:
+            held, fetched = store['time'].values, store['fetched'].values
+        else:
+            # written before fetch times were kept, so there's no telling how old it is
+            shutil.rmtree(path)
+
+    if ttl is not None and len(held) > 0:
+        stale = np.flatnonzero((fetched < now - ttl) & np.isin(held, times))
+        if len(stale) > 0:
+            new = _zarr_steps(da, held[stale], name, now)
+            new = new.drop_vars([var for var in new.variables if 'time' not in new[var].dims])
+            for k, i in enumerate(stale):
+                new.isel(time=[k]).to_zarr(path, region={'time': slice(i, i + 1)})
+
+    missing = np.setdiff1d(times, held)
+    if len(missing) > 0:
+        new = _zarr_steps(da, missing, name, now)
+        if len(held) == 0:
+            new.to_zarr(path, mode='w')
+        else:
+            new.to_zarr(path, append_dim='time')
+    return xr.open_zarr(path)[name].sel(time=times)
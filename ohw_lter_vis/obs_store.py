@@ -0,0 +1,386 @@
+'''
+A local store of SOS observations. Each station and sensor (standard name)
+gets its own Parquet file, alongside a record of the time ranges that have
+already been requested from the server. Asking for a wider window then only
+means fetching the gaps.
+'''
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from collections import defaultdict
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .cache import get_cache_dir, hash_key
+from .instrument import span
+from .remote import canonical_url, http_get
+
+# columns that tell the series in one SOS response apart; a row is one time of one series
+SERIES_COLUMNS = ('station_id', 'sensor_id', 'depth (m)')
+
+
+def merge_intervals(intervals):
+    '''
+    Merges overlapping or touching time intervals
+    Input:
+        - intervals (list(tuple)) - (start, stop) pairs
+    Output:
+        - sorted list of non-overlapping (start, stop) pairs
+    '''
+    merged = []
+    for start, stop in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def missing_intervals(start, stop, held):
+    '''
+    Finds the parts of [start, stop] not covered by the held intervals
+    Input:
+        - start, stop (datetime)
+        - held (list(tuple)) - (start, stop) pairs already covered
+    Output:
+        - list of (start, stop) pairs
+    '''
+    gaps = []
+    cursor = start
+    for lo, hi in merge_intervals(held):
+        if hi <= cursor:
+            continue
+        if lo >= stop:
+            break
+        if lo > cursor:
+            gaps.append((cursor, lo))
+        cursor = max(cursor, hi)
+    if cursor < stop:
+        gaps.append((cursor, stop))
+    return gaps
+
+
+def plan_windows(start, stop, chunk=None):
+    '''
+    Splits a time range into consecutive windows no longer than chunk
+    Input:
+        - start, stop (datetime)
+        - chunk (timedelta) - longest window, None for a single window
+    Output:
+        - list of (start, stop) pairs covering [start, stop]
+    '''
+    if chunk is None or stop - start <= chunk:
+        return [(start, stop)]
+    windows = []
+    lo = start
+    while lo < stop:
+        hi = min(lo + chunk, stop)
+        windows.append((lo, hi))
+        lo = hi
+    return windows
+
+
+def combine_windows(frames):
+    '''
+    Puts the responses for consecutive time windows back together. Rows on the
+    window boundaries come back in both neighbours and are kept once: a row is
+    the same when its time and series (SERIES_COLUMNS) are, and the one from the
+    later frame wins, so data fetched again replaces what was there.
+    Input:
+        - frames (list(pandas.DataFrame)) - observations indexed by time, oldest first
+    Output:
+        - pandas.DataFrame in time order
+    '''
+    frames = [df for df in frames if df is not None and len(df) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame()
+    df = pd.concat(frames)
+    index = df.index.name
+    df = df.reset_index()
+    time_col = df.columns[0]
+    df = df.drop_duplicates([time_col] + [col for col in SERIES_COLUMNS if col in df.columns], keep='last')
+    return df.set_index(time_col).rename_axis(index).sort_index(kind='stable')
+
+
+def sos_keys(url):
+    '''
+    Pulls the station and the observed property out of an SOS GetObservation url
+    Input:
+        - url (string)
+    Output:
+        - tuple(string) - (station, standard_name); urls that name no station get one
+          made from a hash of the url, so that they don't end up sharing a file
+    '''
+    query = parse_qs(urlparse(url).query)
+    station = query.get('offering', query.get('procedure', [None]))[0]
+    if station is None:
+        station = 'url-' + hash_key(canonical_url(url))[:16]
+    observed = query.get('observedProperty', ['unknown'])[0]
+    # observed properties often come as full vocabulary urls
+    return station, observed.rstrip('/').split('/')[-1]
+
+
+def _safe(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+
+def _naive_utc(times):
+    times = pd.to_datetime(times)
+    if getattr(times, 'tz', None) is not None:
+        times = times.tz_convert('UTC').tz_localize(None)
+    return times
+
+
+class ObservationStore():
+    '''
+    Parquet files of SOS observations, partitioned by station and standard name,
+    plus the time coverage already held for each of them and when it was fetched.
+    Inputs:
+        - root (string) - directory of the store, inside the cache directory by default
+        - ttl (float) - seconds after which fetched windows are due again (recent
+          observations get corrected and backfilled), None for never
+    '''
+
+    def __init__(self, root=None, ttl=None):
+        self.root = get_cache_dir('sos') if root is None else root
+        self.ttl = ttl
+
+    def _path(self, station, standard_name, ext):
+        folder = os.path.join(self.root, _safe(station))
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, _safe(standard_name) + ext)
+
+    def _windows(self, station, standard_name):
+        # the fetched windows as (start, stop, fetched) with fetched in seconds since the epoch,
+        # leaving out those past the ttl; windows stored without a fetch time count as expired
+        path = self._path(station, standard_name, '.json')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            windows = [(pd.Timestamp(entry[0]), pd.Timestamp(entry[1]), entry[2] if len(entry) > 2 else 0.)
+                       for entry in json.load(f)]
+        if self.ttl is None:
+            return windows
+        return [(lo, hi, fetched) for lo, hi, fetched in windows if fetched >= time.time() - self.ttl]
+
+    def coverage(self, station, standard_name):
+        '''
+        Output:
+            - list of (start, stop) pandas.Timestamps (UTC, without time zone) held and not expired
+        '''
+        return merge_intervals([(lo, hi) for lo, hi, _ in self._windows(station, standard_name)])
+
+    def gaps(self, station, standard_name, start, stop):
+        '''
+        Output:
+            - list of (start, stop) pandas.Timestamps that still have to be fetched
+        '''
+        return missing_intervals(pd.Timestamp(start), pd.Timestamp(stop), self.coverage(station, standard_name))
+
+    def add(self, station, standard_name, df, windows):
+        '''
+        Merges newly fetched observations into the store and marks the windows they
+        were fetched for as covered. Windows reaching into the future are only marked
+        as covered up to now. Both files are written next to their place and moved in,
+        the observations first, so an interrupted add never leaves coverage claiming
+        observations that aren't there.
+        Input:
+            - station (string)
+            - standard_name (string)
+            - df (pandas.DataFrame) - observations indexed by time, may be empty
+            - windows (list(tuple)) - the (start, stop) windows that were requested
+        '''
+        path = self._path(station, standard_name, '.parquet')
+        if df is not None and len(df) > 0:
+            if os.path.exists(path):
+                df = combine_windows([pd.read_parquet(path), df])
+            else:
+                df = combine_windows([df])
+            df.to_parquet(path + '.partial')
+            os.replace(path + '.partial', path)
+
+        now = pd.Timestamp.now('UTC').tz_localize(None)
+        windows = merge_intervals([(pd.Timestamp(lo), min(pd.Timestamp(hi), now)) for lo, hi in windows])
+        # what was fetched before keeps its own fetch time, except where it was fetched again
+        held = [(gap_lo, gap_hi, fetched) for lo, hi, fetched in self._windows(station, standard_name)
+                for gap_lo, gap_hi in missing_intervals(lo, hi, windows)]
+        held = sorted(held + [(lo, hi, time.time()) for lo, hi in windows])
+        path = self._path(station, standard_name, '.json')
+        with open(path + '.partial', 'w') as f:
+            json.dump([[lo.isoformat(), hi.isoformat(), fetched] for lo, hi, fetched in held], f)
+        os.replace(path + '.partial', path)
+
+    def read(self, station, standard_name, start=None, stop=None):
+        '''
+        Output:
+            - pandas.DataFrame of the stored observations between start and stop
+        '''
+        path = self._path(station, standard_name, '.parquet')
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        df = pd.read_parquet(path)
+        times = _naive_utc(df.index)
+        keep = np.ones(len(df), dtype=bool)
+        if start is not None:
+            keep &= times >= pd.Timestamp(start)
+        if stop is not None:
+            keep &= times <= pd.Timestamp(stop)
+        return df[keep]
+
+
+def stream_sos_csv(url, callback, chunksize=50000, timeout=None, deadline=None):
+    '''
+    Reads the CSV response of an SOS GetObservation request piece by piece, handing
+    each piece to callback as soon as it is parsed, so the whole response is never
+    held in memory.
+    Input:
+        - url (string)
+        - callback (callable) - called as callback(chunk, url) with each pandas.DataFrame
+        - chunksize (int) - rows per chunk
+        - timeout (float or tuple(float)) - seconds, or (connect, read) seconds, to wait for the server
+        - deadline (remote.Deadline) - overall budget the request has to fit in
+    Output:
+        - int - number of rows read
+    '''
+    rows = 0
+    with span('sos.stream', 'sos', url=url) as s, \
+            http_get(url, timeout=timeout, deadline=deadline, stream=True) as response:
+        response.raw.decode_content = True
+        for chunk in pd.read_csv(response.raw, index_col='date_time', parse_dates=True, chunksize=chunksize):
+            callback(chunk, url)
+            rows += len(chunk)
+        s.add(bytes=response.raw.tell(), rows=rows)
+    return rows
+
+
+class ParquetSink():
+    '''
+    Writes chunks of observations straight to Parquet files, one file per chunk,
+    and hands them back lazily. Can be passed anywhere a callback(chunk, url) is
+    expected, and is safe to write to from several threads. A temporary directory
+    made by the sink is removed when it is closed (or garbage collected); use it
+    as a context manager to be sure.
+    Inputs:
+        - path (string) - directory for the files, a new temporary one inside the cache by default
+    '''
+
+    def __init__(self, path=None):
+        if path is None:
+            path = tempfile.mkdtemp(dir=get_cache_dir('streams'))
+            self._cleanup = weakref.finalize(self, shutil.rmtree, path, ignore_errors=True)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self._cleanup = None
+        self.path = path
+        self.files = []
+        self.rows = 0
+        self._written = 0
+        self._by_url = defaultdict(list)
+        self._discarded = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __call__(self, chunk, url=None):
+        with self._lock:
+            if url in self._discarded:
+                return
+            name = os.path.join(self.path, 'part-{:06d}.parquet'.format(self._written))
+            self._written += 1
+            self.files.append(name)
+            self.rows += len(chunk)
+            self._by_url[url].append((name, len(chunk)))
+        chunk.to_parquet(name)
+        with self._lock:
+            # the url may have failed while the chunk was being written
+            late = url in self._discarded
+        if late:
+            os.remove(name)
+
+    def __len__(self):
+        return self.rows
+
+    def discard(self, url):
+        '''
+        Drops the chunks of a url, e.g. one whose response broke off half way, and ignores
+        any more chunks from it
+        Input:
+            - url (string)
+        '''
+        with self._lock:
+            self._discarded.add(url)
+            parts = self._by_url.pop(url, [])
+            for name, rows in parts:
+                self.files.remove(name)
+                self.rows -= rows
+        for name, _ in parts:
+            if os.path.exists(name):
+                os.remove(name)
+
+    def close(self):
+        '''
+        Removes the files, if the sink made its own directory for them
+        '''
+        if self._cleanup is not None:
+            self._cleanup()
+            self.files = []
+            self.rows = 0
+
+    def iter_chunks(self, columns=None, batch_size=None):
+        '''
+        Yields the stored chunks one at a time, reading only what is asked for from each file
+        Input:
+            - columns (list(strings)) - only read these columns, and the index; chunks with none of
+              them are skipped
+            - batch_size (int) - yield at most this many rows at a time, whole chunks by default
+        Output:
+            - generator of pandas.DataFrame
+        '''
+        for name in self.files:
+            parquet = pq.ParquetFile(name)
+            schema = parquet.schema_arrow
+            read = None
+            if columns is not None:
+                index = [col for col in (schema.pandas_metadata or {}).get('index_columns', [])
+                         if isinstance(col, str)]
+                read = [col for col in schema.names if col in columns or col in index]
+                if not any(col in columns for col in read):
+                    continue
+            if batch_size is None:
+                batches = [parquet.read(columns=read, use_pandas_metadata=True)]
+            else:
+                batches = (pa.Table.from_batches([batch]).replace_schema_metadata(schema.metadata)
+                           for batch in parquet.iter_batches(batch_size=batch_size, columns=read))
+            for table in batches:
+                df = table.to_pandas()
+                yield df if columns is None else df[[col for col in columns if col in df.columns]]
+
+    def read(self, columns=None, deduplicate=True):
+        '''
+        Reads everything into a single frame; only for when it fits in memory
+        Input:
+            - columns (list(strings)) - only read these columns
+            - deduplicate (boolean) - drop rows returned twice on time window boundaries
+        Output:
+            - pandas.DataFrame
+        '''
+        frames = list(self.iter_chunks(columns))
+        if len(frames) == 0:
+            return pd.DataFrame()
+        if deduplicate:
+            return combine_windows(frames)
+        return pd.concat(frames)
@@ -0,0 +1,110 @@
+'''
+A small asyncio pipeline for discovery work that arrives in pieces. A producer
+(e.g. one paging through a catalogue) puts items into a bounded queue as soon
+as it has them, and a fixed set of workers takes them off the queue and runs
+the blocking fetch for each item's stage in a thread. A full queue holds the
+producer back, and no host ever sees more than per_host requests at once, so
+the whole run takes about as long as its slowest endpoint.
+'''
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .instrument import span
+from .remote import url_host
+
+
+class StagedPipeline():
+    '''
+    Routes items to blocking stage handlers with bounded, per-host concurrency.
+    Inputs:
+        - handlers (dict) - stage name -> callable(item) doing the (blocking) work
+        - route (callable) - item -> stage name, or None to drop the item
+        - key (callable) - item -> key used to drop repeated items, None to keep all
+        - max_workers (int) - number of items worked on at the same time
+        - per_host (int) - maximum number of simultaneous requests to one host
+        - queue_size (int) - number of items waiting before the producer is held back
+    Items are expected to be dicts with a 'url' entry, which decides their host.
+    '''
+
+    def __init__(self, handlers, route, key=None, max_workers=8, per_host=4, queue_size=64):
+        self.handlers = handlers
+        self.route = route
+        self.key = key
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.queue_size = queue_size
+
+    async def call(self, func, *args):
+        '''
+        Runs a blocking function in the pipeline's threads, e.g. from the producer
+        '''
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def put(self, item):
+        '''
+        Hands an item to the workers; waits while the queue is full
+        '''
+        if self.key is not None:
+            key = self.key(item)
+            if key in self._seen:
+                return
+            self._seen.add(key)
+        stage = self.route(item)
+        if stage is not None:
+            await self._queue.put((stage, item))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            stage, item = job
+            host = url_host(item['url'])
+            if host not in self._hosts:
+                self._hosts[host] = asyncio.Semaphore(self.per_host)
+            report = dict(url=item['url'], host=host, item=item, result=None, error=None)
+            async with self._hosts[host]:
+                tic = time.perf_counter()
+                try:
+                    report['result'] = await self.call(self._run, stage, item)
+                except Exception as err:
+                    report['error'] = err
+                report['elapsed'] = time.perf_counter() - tic
+            self.results[stage].append(report)
+
+    def _run(self, stage, item):
+        with span(stage + '.fetch', stage, url=item['url']) as s:
+            result = self.handlers[stage](item)
+            if isinstance(result, (list, pd.DataFrame)):
+                s.add(rows=len(result))
+            return result
+
+    async def run(self, producer):
+        '''
+        Runs producer(pipeline) and works through everything it puts
+        Input:
+            - producer (coroutine function) - takes the pipeline and awaits put() for each item
+        Output:
+            - dict of stage name -> list of reports (url, host, item, result, error, elapsed),
+              in the order the items finished
+        '''
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._hosts = {}
+        self._seen = set()
+        self.results = {stage: [] for stage in self.handlers}
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers + 4)
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.max_workers)]
+        try:
+            await producer(self)
+            for _ in workers:
+                await self._queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self._executor.shutdown(wait=False)
+        return self.results
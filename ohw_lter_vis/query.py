@@ -0,0 +1,190 @@
+'''
+Fast filtered reads of the CTD and zooplankton data. Rather than loading a
+whole cruise and filtering it in pandas, query() hands the filter to Arrow,
+which only opens the files, row groups and columns that can match:
+
+    surface = query('ctd', pressure=0, variables=['temperature', 'salinity'])
+    spring = query('zooplankton', time=('2013-05-01', '2013-06-01'), bbox=(-150, -148, 59, 60))
+
+The data come from query stores kept next to the loaders' tables in the cache
+(see load_cruise and load_zooplankton), rebuilt whenever a table changes. A store
+is split into year=YYYY directories, and each file is sorted and cut into small
+row groups so that the minimum and maximum of every column in a row group, which
+Parquet keeps, rule most of them out: CTD bins are sorted by pressure and then
+time, so a surface slice or a single cruise only touches a few row groups.
+'''
+
+import glob
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .cache import get_cache_dir
+
+# rows per Parquet row group in the stores; smaller groups prune finer but cost more metadata
+ROW_GROUP_SIZE = 4096
+
+# source -> (tables directory, columns always returned, sort order)
+SOURCES = {
+    'ctd': ('ctd', ['time', 'latitude', 'longitude', 'pressure'], ['pressure', 'time']),
+    'zooplankton': ('zooplankton', ['time', 'latitude', 'longitude'], ['time']),
+}
+
+# opened datasets, keyed by store directory; dropped when the store is rebuilt
+_datasets = {}
+
+
+def store_dir(source, root=None):
+    '''
+    Output:
+        - string path of the query store of a source ('ctd' or 'zooplankton')
+    '''
+    root = get_cache_dir() if root is None else root
+    return os.path.join(root, 'stores', source)
+
+
+def write_store(source, name, df, root=None):
+    '''
+    Writes one table (e.g. a cruise) into a query store, replacing what it held for that table
+    Input:
+        - source (string) - 'ctd' or 'zooplankton'
+        - name (string) - the table, e.g. 'TXS12'; one file per year is written under this name
+        - df (pandas.DataFrame) - with a time column
+        - root (string) - cache directory, the usual one by default
+    '''
+    _, _, order = SOURCES[source]
+    folder = store_dir(source, root)
+    for old in glob.glob(os.path.join(folder, 'year=*', name + '.parquet')):
+        os.remove(old)
+    df = df.sort_values(order, kind='stable')
+    for year, part in df.groupby(df['time'].dt.year):
+        os.makedirs(os.path.join(folder, 'year={}'.format(year)), exist_ok=True)
+        path = os.path.join(folder, 'year={}'.format(year), name + '.parquet')
+        table = pa.Table.from_pandas(part, preserve_index=False)
+        pq.write_table(table, path + '.partial', row_group_size=ROW_GROUP_SIZE)
+        os.replace(path + '.partial', path)
+    _datasets.pop(folder, None)
+
+
+def update_stores(root=None):
+    '''
+    Brings the query stores up to date with the tables in the cache
+    Input:
+        - root (string) - cache directory, the usual one by default
+    Output:
+        - list of the tables (source, name) that were (re)written
+    '''
+    root = get_cache_dir() if root is None else root
+    written = []
+    for source, (tables, _, _) in SOURCES.items():
+        folder = store_dir(source, root)
+        for path in sorted(glob.glob(os.path.join(root, 'tables', tables, '*.parquet'))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            stored = glob.glob(os.path.join(folder, 'year=*', name + '.parquet'))
+            if len(stored) == 0 or min(os.path.getmtime(p) for p in stored) < os.path.getmtime(path):
+                write_store(source, name, pd.read_parquet(path), root)
+                written.append((source, name))
+    return written
+
+
+def _dataset(source, root):
+    folder = store_dir(source, root)
+    if folder not in _datasets:
+        if len(glob.glob(os.path.join(folder, 'year=*', '*.parquet'))) == 0:
+            raise ValueError('there is no {} data in {}; load some first (e.g. load_cruise)'.format(source, root))
+        _datasets[folder] = ds.dataset(folder, format='parquet', partitioning='hive')
+    return _datasets[folder]
+
+
+def _between(field, bounds, kind=None):
+    # bounds is (lo, hi) with None for open ends, or a single value to match exactly
+    lo, hi = bounds if isinstance(bounds, (tuple, list)) else (bounds, bounds)
+    if kind == 'time':
+        lo = None if lo is None else pd.Timestamp(lo).to_datetime64()
+        hi = None if hi is None else pd.Timestamp(hi).to_datetime64()
+    expr = None
+    if lo is not None:
+        expr = ds.field(field) >= lo
+    if hi is not None:
+        upper = ds.field(field) <= hi
+        expr = upper if expr is None else expr & upper
+    return expr
+
+
+def make_filter(source, bbox=None, time=None, pressure=None):
+    '''
+    Turns query arguments into an Arrow filter, adding the year partitions a time range covers
+    Input:
+        - as for query
+    Output:
+        - pyarrow.dataset.Expression, or None for no filter
+    '''
+    if pressure is not None and source != 'ctd':
+        raise ValueError('only the CTD data has a pressure to filter on')
+    parts = []
+    if bbox is not None:
+        min_lon, max_lon, min_lat, max_lat = bbox
+        parts += [_between('longitude', (min_lon, max_lon)), _between('latitude', (min_lat, max_lat))]
+    if time is not None:
+        parts.append(_between('time', time, 'time'))
+        lo, hi = time if isinstance(time, (tuple, list)) else (time, time)
+        parts.append(_between('year', (None if lo is None else pd.Timestamp(lo).year,
+                                       None if hi is None else pd.Timestamp(hi).year)))
+    if pressure is not None:
+        parts.append(_between('pressure', pressure))
+    parts = [part for part in parts if part is not None]
+    if len(parts) == 0:
+        return None
+    expr = parts[0]
+    for part in parts[1:]:
+        expr = expr & part
+    return expr
+
+
+def query(source, bbox=None, time=None, pressure=None, variables=None, root=None):
+    '''
+    Reads the rows of a source matching all the given conditions, and only those
+    Input:
+        - source (string) - 'ctd' or 'zooplankton'
+        - bbox (tuple(floats)) - (min_lon, max_lon, min_lat, max_lat)
+        - time (tuple) - (start, stop), anything pandas.Timestamp understands, None for an open end
+        - pressure (float or tuple(floats)) - a pressure (dbar) to match exactly, e.g. 0 for the
+          surface bins, or (min, max); CTD only
+        - variables (list(strings)) - columns wanted besides time, latitude, longitude (and
+          pressure); None for all columns
+        - root (string) - cache directory, the usual one by default
+    Output:
+        - pandas.DataFrame, in the store's order (by pressure and time for the CTD, time for zooplankton)
+    '''
+    if source not in SOURCES:
+        raise ValueError("source must be one of {}, not {!r}".format(sorted(SOURCES), source))
+    update_stores(root)
+    dataset = _dataset(source, root)
+    _, coordinates, _ = SOURCES[source]
+    if variables is None:
+        columns = [name for name in dataset.schema.names if name != 'year']
+    else:
+        columns = coordinates + [name for name in variables if name not in coordinates]
+    return dataset.to_table(columns=columns, filter=make_filter(source, bbox, time, pressure)).to_pandas()
+
+
+def query_plan(source, bbox=None, time=None, pressure=None, root=None):
+    '''
+    Shows how much of a store a query would read, to check that the filter is pushed down
+    Input:
+        - as for query
+    Output:
+        - dict with the numbers of files and row groups in the store, and of those left to read
+    '''
+    update_stores(root)
+    dataset = _dataset(source, root)
+    expr = make_filter(source, bbox, time, pressure)
+    all_files = list(dataset.get_fragments())
+    # partitions are pruned first, then row groups by their statistics
+    files = list(dataset.get_fragments(filter=expr)) if expr is not None else all_files
+    kept = [len(fragment.split_by_row_group(expr, schema=dataset.schema)) for fragment in files]
+    return dict(files=len(all_files), files_read=sum(n > 0 for n in kept),
+                row_groups=sum(fragment.num_row_groups for fragment in all_files), row_groups_read=sum(kept))
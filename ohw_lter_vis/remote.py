@@ -0,0 +1,298 @@
+'''
+Helpers for pulling many remote resources at once. The IOOS services answer
+each request slowly but happily serve several at the same time, so the
+functions here run requests in a bounded pool of worker threads while
+keeping the number of simultaneous requests to any single host in check.
+
+Plain HTTP downloads go through one pooled keep-alive session per host, with
+separate connect and read timeouts, and a Deadline can hold all the requests
+of a run to one overall time budget.
+'''
+
+import io
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from .instrument import span
+
+# (connect, read) seconds allowed to requests that don't ask for anything else
+TIMEOUT = (10, 60)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def url_host(url):
+    '''
+    Helper function for pulling the host name out of a url
+    Input:
+        - url (string)
+    Output:
+        - string (empty for local paths)
+    '''
+    return urlparse(url).netloc.lower()
+
+
+def get_session(url, pool_size=8):
+    '''
+    Returns the shared requests.Session for the host of a url, so that repeated requests
+    to a host reuse its keep-alive connections instead of opening new ones
+    Input:
+        - url (string)
+        - pool_size (int) - connections kept open to the host, used when the session is created
+    Output:
+        - requests.Session
+    '''
+    host = url_host(url)
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def close_sessions():
+    '''
+    Closes all the shared sessions and their connections
+    '''
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+class Deadline():
+    '''
+    An overall time budget shared by all the requests of a run. Requests made after
+    it has passed fail straight away with a TimeoutError, and the ones made before get
+    timeouts no longer than what is left.
+    Inputs:
+        - seconds (float) - length of the budget, None for no limit
+    '''
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.reset()
+
+    def reset(self):
+        '''
+        Starts the budget again from now
+        '''
+        self.end = None if self.seconds is None else time.monotonic() + self.seconds
+
+    @property
+    def expired(self):
+        return self.end is not None and time.monotonic() >= self.end
+
+    def remaining(self, cap=None):
+        '''
+        Output:
+            - float - seconds left, at most cap; None if there is neither a limit nor a cap
+        '''
+        if self.end is None:
+            return cap
+        left = max(0., self.end - time.monotonic())
+        return left if cap is None else min(cap, left)
+
+    def timeout(self, timeout=None):
+        '''
+        The timeout to give a request: timeout, or TIMEOUT, shortened to what is left
+        Input:
+            - timeout (float or tuple(float)) - seconds, or (connect, read) seconds
+        Output:
+            - tuple(float) - (connect, read) seconds
+        '''
+        if self.expired:
+            raise TimeoutError('the {} s deadline has passed'.format(self.seconds))
+        timeout = TIMEOUT if timeout is None else timeout
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return self.remaining(connect), self.remaining(read)
+
+    def call(self, func, *args, **kwargs):
+        '''
+        Runs func(*args, **kwargs) for at most the time that is left. Meant for clients that manage
+        their own connections (OPeNDAP, CSW), which can't be given the deadline directly;
+        a call that runs out of time is abandoned, not stopped.
+        Output:
+            - whatever func returns; raises TimeoutError if the deadline passes first
+        '''
+        if self.end is None:
+            return func(*args, **kwargs)
+        if self.expired:
+            raise TimeoutError('the {} s deadline has passed'.format(self.seconds))
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            return pool.submit(func, *args, **kwargs).result(timeout=self.remaining())
+        except FutureTimeout:
+            raise TimeoutError('the {} s deadline has passed'.format(self.seconds))
+        finally:
+            pool.shutdown(wait=False)
+
+
+def http_get(url, timeout=None, deadline=None, **kwargs):
+    '''
+    GETs a url through the shared session of its host
+    Input:
+        - url (string)
+        - timeout (float or tuple(float)) - seconds, or (connect, read) seconds; TIMEOUT by default
+        - deadline (Deadline) - overall budget the request has to fit in
+        - kwargs - passed on to requests, e.g. stream=True
+    Output:
+        - requests.Response; raises for HTTP errors
+    '''
+    deadline = Deadline() if deadline is None else deadline
+    with span('http.get', 'http', host=url_host(url)) as s:
+        response = get_session(url).get(url, timeout=deadline.timeout(timeout), **kwargs)
+        response.raise_for_status()
+        # streamed bodies are counted by whoever reads them
+        if not kwargs.get('stream', False):
+            s.add(bytes=len(response.content))
+    return response
+
+
+def open_remote(url, timeout=None, deadline=None):
+    '''
+    Downloads a url into memory for readers such as pandas.read_csv. Local paths are
+    handed back untouched.
+    Input:
+        - url (string) - url or local path
+        - timeout, deadline - as for http_get
+    Output:
+        - io.BytesIO with the content, or the local path
+    '''
+    if url_host(url) == '' or os.path.exists(url):
+        return url
+    return io.BytesIO(http_get(url, timeout=timeout, deadline=deadline).content)
+
+
+def read_text(url, timeout=None, deadline=None, encoding='utf-8'):
+    '''
+    Reads a remote (or local) text file in one go
+    Input:
+        - url (string) - url or local path
+        - timeout, deadline - as for http_get
+        - encoding (string)
+    Output:
+        - string
+    '''
+    source = open_remote(url, timeout=timeout, deadline=deadline)
+    if isinstance(source, str):
+        with open(source, encoding=encoding) as f:
+            return f.read()
+    with span('decode', 'parse') as s:
+        s.add(bytes=len(source.getvalue()))
+        return source.getvalue().decode(encoding)
+
+
+def canonical_url(url, drop_params=('eventTime',)):
+    '''
+    Normalizes a url so that different spellings of the same endpoint compare equal:
+    lower case scheme and host, no default port, no fragment or trailing slash, and
+    sorted query parameters. Parameters in drop_params are left out; by default that
+    is the SOS eventTime, which get_observations rewrites anyway.
+    Input:
+        - url (string)
+        - drop_params (tuple(strings)) - query parameters to leave out
+    Output:
+        - string
+    '''
+    parts = urlparse(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = parts.path.rstrip('/') or '/'
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in drop_params)
+    return urlunparse((scheme, netloc, path, parts.params, urlencode(query, safe=':/'), ''))
+
+
+def fetch_concurrently(func, urls, max_workers=8, per_host=4, timeout=None, span_name='fetch'):
+    '''
+    Calls func(url) for every url using a bounded pool of worker threads.
+    Failures are captured rather than raised so that one bad endpoint does
+    not spoil the rest of the batch.
+    Input:
+        - func (callable) - function of a single url that does the fetching
+        - urls (list(strings)) - the urls to fetch
+        - max_workers (int) - number of worker threads
+        - per_host (int) - maximum number of simultaneous requests to one host
+        - timeout (float) - seconds to wait for the whole batch. Urls that have not
+          answered by then are abandoned and reported with a TimeoutError.
+        - span_name (string) - name of the instrument span of each url, e.g. 'sos.fetch'
+    Output:
+        - list(dict) in the same order as urls, each with the keys
+          url, host, result, error and elapsed (seconds)
+    '''
+    locks = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+    for url in urls:
+        locks[url_host(url)]
+
+    def run(url):
+        report = dict(url=url, host=url_host(url), result=None, error=None)
+        with locks[report['host']], span(span_name, span_name.split('.')[0], url=url) as s:
+            tic = time.perf_counter()
+            try:
+                report['result'] = func(url)
+                s.add(rows=_rows(report['result']) or 0)
+            except Exception as err:
+                report['error'] = err
+            report['elapsed'] = time.perf_counter() - tic
+        return report
+
+    if len(urls) == 0:
+        return []
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(urls)))
+    futures = [pool.submit(run, url) for url in urls]
+    done, _ = wait(futures, timeout=timeout)
+    # don't hold the caller up for stragglers that are past the timeout, and don't start
+    # the urls still waiting for a worker
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for url, future in zip(urls, futures):
+        if future in done:
+            results.append(future.result())
+        else:
+            results.append(dict(url=url, host=url_host(url), result=None, elapsed=timeout,
+                                error=TimeoutError('no answer after {} s'.format(timeout))))
+    return results
+
+
+def _rows(result):
+    if isinstance(result, (pd.DataFrame, list)):
+        return len(result)
+    if isinstance(result, int):
+        return result
+    return None
+
+
+def fetch_report(results):
+    '''
+    Summarizes the output of fetch_concurrently as a table
+    Input:
+        - results (list(dict)) - output of fetch_concurrently
+    Output:
+        - pandas.DataFrame with one row per url: host, ok, rows, elapsed, error
+    '''
+    rows = []
+    for res in results:
+        result = res['result']
+        rows.append(dict(url=res['url'],
+                         host=res['host'],
+                         ok=res['error'] is None,
+                         rows=_rows(result),
+                         elapsed=res['elapsed'],
+                         error=None if res['error'] is None else repr(res['error'])))
+    return pd.DataFrame(rows, columns=['url', 'host', 'ok', 'rows', 'elapsed', 'error'])
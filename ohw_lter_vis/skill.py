@@ -0,0 +1,127 @@
+'''
+Model-versus-observation skill over a range of dates. The model is read one
+time step at a time, every observation (CTD casts, SOS time series) is matched
+to the step nearest to it, and the statistics are kept as running sums so a
+whole cruise season can be scored in a single pass over the model output.
+'''
+
+import numpy as np
+import pandas as pd
+
+from .model_tools import extract_points, station_window
+
+
+class SkillAccumulator():
+    '''
+    Running bias, RMSE and correlation between model and observed values, grouped
+    by station, depth and variable. Only sums are stored, so batches of matched
+    values can be added in any order.
+    '''
+
+    keys = ['station', 'depth', 'variable']
+    sums = ['n', 'model', 'obs', 'model2', 'obs2', 'model_obs']
+
+    def __init__(self):
+        self._sums = None
+
+    def update(self, station, depth, variable, model, obs):
+        '''
+        Adds a batch of matched values
+        Input:
+            - station (array like) - station names
+            - depth (array like or float) - observation depths
+            - variable (string or array like) - variable names
+            - model (array like) - model values
+            - obs (array like) - observed values
+        '''
+        frame = pd.DataFrame(dict(station=station, depth=depth, variable=variable,
+                                  model=np.asarray(model, dtype=float), obs=np.asarray(obs, dtype=float)))
+        frame = frame.dropna(subset=['model', 'obs'])
+        if len(frame) == 0:
+            return
+        frame['n'] = 1
+        frame['model2'] = frame['model'] ** 2
+        frame['obs2'] = frame['obs'] ** 2
+        frame['model_obs'] = frame['model'] * frame['obs']
+        sums = frame.groupby(self.keys, dropna=False)[self.sums].sum()
+        self._sums = sums if self._sums is None else self._sums.add(sums, fill_value=0)
+
+    def result(self):
+        '''
+        Output:
+            - pandas.DataFrame indexed by station, depth and variable with the columns
+              n, model_mean, obs_mean, bias, rmse and corr
+        '''
+        if self._sums is None:
+            return pd.DataFrame(columns=['n', 'model_mean', 'obs_mean', 'bias', 'rmse', 'corr'])
+        s = self._sums
+        n = s['n']
+        out = pd.DataFrame(index=s.index)
+        out['n'] = n.astype(int)
+        out['model_mean'] = s['model'] / n
+        out['obs_mean'] = s['obs'] / n
+        out['bias'] = out['model_mean'] - out['obs_mean']
+        out['rmse'] = np.sqrt(np.maximum((s['model2'] - 2 * s['model_obs'] + s['obs2']) / n, 0))
+        cov = n * s['model_obs'] - s['model'] * s['obs']
+        var = (n * s['model2'] - s['model'] ** 2) * (n * s['obs2'] - s['obs'] ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out['corr'] = cov / np.sqrt(var.where(var > 0))
+        return out
+
+
+def evaluate_skill(da, obs, obs_column, variable=None, start=None, stop=None, time_tolerance=None,
+                   method='nearest', accumulator=None, station_col='station', time_col='time',
+                   lon_col='longitude', lat_col='latitude', depth_col=None, deadline=None):
+    '''
+    Scores a model variable against observations over a date range. Every model
+    time step that has observations near it is loaded exactly once.
+    Input:
+        - da (xarray.DataArray) - model variable with a time dimension
+        - obs (pandas.DataFrame) - observations, one row per measurement
+        - obs_column (string) - column of obs holding the observed values
+        - variable (string) - name the statistics are grouped under (obs_column by default)
+        - start, stop (datetime) - date range to score (the whole model by default)
+        - time_tolerance (timedelta) - largest allowed gap between an observation and its model time
+        - method (string) - 'nearest' or 'bilinear' horizontal interpolation
+        - accumulator (SkillAccumulator) - add to an existing accumulator, e.g. across variables
+        - station_col, time_col, lon_col, lat_col (strings) - column names in obs
+        - depth_col (string) - column of obs depths, matched to the model depth axis (or to the
+          depths of ROMS s-levels, see model_tools.add_roms_depth); leave it out to score a
+          single level such as the surface
+        - deadline (remote.Deadline) - time budget for reading the model; a TimeoutError is raised if it
+          runs out, leaving what was scored so far in the accumulator
+    Output:
+        - SkillAccumulator
+    '''
+    if depth_col is not None and 'depth' not in da.dims and 'depth_rho' not in da.coords:
+        raise ValueError('{} has no depths to match {} to; pick a level and leave depth_col out'
+                         .format(da.name, depth_col))
+    acc = SkillAccumulator() if accumulator is None else accumulator
+    variable = obs_column if variable is None else variable
+    times = pd.to_datetime(obs[time_col]) if time_col in obs else pd.to_datetime(obs.index)
+    keep = np.ones(len(obs), dtype=bool)
+    if start is not None:
+        keep &= np.asarray(times >= pd.Timestamp(start))
+    if stop is not None:
+        keep &= np.asarray(times <= pd.Timestamp(stop))
+    obs = obs[keep]
+    times = times[keep]
+    # only the part of the grid around the stations is ever loaded
+    if len(obs) > 0:
+        da = station_window(da, obs[lon_col].values, obs[lat_col].values)
+
+    model_times = da.indexes['time']
+    tolerance = None if time_tolerance is None else pd.Timedelta(time_tolerance)
+    step = model_times.get_indexer(times, method='nearest', tolerance=tolerance)
+
+    # walk through the model in time order, one slice per step that has something to match
+    for k in np.unique(step[step >= 0]):
+        rows = obs[step == k]
+        model_slice = da.isel(time=k)
+        model_slice = model_slice.load() if deadline is None else deadline.call(model_slice.load)
+        values = extract_points(model_slice, rows[lon_col].values, rows[lat_col].values,
+                                depth=None if depth_col is None else rows[depth_col].values, method=method)
+        acc.update(rows[station_col].values,
+                   rows[depth_col].values if depth_col is not None else np.nan,
+                   variable, values.values, rows[obs_column].values)
+    return acc
@@ -0,0 +1,288 @@
+'''
+SQL over everything the loaders have parsed. The Parquet tables kept in the
+cache (see load_cruise, load_zooplankton and the SOS ObservationStore) become
+tables of an embedded database, together with typed views for the usual joins:
+
+    casts       one row per CTD cast, with its header (station, time, position)
+                and the mean temperature and salinity of the cast
+    profiles    every CTD bin with the header of its cast
+    tows        one row per zooplankton taxon per tow
+    tow_cast    every tow row matched to the cast of its cruise nearest in time,
+                with that cast's mean temperature and salinity, as in the demo notebook
+
+With DuckDB installed the tables are views straight over the Parquet files,
+so a filtered aggregate across every cruise only reads the columns and row
+groups it needs and never loads whole tables into pandas:
+
+    with connect() as db:
+        db.sql("SELECT cruise, avg(temperature) FROM profiles WHERE pressure < 10 GROUP BY cruise")
+
+Without DuckDB the same tables and views are built in an in-memory SQLite
+database instead, which has to read the files in full.
+'''
+
+import glob
+import os
+import sqlite3
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from .cache import get_cache_dir
+
+# the way each engine spells the types and time arithmetic used in the views
+DIALECTS = {
+    'duckdb': dict(double='DOUBLE', integer='INTEGER', text='VARCHAR', timestamp='TIMESTAMP',
+                   seconds='epoch({})'),
+    'sqlite': dict(double='REAL', integer='INTEGER', text='TEXT', timestamp='TEXT',
+                   seconds='julianday({}) * 86400'),
+}
+
+# tow_cast ranks the casts of a tow's cruise by how near in time they are to it. DuckDB only ranks
+# two per tow time, the casts just before and after it found by ASOF joins; SQLite, which has no
+# ASOF join, ranks every cast of the cruise. Tows of a cruise without casts get no cast.
+_TOW_CAST = '''
+        WITH tow_times AS (SELECT DISTINCT cruise, time FROM tows),
+             candidates AS ({candidates}),
+             nearest AS (
+                 SELECT tow_cruise, tow_time, cruise AS cast_cruise, cast_id, time AS cast_time,
+                        temperature, salinity,
+                        row_number() OVER (PARTITION BY tow_cruise, tow_time
+                                           ORDER BY abs({{cast_seconds}} - {{tow_seconds}}), time, cast_id) AS nearness
+                 FROM candidates)
+        SELECT tows.*, nearest.cast_cruise, nearest.cast_id, nearest.cast_time,
+               nearest.temperature, nearest.salinity
+        FROM tows
+        LEFT JOIN nearest
+          ON nearest.tow_cruise = tows.cruise AND nearest.tow_time = tows.time AND nearest.nearness = 1'''
+
+# view name -> (tables it needs, SQL, or SQL by engine); the SQL is formatted with a dialect (see create_views)
+VIEWS = {
+    'casts': (('ctd',), '''
+        SELECT CAST(cruise AS {text}) AS cruise, CAST(id AS {integer}) AS cast_id,
+               CAST(station AS {text}) AS station, CAST(time AS {timestamp}) AS time,
+               CAST(latitude AS {double}) AS latitude, CAST(longitude AS {double}) AS longitude,
+               CAST(waterdepth AS {double}) AS waterdepth, CAST(max(pressure) AS {double}) AS max_pressure,
+               CAST(avg(temperature) AS {double}) AS temperature, CAST(avg(salinity) AS {double}) AS salinity,
+               count(*) AS bins
+        FROM ctd
+        GROUP BY cruise, id, station, time, latitude, longitude, waterdepth'''),
+    'profiles': (('ctd',), '''
+        SELECT CAST(cruise AS {text}) AS cruise, CAST(id AS {integer}) AS cast_id,
+               CAST(station AS {text}) AS station, CAST(time AS {timestamp}) AS time,
+               CAST(latitude AS {double}) AS latitude, CAST(longitude AS {double}) AS longitude,
+               CAST(pressure AS {double}) AS pressure, CAST(temperature AS {double}) AS temperature,
+               CAST(salinity AS {double}) AS salinity
+        FROM ctd'''),
+    'tows': (('zooplankton',), '''
+        SELECT CAST("Cruise" AS {text}) AS cruise, CAST("Station" AS {text}) AS station,
+               CAST(time AS {timestamp}) AS time, CAST(latitude AS {double}) AS latitude,
+               CAST(longitude AS {double}) AS longitude, CAST("Tow Depth (m)" AS {double}) AS tow_depth,
+               CAST("Class" AS {text}) AS class, CAST("Genus" AS {text}) AS genus,
+               CAST("Species" AS {text}) AS species,
+               CAST("Abundance (no m-3)" AS {double}) AS abundance
+        FROM zooplankton'''),
+    'tow_cast': (('ctd', 'zooplankton'), {
+        'duckdb': _TOW_CAST.format(candidates='''
+            SELECT tow_times.cruise AS tow_cruise, tow_times.time AS tow_time, casts.*
+            FROM tow_times ASOF JOIN casts ON tow_times.cruise = casts.cruise AND tow_times.time >= casts.time
+            UNION ALL
+            SELECT tow_times.cruise AS tow_cruise, tow_times.time AS tow_time, casts.*
+            FROM tow_times ASOF JOIN casts ON tow_times.cruise = casts.cruise AND tow_times.time <= casts.time'''),
+        'sqlite': _TOW_CAST.format(candidates='''
+            SELECT tow_times.cruise AS tow_cruise, tow_times.time AS tow_time, casts.*
+            FROM tow_times JOIN casts ON tow_times.cruise = casts.cruise'''),
+    }),
+}
+
+
+class Database():
+    '''
+    An embedded SQL database of the loaded data.
+    Inputs:
+        - path (string) - database file, None for an in-memory database
+        - engine (string) - 'duckdb' or 'sqlite'; DuckDB when it is installed by default
+    '''
+
+    def __init__(self, path=None, engine=None):
+        if engine is None:
+            engine = 'sqlite' if duckdb is None else 'duckdb'
+        if engine not in DIALECTS:
+            raise ValueError("engine must be 'duckdb' or 'sqlite', not {!r}".format(engine))
+        if engine == 'duckdb' and duckdb is None:
+            raise ImportError('the duckdb engine needs the duckdb package')
+        self.engine = engine
+        self.dialect = DIALECTS[engine]
+        if engine == 'duckdb':
+            self.con = duckdb.connect(':memory:' if path is None else path)
+        else:
+            self.con = sqlite3.connect(':memory:' if path is None else path)
+        # frames registered with DuckDB are read in place, so they are kept alive here
+        self._frames = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.con.close()
+
+    def sql(self, query, params=None):
+        '''
+        Runs a query
+        Input:
+            - query (string) - SQL, with ? placeholders for params
+            - params (list) - values for the placeholders
+        Output:
+            - pandas.DataFrame (times come back as text from SQLite)
+        '''
+        if self.engine == 'duckdb':
+            return self.con.execute(query, params or []).df()
+        return pd.read_sql_query(query, self.con, params=params)
+
+    def tables(self):
+        '''
+        Output:
+            - sorted list of the tables and views
+        '''
+        if self.engine == 'duckdb':
+            names = self.con.execute('SELECT table_name FROM information_schema.tables').fetchall()
+        else:
+            names = self.con.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')").fetchall()
+        return sorted(name for name, in names)
+
+    def _drop(self, name):
+        for kind in ('VIEW', 'TABLE'):
+            try:
+                self.con.execute('DROP {} IF EXISTS "{}"'.format(kind, name))
+            except Exception:
+                # DuckDB refuses to drop a view as a table and the other way round
+                pass
+        if self.engine == 'duckdb' and name in self._frames:
+            self.con.unregister(name)
+            del self._frames[name]
+
+    def register(self, name, df):
+        '''
+        Makes a DataFrame, e.g. the output of make_CTD_dataframe, available as a table.
+        DuckDB reads it in place; SQLite gets a copy.
+        Input:
+            - name (string)
+            - df (pandas.DataFrame)
+        '''
+        self._drop(name)
+        if self.engine == 'duckdb':
+            self._frames[name] = df
+            self.con.register(name, df)
+        else:
+            df.to_sql(name, self.con, index=False)
+
+    def register_parquet(self, name, files):
+        '''
+        Makes Parquet files with the same columns available as one table. DuckDB reads
+        them in place, only the columns and row groups a query needs; SQLite gets a copy.
+        Input:
+            - name (string)
+            - files (list(strings)) - paths or glob patterns
+        Output:
+            - boolean - False if there were no files
+        '''
+        paths = sorted(path for pattern in files for path in glob.glob(pattern))
+        if len(paths) == 0:
+            return False
+        self._drop(name)
+        if self.engine == 'duckdb':
+            listed = ', '.join("'{}'".format(path.replace("'", "''")) for path in paths)
+            self.con.execute('CREATE VIEW "{}" AS SELECT * FROM read_parquet([{}], union_by_name=true)'
+                             .format(name, listed))
+        else:
+            frames = [pd.read_parquet(path) for path in paths]
+            pd.concat(frames, ignore_index=True).to_sql(name, self.con, index=False)
+        return True
+
+    def register_observations(self, root=None):
+        '''
+        Makes the SOS ObservationStore available as an observations table, with the
+        station and standard_name of every row
+        Input:
+            - root (string) - directory of the store, as for ObservationStore
+        Output:
+            - boolean - False if the store is empty
+        '''
+        root = get_cache_dir('sos') if root is None else root
+        paths = sorted(glob.glob(os.path.join(root, '*', '*.parquet')))
+        if len(paths) == 0:
+            return False
+        self._drop('observations')
+        if self.engine == 'duckdb':
+            self.con.execute('''CREATE VIEW observations AS
+                SELECT parse_filename(parse_dirpath(filename)) AS station,
+                       parse_filename(filename, true) AS standard_name, * EXCLUDE (filename)
+                FROM read_parquet('{}', union_by_name=true, filename=true)'''
+                             .format(os.path.join(root, '*', '*.parquet').replace("'", "''")))
+        else:
+            frames = []
+            for path in paths:
+                df = pd.read_parquet(path).reset_index()
+                df.insert(0, 'standard_name', os.path.splitext(os.path.basename(path))[0])
+                df.insert(0, 'station', os.path.basename(os.path.dirname(path)))
+                frames.append(df)
+            pd.concat(frames, ignore_index=True).to_sql('observations', self.con, index=False)
+        return True
+
+    def create_views(self):
+        '''
+        (Re)creates the typed views (VIEWS) whose tables are there
+        Output:
+            - list of the views created
+        '''
+        tables = set(self.tables())
+        words = dict(self.dialect, cast_seconds=self.dialect['seconds'].format('time'),
+                     tow_seconds=self.dialect['seconds'].format('tow_time'))
+        created = []
+        for name, (needs, query) in VIEWS.items():
+            if isinstance(query, dict):
+                query = query[self.engine]
+            if all(table in tables or table in created for table in needs):
+                self._drop(name)
+                self.con.execute('CREATE VIEW {} AS {}'.format(name, query.format(**words)))
+                created.append(name)
+        return created
+
+    def attach_cache(self, root=None):
+        '''
+        Registers everything parsed into the cache: the CTD tables of every cruise as ctd,
+        the zooplankton table as zooplankton and the SOS store as observations, then
+        creates the views
+        Input:
+            - root (string) - cache directory, the usual one by default
+        Output:
+            - list of the tables and views available
+        '''
+        root = get_cache_dir() if root is None else root
+        self.register_parquet('ctd', [os.path.join(root, 'tables', 'ctd', '*.parquet')])
+        self.register_parquet('zooplankton', [os.path.join(root, 'tables', 'zooplankton', '*.parquet')])
+        self.register_observations(os.path.join(root, 'sos'))
+        self.create_views()
+        return self.tables()
+
+
+def connect(path=None, engine=None, root=None):
+    '''
+    Opens a database with everything in the cache attached (see Database.attach_cache)
+    Input:
+        - path (string) - database file, None for an in-memory database
+        - engine (string) - 'duckdb' or 'sqlite'; DuckDB when it is installed by default
+        - root (string) - cache directory, the usual one by default
+    Output:
+        - Database
+    '''
+    db = Database(path, engine)
+    db.attach_cache(root)
+    return db
@@ -0,0 +1,228 @@
+'''
+Keyword lookup in the CF standard name table. A copy of the names relevant to
+the IOOS catalogue is bundled in data/cf_standard_names.csv (the full table
+published by CF, cf-standard-name-table.xml, can be loaded instead) and is
+indexed by the words in each name the first time it is needed.
+
+The module also remembers which names the catalogue has actually returned
+records for, so queries can leave out the names that never match anything.
+'''
+
+import csv
+import json
+import os
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from xml.etree import ElementTree
+
+from .cache import get_cache_dir
+
+TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cf_standard_names.csv')
+
+# common shorthands and the words they stand for in standard names
+ALIASES = {'co2': 'carbon_dioxide', 'o2': 'oxygen', 'ch4': 'methane', 'chl': 'chlorophyll',
+           'temp': 'temperature', 'sst': 'sea_surface_temperature', 'ssh': 'sea_surface_height',
+           'sal': 'salinity', 'current': 'sea_water_velocity'}
+
+
+def _words(text):
+    text = text.strip().lower().replace('-', '_').replace(' ', '_')
+    words = []
+    for word in text.split('_'):
+        if word:
+            words += ALIASES.get(word, word).split('_')
+    return words
+
+
+class StandardNameIndex():
+    '''
+    An inverted index from the words of CF standard names to the names.
+    Inputs:
+        - names (list(strings)) - standard names
+        - units (dict) - standard name -> canonical units, optional
+    '''
+
+    def __init__(self, names, units=None):
+        self._names = set(names)
+        self.names = sorted(self._names)
+        self.units = {} if units is None else units
+        self._words = {}
+        for i, name in enumerate(self.names):
+            for word in name.split('_'):
+                self._words.setdefault(word, set()).add(i)
+        # sorted vocabulary, for prefix lookups with bisect
+        self._vocabulary = sorted(self._words)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def _starting_with(self, sorted_list, prefix):
+        start = bisect_left(sorted_list, prefix)
+        end = start
+        while end < len(sorted_list) and sorted_list[end].startswith(prefix):
+            end += 1
+        return sorted_list[start:end]
+
+    def prefix(self, text):
+        '''
+        Output:
+            - list of the standard names starting with text
+        '''
+        return self._starting_with(self.names, text)
+
+    def search(self, keyword, limit=None, prefer=('sea_water', 'sea_surface')):
+        '''
+        Finds the standard names containing every word of the keyword. Words may be
+        abbreviated (e.g. 'temp') and a few shorthands such as 'co2' are understood.
+        Input:
+            - keyword (string) - one or more words, separated by spaces or underscores
+            - limit (int) - maximum number of names returned
+            - prefer (tuple(strings)) - names containing one of these are ranked first among equals
+        Output:
+            - list of standard names, best matches first: the keyword itself, then names
+              matching whole words, names with a preferred phrase, and shorter names
+        '''
+        words = _words(keyword)
+        if len(words) == 0:
+            return []
+        found = None
+        for word in words:
+            ids = set()
+            for match in self._starting_with(self._vocabulary, word):
+                ids |= self._words[match]
+            found = ids if found is None else found & ids
+        query = '_'.join(words)
+
+        def rank(i):
+            name = self.names[i]
+            parts = name.split('_')
+            return (name != query,
+                    -sum(word in parts for word in words),
+                    query not in name,
+                    not any(phrase in name for phrase in prefer),
+                    len(parts),
+                    name)
+        ranked = [self.names[i] for i in sorted(found, key=rank)]
+        return ranked if limit is None else ranked[:limit]
+
+
+@lru_cache(maxsize=4)
+def standard_name_index(path=TABLE):
+    '''
+    Loads and indexes a standard name table, once per table
+    Input:
+        - path (string) - the bundled CSV by default, or CF's cf-standard-name-table.xml
+    Output:
+        - StandardNameIndex
+    '''
+    units = {}
+    if path.endswith('.xml'):
+        for entry in ElementTree.parse(path).getroot().iter('entry'):
+            units[entry.get('id')] = entry.findtext('canonical_units') or ''
+    else:
+        with open(path) as f:
+            for row in csv.DictReader(f):
+                units[row['standard_name']] = row['canonical_units']
+    return StandardNameIndex(list(units), units)
+
+
+def fetch_labels(keyword, limit=None, available=None, phrases=('sea_water', 'sea_surface')):
+    '''
+    Helper function for accessing relevant labels in the CF standards
+    Input:
+        - keyword (string) - e.g. 'temperature', 'salinity', 'oxygen', 'co2', 'dissolved oxygen'
+        - limit (int) - maximum number of labels returned
+        - available (collection(strings)) - only return these names, e.g. those the catalogue has
+        - phrases (tuple(strings)) - only return names containing one of these, unless none do;
+          None for every name matching the keyword
+    Output:
+        - list(string), best matches first
+    '''
+    labels = standard_name_index().search(keyword)
+    if phrases is not None:
+        labels = [label for label in labels if any(phrase in label for phrase in phrases)] or labels
+    if available is not None:
+        labels = [label for label in labels if label in available]
+    return labels if limit is None else labels[:limit]
+
+
+def _catalogue_file():
+    return os.path.join(get_cache_dir(), 'catalogue_names.json')
+
+
+def _load_catalogue_names():
+    path = _catalogue_file()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        seen = json.load(f)
+    # files from before searches were told apart hold a single queried/found pair
+    return dict((key, entry) for key, entry in seen.items() if isinstance(entry, dict))
+
+
+def catalogue_names(key, ttl=None):
+    '''
+    What earlier runs of a search have learned about the catalogue
+    Input:
+        - key (string) - identifies the search (catalogue, region, dates, ...), as for remember_catalogue_names
+        - ttl (float) - ignore what was learned longer than ttl seconds ago
+    Output:
+        - tuple(set, set) - the names that have been searched for, and those of them that
+          turned up in at least one record
+    '''
+    entry = _load_catalogue_names().get(key)
+    if entry is None or (ttl is not None and entry['time'] < time.time() - ttl):
+        return set(), set()
+    return set(entry['queried']), set(entry['found'])
+
+
+def _record_text(rec):
+    # what apiso:AnyText searches: the whole record, where it came with its XML
+    xml = getattr(rec, 'xml', None)
+    if xml is not None:
+        return xml.decode('utf-8', 'replace') if isinstance(xml, bytes) else xml
+    return ' '.join(list(rec.subjects or []) + [rec.title or '', rec.abstract or ''])
+
+
+def remember_catalogue_names(key, labels, records):
+    '''
+    Records which of the labels searched for turned up in the records a search returned.
+    Only call it with every record the search matched; labels missing from a partial
+    result may well be in the rest.
+    Input:
+        - key (string) - identifies the search (catalogue, region, dates, ...)
+        - labels (list(strings)) - the labels that were searched for
+        - records (dict) - CswRecord objects, as in CatalogueServiceWeb.records
+    '''
+    # the catalogue matches labels regardless of case
+    text = ' '.join(_record_text(rec) for rec in records.values()).lower()
+    seen = _load_catalogue_names()
+    queried, found = catalogue_names(key)
+    queried |= set(labels)
+    found |= set(label for label in labels if label.lower() in text)
+    seen[key] = dict(queried=sorted(queried), found=sorted(found), time=time.time())
+    tmp = _catalogue_file() + '.partial'
+    with open(tmp, 'w') as f:
+        json.dump(seen, f)
+    os.replace(tmp, _catalogue_file())
+
+
+def narrow_labels(labels, queried=(), found=()):
+    '''
+    Shrinks a list of labels before it is turned into '*label*' catalogue filters: labels
+    already searched for without a single match are dropped, as are labels containing another
+    label (its wildcard matches them too). Nothing is dropped if that would leave no labels.
+    Input:
+        - labels (list(strings))
+        - queried, found (collections of strings) - as returned by catalogue_names
+    Output:
+        - list(strings), in the original order
+    '''
+    kept = [label for label in labels if label not in queried or label in found]
+    if len(kept) == 0:
+        kept = list(labels)
+    return [label for label in kept if not any(other != label and other in label for other in kept)]
@@ -0,0 +1,290 @@
+'''
+Synthetic Seward Line data, for trying the loaders at volumes the real TXS12
+files can't provide. The generator writes CTD .ascii/.hdr pairs and Calvet
+zooplankton CSVs laid out like the files on the AOOS portal, for any number of
+cruises, stations and depths. Everything is worked out from a seed, so the same
+arguments always give the same bytes.
+
+    files = write_archive('/tmp/seward', n_cruises=10, n_stations=60, seed=1)
+    df = make_CTD_dataframe(*files['ctd'][0])
+'''
+
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# ends of the line, from the mouth of Resurrection Bay (GAK1) out past the shelf break (GAK15)
+LINE_START = (-149.467, 59.845)
+LINE_END = (-147.000, 57.900)
+
+# SBE variable names and descriptions, in the column order of the TXS12 .ascii file
+CTD_COLUMNS = [('Consecutive Station Number', 'Station'), ('prDM', 'Pressure, Digiquartz [db]'),
+               ('t090C', 'Temperature [ITS-90, deg C]'), ('t190C', 'Temperature, 2 [ITS-90, deg C]'),
+               ('c0S/m', 'Conductivity [S/m]'), ('c1S/m', 'Conductivity, 2 [S/m]')] + \
+              [('v{}'.format(i), 'Voltage {}'.format(i)) for i in range(8)] + \
+              [('flECO-AFL', 'Fluorescence, WET Labs ECO-AFL/FL [mg/m^3]'), ('CStarTr0', 'Beam Transmission [%]'),
+               ('sbeox0ML/L', 'Oxygen, SBE 43 [ml/l]'), ('altM', 'Altimeter [m]'),
+               ('latitude', 'Latitude [deg]'), ('longitude', 'Longitude [deg]'),
+               ('sigma-t00', 'Density [sigma-t, kg/m^3 ]'), ('sigma-t11', 'Density, 2 [sigma-t, kg/m^3 ]'),
+               ('sal00', 'Salinity, Practical [PSU]'), ('sal11', 'Salinity, Practical, 2 [PSU]'),
+               ('nbin', 'number of scans per bin'), ('flag', 'flag')]
+
+# instrument notes, some of which end up in each header so headers differ in length
+HEADER_NOTES = ['Sea-Bird SBE 9 Data File', 'Software Version Seasave V 7.21', 'Temperature SN = 4321',
+                'Conductivity SN = 2876', 'System UpLoad Time = {date}', 'Ship: R/V Tiglax',
+                'binavg_binsize = 1', 'binavg_excl_bad_scans = yes', 'loopedit_minVelocity = 0.250',
+                'wildedit_pass1_nstd = 2.0', 'filter_low_pass_tc_A = 0.030', 'celltm_alpha = 0.0300, 0.0300']
+
+ZOOPLANKTON_COLUMNS = ['Cruise', 'Year', 'Month', 'Day', 'Time (hh:mm:ss AM/PM)', 'Date-Time', 'Station',
+                       'Tow Depth (m)', 'Sonic Depth (m)', 'Latitude (degrees N)', 'Longitude (degrees W)',
+                       'Net Type', 'Mesh Size (um)', 'Volume Filtered (m3)', 'Taxa', 'Stage', 'Sex',
+                       'Abundance (no m-3)', 'Biomass (mg m-3)', 'Kingdom', 'Phylum', 'Subphylum', 'Superclass',
+                       'Class', 'Subclass', 'Infraclass', 'Order', 'Suborder', 'Infraorder', 'Family', 'Genus',
+                       'Species']
+
+# (phylum, class, genus) of the common Calvet taxa
+TAXA = [('Arthropoda', 'Maxillopoda', 'Neocalanus'), ('Arthropoda', 'Maxillopoda', 'Pseudocalanus'),
+        ('Arthropoda', 'Maxillopoda', 'Calanus'), ('Arthropoda', 'Maxillopoda', 'Oithona'),
+        ('Arthropoda', 'Maxillopoda', 'Metridia'), ('Arthropoda', 'Malacostraca', 'Thysanoessa'),
+        ('Arthropoda', 'Malacostraca', 'Euphausia'), ('Arthropoda', 'Ostracoda', 'Conchoecia'),
+        ('Chordata', 'Appendicularia', 'Oikopleura'), ('Chordata', 'Appendicularia', 'Fritillaria'),
+        ('Chordata', 'Actinopterygii', 'Ammodytes'), ('Mollusca', 'Gastropoda', 'Limacina'),
+        ('Mollusca', 'Bivalvia', 'Mytilus'), ('Annelida', 'Polychaeta', 'Tomopteris'),
+        ('Chaetognatha', 'Sagittoidea', 'Parasagitta'), ('Cnidaria', 'Hydrozoa', 'Aglantha')]
+STAGES = ['adult', 'C5', 'C4', 'C3', 'juvenile', 'larva', 'egg']
+
+
+def _rng(seed, *parts):
+    # an independent stream for each cruise and file, so adding cruises doesn't change the others
+    return np.random.RandomState([seed] + [zlib.crc32(part.encode()) for part in parts])
+
+
+def cruise_names(n_cruises, start_year=2012):
+    '''
+    Names cruises the way the Seward Line does, a spring (TXS) and a fall (TXF) cruise a year
+    Input:
+        - n_cruises (int)
+        - start_year (int)
+    Output:
+        - list of (name, first day) tuples, e.g. ('TXS12', Timestamp('2012-05-03'))
+    '''
+    cruises = []
+    for i in range(n_cruises):
+        year = start_year + i // 2
+        season, month = ('TXS', 5) if i % 2 == 0 else ('TXF', 9)
+        cruises.append(('{}{:02d}'.format(season, year % 100), pd.Timestamp(year, month, 3)))
+    return cruises
+
+
+def seward_stations(n_stations=15):
+    '''
+    Stations spread evenly along the Seward Line
+    Input:
+        - n_stations (int) - any number; 15 gives roughly GAK1 to GAK15
+    Output:
+        - pandas.DataFrame with station, latitude, longitude and waterdepth (m)
+    '''
+    offshore = np.linspace(0, 1, n_stations)
+    lon = LINE_START[0] + (LINE_END[0] - LINE_START[0]) * offshore
+    lat = LINE_START[1] + (LINE_END[1] - LINE_START[1]) * offshore
+    # shelf at 200-300 m, then down the slope past GAK13
+    depth = 60 + 200 * np.minimum(offshore / 0.3, 1) + 2400 * np.maximum(offshore - 0.8, 0) / 0.2
+    if n_stations == 15:
+        names = ['GAK{}'.format(i + 1) for i in range(n_stations)]
+    else:
+        names = ['GAK{:.1f}'.format(1 + 14 * x) for x in offshore]
+    return pd.DataFrame({'station': names, 'latitude': lat.round(4), 'longitude': lon.round(4),
+                         'waterdepth': depth.round().astype(int)})
+
+
+def cruise_plan(cruise, start, n_stations=40, seed=0):
+    '''
+    The casts of one cruise, working offshore along the line about three hours apart
+    Input:
+        - cruise (string) - cruise name
+        - start (pandas.Timestamp) - time of the first cast
+        - n_stations (int) - number of casts
+        - seed (int)
+    Output:
+        - pandas.DataFrame with one row per cast: id, station, time, latitude, longitude, waterdepth
+    '''
+    rng = _rng(seed, cruise, 'plan')
+    casts = seward_stations(n_stations)
+    casts.insert(0, 'id', np.arange(1, n_stations + 1))
+    hours = np.cumsum(np.r_[0, rng.uniform(2, 4, n_stations - 1)])
+    casts['time'] = (start + pd.Timedelta(hours=6) + pd.to_timedelta(hours, unit='h')).round('min')
+    casts['latitude'] += rng.normal(0, 0.002, n_stations).round(4)
+    casts['longitude'] += rng.normal(0, 0.002, n_stations).round(4)
+    return casts
+
+
+def ctd_profiles(casts, max_depth=250, seed=0, cruise=''):
+    '''
+    1 m binned profiles for every cast, down to the bottom or max_depth
+    Input:
+        - casts (pandas.DataFrame) - as returned by cruise_plan
+        - max_depth (int) - deepest pressure bin (dbar)
+        - seed (int)
+        - cruise (string) - cruise name, to seed each cruise differently
+    Output:
+        - numpy.ndarray with the columns of CTD_COLUMNS
+    '''
+    rng = _rng(seed, cruise, 'ctd')
+    spring = cruise.startswith('TXS')
+    blocks = []
+    for cast in casts.itertuples():
+        p = np.arange(0, min(cast.waterdepth - 5, max_depth) + 1, dtype=float)
+        n = len(p)
+        mixed = rng.uniform(10, 40) if spring else rng.uniform(20, 60)
+        surface = rng.normal(6.5 if spring else 11.0, 0.5)
+        temp = 4.5 + (surface - 4.5) / (1 + np.exp((p - mixed) / 8.)) + rng.normal(0, 0.01, n)
+        sal = 32.9 - 2.0 * np.exp(-p / 40.) - (0.5 * np.exp(-cast.id / 5.)) + rng.normal(0, 0.005, n)
+        sigma = (sal - 35) * 0.78 - (temp - 10) * 0.16 + 27.0 + p * 0.0001
+        fluor = 2.5 * np.exp(-((p - mixed) / 15.) ** 2) * rng.uniform(0.5, 2) + rng.uniform(0, 0.05, n)
+        blocks.append(np.column_stack(
+            [np.full(n, cast.id), p, temp, temp + rng.normal(0, 0.002, n), 2.9 + 0.09 * temp, 2.9 + 0.09 * temp]
+            + [rng.uniform(0, 5, n).round(3) for _ in range(8)]
+            + [fluor, 90 - 10 * fluor / 2.5, 7.5 - 0.01 * p, np.maximum(cast.waterdepth - p, 0) % 100,
+               np.full(n, cast.latitude), np.full(n, cast.longitude), sigma, sigma + rng.normal(0, 0.001, n),
+               sal, sal + rng.normal(0, 0.001, n), np.full(n, 24.), np.zeros(n)]))
+    return np.vstack(blocks)
+
+
+def write_ctd_pair(folder, cruise='TXS12', start=pd.Timestamp(2012, 5, 3), n_stations=40, max_depth=250,
+                   seed=0):
+    '''
+    Writes a CTD data file and its header file, like TXS12.ascii and TXS12.hdr
+    Input:
+        - folder (string)
+        - cruise (string) - cruise name, also the file names
+        - start (pandas.Timestamp) - first day of the cruise
+        - n_stations (int) - number of casts
+        - max_depth (int) - deepest pressure bin (dbar)
+        - seed (int)
+    Output:
+        - tuple(string) - paths of the data and header files
+    '''
+    rng = _rng(seed, cruise, 'header')
+    casts = cruise_plan(cruise, start, n_stations, seed)
+
+    hdr = os.path.join(folder, cruise + '.hdr')
+    header = pd.DataFrame({'id': casts['id'], 'station': casts['station'],
+                           'date': casts['time'].dt.strftime('%m/%d/%Y %H:%M:%S'),
+                           'latitude': casts['latitude'], 'longitude': casts['longitude'],
+                           'waterdepth': casts['waterdepth'],
+                           'filename': ['{}_{:03d}.cnv'.format(cruise.lower(), i) for i in casts['id']],
+                           'instrument': 'SBE9plus', 'ship': 'Tiglax', 'cruise': cruise, 'junk1': 'Hopcroft',
+                           'PI': 'Russ Hopcroft', 'purpose': 'Seward Line Long Term Observation Program',
+                           'agency': 'NPRB', 'region': 'Northern Gulf of Alaska', 'junk2': 'n'})
+    header.to_csv(hdr, header=False, index=False)
+
+    # the block of notes before the column list varies between cruises
+    notes = [HEADER_NOTES[i] for i in sorted(rng.choice(len(HEADER_NOTES), rng.randint(2, len(HEADER_NOTES)),
+                                                        replace=False))]
+    data = os.path.join(folder, cruise + '.ascii')
+    with open(data, 'w') as f:
+        f.write('% {} CTD data, Seward Line, synthetic\n'.format(cruise))
+        for note in notes:
+            f.write('% ' + note.format(date=start.strftime('%b %d %Y')) + '\n')
+        f.write('% Data File Column Contents:\n')
+        for k, (name, title) in enumerate(CTD_COLUMNS):
+            f.write('% {:2d}: {}: {}\n'.format(k + 1, name, title))
+        f.write('%' * 40 + '\n')
+        f.write('% *END*\n')
+        np.savetxt(f, ctd_profiles(casts, max_depth, seed, cruise), fmt='%.4f')
+    return data, hdr
+
+
+def zooplankton_tows(casts, cruise, n_taxa=150, seed=0, every=3):
+    '''
+    Calvet tows at every few casts of a cruise, each with n_taxa rows
+    Input:
+        - casts (pandas.DataFrame) - as returned by cruise_plan
+        - cruise (string)
+        - n_taxa (int) - rows per tow
+        - seed (int)
+        - every (int) - a tow at every this many casts
+    Output:
+        - pandas.DataFrame with ZOOPLANKTON_COLUMNS
+    '''
+    rng = _rng(seed, cruise, 'zooplankton')
+    tows = casts.iloc[::every]
+    rows = np.repeat(np.arange(len(tows)), n_taxa)
+    # the net goes in shortly after the CTD comes up
+    times = (tows['time'] + pd.Timedelta(minutes=40)).dt.round('min').values[rows]
+    times = pd.DatetimeIndex(times)
+    taxa = [TAXA[k] for k in rng.randint(0, len(TAXA), len(rows))]
+    frame = pd.DataFrame(columns=ZOOPLANKTON_COLUMNS, index=np.arange(len(rows)))
+    frame['Cruise'] = cruise
+    frame['Year'] = times.year
+    frame['Month'] = times.month
+    frame['Day'] = times.day
+    # despite its name the column holds 24 hour hh:mm times
+    frame['Time (hh:mm:ss AM/PM)'] = times.strftime('%H:%M')
+    frame['Date-Time'] = times.strftime('%m/%d/%Y %H:%M')
+    frame['Station'] = tows['station'].values[rows]
+    frame['Tow Depth (m)'] = np.minimum(tows['waterdepth'].values[rows] - 5, 100)
+    frame['Sonic Depth (m)'] = tows['waterdepth'].values[rows]
+    frame['Latitude (degrees N)'] = tows['latitude'].values[rows]
+    frame['Longitude (degrees W)'] = tows['longitude'].values[rows]
+    frame['Net Type'] = 'CalVET'
+    frame['Mesh Size (um)'] = 150
+    frame['Volume Filtered (m3)'] = rng.uniform(2, 6, len(tows)).round(2)[rows]
+    frame['Taxa'] = [genus for _, _, genus in taxa]
+    frame['Stage'] = [STAGES[k] for k in rng.randint(0, len(STAGES), len(rows))]
+    frame['Sex'] = ''
+    frame['Abundance (no m-3)'] = rng.lognormal(1, 1.5, len(rows)).round(4)
+    frame['Biomass (mg m-3)'] = (frame['Abundance (no m-3)'] * rng.uniform(0.005, 0.05, len(rows))).round(4)
+    frame['Kingdom'] = 'Animalia'
+    frame['Phylum'] = [phylum for phylum, _, _ in taxa]
+    frame['Class'] = [cls for _, cls, _ in taxa]
+    frame['Genus'] = frame['Taxa']
+    frame['Species'] = ['sp{}'.format(k) for k in rng.randint(1, 10, len(rows))]
+    return frame
+
+
+def write_zooplankton_csv(path, frames):
+    '''
+    Writes tows in the layout of Seward_ZooData_Calvet_2012-2016_final.csv: a
+    leading row number and a few empty columns at the end
+    Input:
+        - path (string)
+        - frames (list(pandas.DataFrame)) - as returned by zooplankton_tows
+    Output:
+        - path
+    '''
+    df = pd.concat(frames, ignore_index=True)
+    df.index = np.arange(1, len(df) + 1)
+    for i in range(3):
+        df['Unnamed: {}'.format(len(ZOOPLANKTON_COLUMNS) + 1 + i)] = ''
+    df.to_csv(path, encoding='latin_1')
+    return path
+
+
+def write_archive(folder, n_cruises=1, n_stations=40, max_depth=250, n_taxa=150, start_year=2012, seed=0):
+    '''
+    Writes a whole synthetic archive: a CTD pair per cruise and one zooplankton
+    file covering all of them, with tows that line up with the casts
+    Input:
+        - folder (string) - created if needed
+        - n_cruises (int) - two a year, spring and fall
+        - n_stations (int) - casts per cruise
+        - max_depth (int) - deepest pressure bin (dbar)
+        - n_taxa (int) - zooplankton rows per tow
+        - start_year (int)
+        - seed (int)
+    Output:
+        - dict with 'ctd' (list of (data, header) paths, one per cruise), 'zooplankton' (path)
+          and 'cruises' (list of names)
+    '''
+    os.makedirs(folder, exist_ok=True)
+    files = dict(ctd=[], zooplankton=None, cruises=[])
+    tows = []
+    for cruise, start in cruise_names(n_cruises, start_year):
+        files['ctd'].append(write_ctd_pair(folder, cruise, start, n_stations, max_depth, seed))
+        files['cruises'].append(cruise)
+        tows.append(zooplankton_tows(cruise_plan(cruise, start, n_stations, seed), cruise, n_taxa, seed))
+    files['zooplankton'] = write_zooplankton_csv(os.path.join(folder, 'Seward_ZooData_Calvet_synthetic.csv'), tows)
+    return files
@@ -0,0 +1,46 @@
+from __future__ import absolute_import, division, print_function
+import os
+import time
+import pandas as pd
+from ohw_lter_vis import cache
+
+
+def test_cache_dir(tmpdir, monkeypatch):
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    path = cache.get_cache_dir('csw')
+    assert path == os.path.join(str(tmpdir), 'csw')
+    assert os.path.isdir(path)
+
+
+def test_hash_key():
+    assert cache.hash_key('a', b'b') == cache.hash_key('a', 'b')
+    # the separator keeps ('ab', 'c') apart from ('a', 'bc')
+    assert cache.hash_key('ab', 'c') != cache.hash_key('a', 'bc')
+
+
+def test_is_fresh(tmpdir):
+    path = str(tmpdir.join('x.json'))
+    assert not cache.is_fresh(path, None)
+    open(path, 'w').close()
+    assert cache.is_fresh(path, None)
+    assert cache.is_fresh(path, 60)
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert not cache.is_fresh(path, 60)
+
+
+def test_cached_table_source(tmpdir, monkeypatch):
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    builds = []
+
+    def build():
+        builds.append(1)
+        return pd.DataFrame(dict(x=[len(builds)]))
+
+    assert cache.cached_table('ctd/A', build, source=['a.ascii', 'a.hdr'])['x'][0] == 1
+    assert cache.cached_table('ctd/A', build, source=['a.ascii', 'a.hdr'])['x'][0] == 1
+    assert cache.cached_table('ctd/A', build)['x'][0] == 1
+    assert cache.table_source('ctd/A') == ['a.ascii', 'a.hdr']
+    # the same name built from other files is built again
+    assert cache.cached_table('ctd/A', build, source=['b.ascii', 'b.hdr'])['x'][0] == 2
+    assert cache.table_source('ctd/A') == ['b.ascii', 'b.hdr']
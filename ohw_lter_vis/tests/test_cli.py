@@ -0,0 +1,133 @@
+from __future__ import absolute_import, division, print_function
+import json
+import os
+import tarfile
+import numpy.testing as npt
+import pandas as pd
+import pytest
+from ohw_lter_vis import cli
+from ohw_lter_vis.cache import table_path
+from ohw_lter_vis.load_Seward_CTD import CRUISES, load_cruise
+from ohw_lter_vis.load_Seward_zooplankton import load_zooplankton
+from ohw_lter_vis.synthetic import write_archive
+
+
+def _config(tmpdir, monkeypatch):
+    files = write_archive(str(tmpdir.join('remote')), n_cruises=2, n_stations=6, max_depth=20, n_taxa=4)
+    # the config adds the cruises to CRUISES; put it back as it was afterwards
+    for name, urls in zip(files['cruises'], files['ctd']):
+        monkeypatch.setitem(CRUISES, name, urls)
+    config = dict(cruises=dict(zip(files['cruises'], files['ctd'])), zooplankton=files['zooplankton'], ioos=[])
+    path = str(tmpdir.join('config.json'))
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    return path
+
+
+def test_warm(tmpdir, monkeypatch):
+    """
+    warm parses every configured cruise into the cache, reports on it, and leaves
+    cached tables alone the second time.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    config = _config(tmpdir, monkeypatch)
+    report = str(tmpdir.join('report.json'))
+    npt.assert_equal(cli.main(['warm', '--config', config, '--report', report]), 0)
+    rows = pd.read_json(report)
+    npt.assert_equal(list(rows['name']), ['TXF12', 'TXS12', 'calvet'])
+    npt.assert_equal((rows['stored'] > 0).all(), True)
+    npt.assert_equal(os.path.exists(table_path('ctd/TXF12')), True)
+    mtime = os.path.getmtime(table_path('ctd/TXF12'))
+    npt.assert_equal(cli.main(['warm', '--config', config]), 0)
+    npt.assert_equal(os.path.getmtime(table_path('ctd/TXF12')), mtime)
+    npt.assert_equal(len(load_cruise('TXF12')), rows.set_index('name').loc['TXF12', 'rows'])
+
+
+def test_warm_downloaded(tmpdir, monkeypatch):
+    """
+    The report counts every byte the server sent, and each of them once.
+    """
+    from ohw_lter_vis.fake_ioos import FakeIOOS
+
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    files = write_archive(str(tmpdir.join('remote')), n_cruises=1, n_stations=6, max_depth=20, n_taxa=4)
+    with FakeIOOS(n_stations=0, n_models=0, root=str(tmpdir.join('remote'))) as fake:
+        def served(path):
+            return '{}/files/{}'.format(fake.url, os.path.basename(path))
+        config = dict(cruises=dict((name, [served(data), served(header)])
+                                   for name, (data, header) in zip(files['cruises'], files['ctd'])),
+                      zooplankton=served(files['zooplankton']), ioos=[])
+        for name, urls in config['cruises'].items():
+            monkeypatch.setitem(CRUISES, name, tuple(urls))
+        config['cruises'] = sorted(config['cruises'])
+        report = cli.warm(config)
+    npt.assert_equal(list(report['error']), ['', ''])
+    npt.assert_equal(report['downloaded'].sum(), fake.sent['files'])
+
+
+def test_bundle_and_unpack(tmpdir, monkeypatch):
+    """
+    A bundle unpacked into an empty cache serves the loaders without the original files.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    output = str(tmpdir.join('seward.tar.gz'))
+    npt.assert_equal(cli.main(['bundle', output, '--config', _config(tmpdir, monkeypatch)]), 0)
+    zoo = load_zooplankton()
+
+    tmpdir.join('remote').remove()
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('node')))
+    npt.assert_equal(cli.main(['unpack', output]), 0)
+    npt.assert_equal(len(load_cruise('TXS12')), 6 * 21)
+    pd.testing.assert_frame_equal(load_zooplankton(), zoo)
+    npt.assert_equal(len(load_zooplankton(2012)), len(zoo))
+
+
+def test_warm_ioos(tmpdir, monkeypatch):
+    """
+    An IOOS query is searched once into a snapshot, which later runs reuse until it
+    is older than the query's cache_ttl.
+    """
+    for name in ('geopandas', 'cartopy', 'folium', 'altair', 'gridgeo', 'geolinks', 'ioos_tools', 'netCDF4'):
+        pytest.importorskip(name)
+    from ohw_lter_vis.fake_ioos import FakeIOOS
+
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    with FakeIOOS(n_stations=3, n_models=0, names=['sea_water_temperature']) as fake:
+        query = dict(name='fake', roi=[-154., -142., 58.5, 61.], start='2018-07-01', stop='2018-07-03',
+                     target=['sea_water_temperature'], csw_endpoint=fake.csw_url)
+        config = dict(cruises=[], zooplankton=None, ioos=[query])
+        report = cli.warm(config)
+        npt.assert_equal(list(report['error']), [''])
+        npt.assert_equal(report['rows'][0] > 0, True)
+        npt.assert_equal(report['downloaded'][0], fake.sent['csw'] + fake.sent['sos'])
+        state = os.path.join(cli.ioos_snapshot('fake'), 'state.json')
+        mtime = os.path.getmtime(state)
+        requests = dict(fake.requests)
+
+        npt.assert_equal(list(cli.warm(config)['rows']), list(report['rows']))
+        npt.assert_equal(fake.requests, requests)
+        npt.assert_equal(os.path.getmtime(state), mtime)
+
+        # past its ttl the snapshot is searched for again
+        query['cache_ttl'] = 0
+        npt.assert_equal(list(cli.warm(config)['error']), [''])
+        npt.assert_equal(fake.requests['csw'] > requests['csw'], True)
+
+
+def test_unpack_without_filters(tmpdir, monkeypatch):
+    """
+    Where tarfile has no extraction filters, bundles still unpack, and members
+    that would land outside the cache are refused.
+    """
+    monkeypatch.delattr(tarfile, 'data_filter', raising=False)
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    output = str(tmpdir.join('seward.tar'))
+    cli.bundle(output)
+    npt.assert_equal(cli.unpack(output, str(tmpdir.join('node')))['files'], 0)
+
+    bad = str(tmpdir.join('bad.tar'))
+    with tarfile.open(bad, 'w') as tar:
+        tar.add(output, arcname='../escaped.tar')
+    with pytest.raises(ValueError):
+        cli.unpack(bad, str(tmpdir.join('node')))
+    npt.assert_equal(tmpdir.join('escaped.tar').exists(), False)
@@ -0,0 +1,37 @@
+from __future__ import absolute_import, division, print_function
+import numpy.testing as npt
+import pandas as pd
+import requests
+from owslib import fes
+from owslib.csw import CatalogueServiceWeb
+from ohw_lter_vis.fake_ioos import FakeIOOS
+
+
+def test_fake_catalogue():
+    """
+    The fake catalogue pages like the real one and lists SOS and model urls.
+    """
+    with FakeIOOS(n_stations=3, n_models=1, names=['sea_water_temperature']) as fake:
+        csw = CatalogueServiceWeb(fake.csw_url, skip_caps=True)
+        csw.getrecords2(constraints=[fes.PropertyIsLike('apiso:AnyText', '*temperature*')],
+                        startposition=1, maxrecords=3)
+        npt.assert_equal(csw.results['matches'], 4)
+        npt.assert_equal(len(csw.records), 3)
+        csw.getrecords2(constraints=[], startposition=4, maxrecords=3)
+        npt.assert_equal(len(csw.records), 1)
+        schemes = [scheme for rec in fake.records() for scheme, url in rec['references']]
+        npt.assert_equal(sorted(schemes), ['OGC:SOS'] * 3 + ['OPeNDAP:OPeNDAP'])
+
+
+def test_fake_sos():
+    """
+    SOS answers cover the requested window, and failures are injected on request.
+    """
+    with FakeIOOS(n_stations=1, n_models=0, failure_rate={'sos': 1.}) as fake:
+        url = fake.records()[0]['references'][0][1]
+        window = url.replace('eventTime=latest', 'eventTime=2018-07-01T00:00:00/2018-07-01T12:00:00')
+        npt.assert_equal(requests.get(window).status_code, 500)
+        fake.failure_rate = 0.
+        df = pd.read_csv(window, index_col='date_time', parse_dates=True)
+        npt.assert_equal(len(df), 13)
+        npt.assert_equal(fake.requests['sos'], 2)
@@ -0,0 +1,43 @@
+from __future__ import absolute_import, division, print_function
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy.testing as npt
+import pytest
+from ohw_lter_vis.fake_ioos import FakeIOOS
+from ohw_lter_vis.remote import Deadline
+
+for name in ('gridgeo', 'netCDF4'):
+    pytest.importorskip(name)
+
+from ohw_lter_vis.grids import CachedGrid, ProbePool, probe_dap_url  # noqa: E402
+
+TARGET = ['sea_water_temperature']
+
+
+def test_probe_pool(tmpdir, monkeypatch):
+    """
+    Probes run in the worker processes give the same answers as in this one, really run
+    side by side, and give up when the deadline has passed.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    with FakeIOOS(n_stations=0, n_models=4, latency=0.02) as fake:
+        urls = ['{}/files/model_{}.nc#mode=bytes'.format(fake.url, i) for i in range(4)]
+        tic = time.perf_counter()
+        local = probe_dap_url(urls[0], TARGET)
+        single = time.perf_counter() - tic
+        npt.assert_equal(local['valid'], True)
+
+        with ProbePool(4) as pool:
+            # the first probe also starts the workers
+            npt.assert_equal(pool.probe(urls[0], TARGET)['title'], local['title'])
+            tic = time.perf_counter()
+            with ThreadPoolExecutor(4) as threads:
+                probes = list(threads.map(lambda url: pool.probe(url, TARGET), urls))
+            elapsed = time.perf_counter() - tic
+            with pytest.raises(TimeoutError):
+                pool.probe(urls[1], TARGET, deadline=Deadline(0))
+
+    npt.assert_equal([probe['valid'] for probe in probes], [True] * 4)
+    npt.assert_equal(set(type(probe['grid']) for probe in probes), {CachedGrid})
+    # one after the other, the three probes that build a grid would take three times as long
+    assert elapsed < 2 * single, (elapsed, single)
@@ -0,0 +1,69 @@
+from __future__ import absolute_import, division, print_function
+import json
+import threading
+import numpy as np
+import numpy.testing as npt
+from ohw_lter_vis import instrument, load_Seward_CTD
+
+
+def test_spans(tmpdir):
+    """
+    Spans record counters, outermost spans of the main thread the peak memory,
+    and they export to both formats.
+    """
+    with instrument.span('ignored') as s:
+        s.add(rows=1)
+
+    with instrument.tracing(memory=True) as tracer:
+        with instrument.span('outer', 'test') as outer:
+            with instrument.span('inner', 'test', url='http://a.org') as inner:
+                inner.add(bytes=10, rows=2)
+                big = np.ones(1000000)
+            del big
+            outer.add(rows=3)
+    assert instrument.current_tracer() is None
+    npt.assert_equal([span['name'] for span in tracer.spans], ['inner', 'outer'])
+    inner, outer = tracer.spans
+    npt.assert_equal((inner['bytes'], inner['rows'], outer['rows']), (10, 2, 3))
+    npt.assert_equal(inner['peak_memory'], None)
+    assert outer['peak_memory'] >= 8000000
+
+    # the peak is shared by the whole process, so spans of other threads don't get one
+    def work():
+        with instrument.span('worker', 'test'):
+            pass
+    with instrument.tracing(memory=True) as threaded:
+        worker = threading.Thread(target=work)
+        worker.start()
+        worker.join()
+    npt.assert_equal(threaded.spans[0]['peak_memory'], None)
+
+    summary = tracer.summary()
+    npt.assert_equal(summary.loc['inner', 'count'], 1)
+
+    path = str(tmpdir.join('run.json'))
+    tracer.to_chrome_trace(path)
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    npt.assert_equal(events[0]['ph'], 'X')
+    npt.assert_equal(events[0]['args']['url'], 'http://a.org')
+
+
+def test_ctd_spans(tmpdir):
+    """
+    The CTD loader reports its stages.
+    """
+    path = tmpdir.join('ctd.ascii')
+    path.write('% Data File Column Contents:\n'
+               '% 1: Consecutive Station Number: Station\n'
+               '% 2: prDM: Pressure [db]\n'
+               '%%%%\n'
+               '**END**\n'
+               '1 2.0\n'
+               '1 4.0\n')
+    with instrument.tracing() as tracer:
+        data = load_Seward_CTD.load_data(str(path))
+    npt.assert_equal(list(data.columns), ['id', 'pressure'])
+    spans = dict((span['name'], span) for span in tracer.spans)
+    npt.assert_equal(sorted(spans), ['ctd.load_data', 'ctd.parse_header', 'ctd.read_table'])
+    npt.assert_equal(spans['ctd.read_table']['rows'], 2)
@@ -0,0 +1,188 @@
+from __future__ import absolute_import, division, print_function
+from datetime import datetime
+import numpy.testing as npt
+import pandas as pd
+import pytest
+from ohw_lter_vis.fake_ioos import FakeIOOS
+from ohw_lter_vis.remote import Deadline
+from ohw_lter_vis.standard_names import catalogue_names
+
+# ioos_lib needs the whole geospatial stack; without it there is nothing to test
+for name in ('geopandas', 'cartopy', 'folium', 'altair', 'gridgeo', 'geolinks', 'ioos_tools', 'netCDF4'):
+    pytest.importorskip(name)
+
+from ohw_lter_vis.ioos_lib import CachedGrid, DataScraper, dedupe_references  # noqa: E402
+
+ROI = [-154., -142., 58.5, 61.]
+
+
+def _scraper(fake, models_only=False, target=None):
+    return DataScraper(ROI, datetime(2018, 7, 1), datetime(2018, 7, 3), target or ['sea_water_temperature'],
+                       models_only=models_only, csw_endpoint=fake.csw_url)
+
+
+def test_dedupe_references():
+    """
+    Of the rows listing the same endpoint, the OPeNDAP one is kept, in its original place.
+    """
+    df = pd.DataFrame(dict(scheme=['WWW:LINK', 'WWW:LINK', 'OPeNDAP:OPeNDAP'],
+                           url=['http://a/dodsC/m.nc.html', 'http://b/x', 'http://a/dodsC/m.nc'],
+                           canonical=['m', 'x', 'm']))
+    kept = dedupe_references(df)
+    npt.assert_equal(list(kept['url']), ['http://b/x', 'http://a/dodsC/m.nc'])
+    npt.assert_equal(list(kept.index), [0, 1])
+
+
+def test_observations(tmpdir, monkeypatch):
+    """
+    The step by step search finds every fake station and reads its observations,
+    and a second scraper gets them from the cache.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    with FakeIOOS(n_stations=3, n_models=0, names=['sea_water_temperature']) as fake:
+        scraper = _scraper(fake)
+        scraper.get_records()
+        scraper.create_database()
+        df = scraper.get_observations()
+        npt.assert_equal(len(scraper.csw_records), 3)
+        npt.assert_equal(scraper.stage, 'observations')
+        npt.assert_equal(df['station_id'].nunique(), 3)
+
+        requests = dict(fake.requests)
+        again = _scraper(fake)
+        again.get_records()
+        again.create_database()
+        npt.assert_equal(again.get_observations().shape, df.shape)
+        npt.assert_equal(again.csw, None)
+        npt.assert_equal(fake.requests['csw'], requests['csw'])
+
+
+def test_narrowed_search(tmpdir, monkeypatch):
+    """
+    Labels the catalogue had nothing for are left out of the next search, which still
+    finds the records of the first in the cache.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    target = ['sea_water_temperature', 'sea_water_salinity']
+    with FakeIOOS(n_stations=3, n_models=0, names=['sea_water_temperature']) as fake:
+        scraper = _scraper(fake, target=target)
+        scraper.get_records()
+        npt.assert_equal(fake.requests['csw'], 1)
+        queried, found = catalogue_names(scraper._catalogue_key())
+        npt.assert_equal((queried, found), (set(target), {'sea_water_temperature'}))
+
+        again = _scraper(fake, target=target)
+        assert again._query_filter() is not again.filter_list
+        again.get_records()
+        npt.assert_equal(fake.requests['csw'], 1)
+        npt.assert_equal(list(again.csw_records), list(scraper.csw_records))
+
+
+def test_models(tmpdir, monkeypatch):
+    """
+    Model endpoints probed side by side are all found valid, and only answers are remembered.
+    Grids built now and grids from the cache are the same kind of object.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    monkeypatch.setattr(DataScraper, '_dap_probes', {})
+    with FakeIOOS(n_stations=0, n_models=4, names=['sea_water_temperature']) as fake:
+        scraper = _scraper(fake, models_only=True)
+        scraper.get_records()
+        scraper.create_database()
+        scraper.get_models(max_workers=4)
+        npt.assert_equal(list(scraper.probe_report['error'].isnull()), [True] * 4)
+        npt.assert_equal(len(scraper.model_urls), 4)
+        npt.assert_equal(len(DataScraper._dap_probes), 4)
+        npt.assert_equal(set(type(grid) for grid in scraper.grids.values()), {CachedGrid})
+
+        # the fake models have no depth axis, so station depths fall back to the surface
+        with pytest.warns(UserWarning, match='surface'):
+            samples = scraper.sample_models('temp', [-150.], [59.], time=['2018-07-02'], depth=[10.])
+        npt.assert_equal(len(samples), 4)
+
+        # every run gets a budget of its own, and a spent one leaves the models out
+        scraper.run_timeout = 60
+        npt.assert_equal(len(scraper.sample_models('temp', [-150.], [59.])), 4)
+        spent = Deadline(0)
+        with pytest.warns(UserWarning, match='ran out of time'):
+            npt.assert_equal(scraper.sample_models('temp', [-150.], [59.], deadline=spent), {})
+
+        # a model that can't be opened is left out, saying why
+        scraper.model_urls.append(fake.csw_url.rsplit('/', 1)[0] + '/missing.nc')
+        with pytest.warns(UserWarning, match='could not open .*missing.nc'):
+            npt.assert_equal(len(scraper.sample_models('temp', [-150.], [59.])), 4)
+        obs = pd.DataFrame({'station': ['a'], 'time': [datetime(2018, 7, 2)], 'longitude': [-150.],
+                            'latitude': [59.], 'temp': [10.]})
+        with pytest.warns(UserWarning, match='could not open .*missing.nc'):
+            scores = scraper.model_skill('temp', obs, 'temp')
+        npt.assert_equal(len(scores.index.unique('model')), 4)
+        scraper.model_urls.pop()
+
+        DataScraper._dap_probes.clear()
+        again = _scraper(fake, models_only=True)
+        again.get_records()
+        again.create_database()
+        again.get_models()
+        npt.assert_equal(set(type(grid) for grid in again.grids.values()), {CachedGrid})
+
+
+def test_save_state(tmpdir, monkeypatch):
+    """
+    A snapshot taken after the records step loads back and resumes to the observations, and
+    a save cut off while swapping snapshots leaves the previous one readable.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    path = str(tmpdir.join('snapshot'))
+    with FakeIOOS(n_stations=3, n_models=0, names=['sea_water_temperature']) as fake:
+        scraper = _scraper(fake)
+        scraper.get_records()
+        scraper.save_state(path)
+
+        loaded = DataScraper.load_state(path)
+        npt.assert_equal(loaded.stage, 'records')
+        npt.assert_equal(loaded.csw_endpoint, fake.csw_url)
+        npt.assert_equal(list(loaded.csw_records), list(scraper.csw_records))
+        df = loaded.resume(checkpoint=path)
+        npt.assert_equal(loaded.stage, 'observations')
+        npt.assert_equal(df['station_id'].nunique(), 3)
+
+    again = DataScraper.load_state(path)
+    npt.assert_equal(again.stage, 'observations')
+    npt.assert_equal(again._observations_frame().shape, df.shape)
+    npt.assert_equal(sorted(tmpdir.listdir(lambda p: p.basename.startswith('snapshot'))),
+                     [tmpdir.join('snapshot')])
+
+    # the state of a save interrupted after moving the old snapshot aside
+    tmpdir.join('snapshot').rename(tmpdir.join('snapshot.old'))
+    npt.assert_equal(DataScraper.load_state(path).stage, 'observations')
+
+
+def test_discover(tmpdir, monkeypatch):
+    """
+    The pipeline leaves the same references as the separate steps, and shares their caches.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    with FakeIOOS(n_stations=5, n_models=0, names=['sea_water_temperature'], latency=0.01) as fake:
+        scraper = _scraper(fake)
+        scraper.discover(pagesize=2)
+        npt.assert_equal(scraper.stage, 'observations')
+        npt.assert_equal(len(scraper.csw_records), 5)
+
+        requests = dict(fake.requests)
+        again = _scraper(fake)
+        again.get_records()
+        again.create_database()
+        npt.assert_equal(fake.requests['csw'], requests['csw'])
+        npt.assert_equal(list(again.df['url']), list(scraper.df['url']))
+
+        # the step by step search, made without the cache, lists the same references in the same order
+        fresh = _scraper(fake)
+        fresh.cache_ttl = 0
+        fresh.get_records(pagesize=2)
+        fresh.create_database()
+        npt.assert_equal(list(fresh.df['url']), list(scraper.df['url']))
+
+        cached = _scraper(fake)
+        df = cached.discover()
+        npt.assert_equal(fake.requests['csw'], requests['csw'] + 3)
+        npt.assert_equal(df.shape, scraper._observations_frame().shape)
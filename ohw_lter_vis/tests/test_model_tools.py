@@ -0,0 +1,235 @@
+from __future__ import absolute_import, division, print_function
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import numpy.testing as npt
+import xarray as xr
+from ohw_lter_vis import model_tools
+
+
+def make_regular(lon0=-156.):
+    """
+    A small HYCOM-like dataset on a regular grid.
+    """
+    lon = np.arange(lon0, lon0 + 16, 0.5)
+    lat = np.arange(56., 63., 0.5)
+    time = pd.date_range('2012-05-04', periods=4, freq='D')
+    data = np.random.RandomState(0).rand(len(time), 2, len(lat), len(lon))
+    return xr.Dataset({'water_temp': (('time', 'depth', 'lat', 'lon'), data)},
+                      coords={'time': time, 'depth': [0., 2.], 'lat': lat, 'lon': lon})
+
+
+def make_curvilinear():
+    """
+    A small ROMS-like dataset on a rotated grid.
+    """
+    eta, xi = np.mgrid[0:20, 0:30]
+    lon = -156 + 0.5 * xi + 0.1 * eta
+    lat = 56 + 0.4 * eta + 0.05 * xi
+    time = pd.date_range('2012-05-04', periods=2, freq='D')
+    data = np.random.RandomState(1).rand(len(time), 3, 20, 30)
+    return xr.Dataset({'temp': (('time', 's_rho', 'eta_rho', 'xi_rho'), data)},
+                      coords={'time': time,
+                              'lon_rho': (('eta_rho', 'xi_rho'), lon),
+                              'lat_rho': (('eta_rho', 'xi_rho'), lat)})
+
+
+
+def make_roms(vtransform=2):
+    """
+    make_curvilinear with the ROMS vertical grid: three s-levels over a bottom
+    sloping from 100 m to 390 m along xi.
+    """
+    ds = make_curvilinear()
+    s_rho = np.array([-5 / 6., -1 / 2., -1 / 6.])
+    return ds.assign(h=(('eta_rho', 'xi_rho'), 100. + 10. * np.mgrid[0:20, 0:30][1]),
+                     hc=10., Cs_r=('s_rho', s_rho), Vtransform=vtransform).assign_coords(s_rho=s_rho)
+
+
+def test_select_roi_regular():
+    roi = [-154, -142, 58.5, 61.]
+    sub = model_tools.select_roi(make_regular(), roi)
+    npt.assert_equal(sub.lon.values.min(), -154.)
+    npt.assert_equal(sub.lon.values.max(), -142.)
+    npt.assert_equal(sub.lat.values[[0, -1]], [58.5, 61.])
+
+    # longitudes counted from 0 to 360
+    sub = model_tools.select_roi(make_regular(lon0=204.), roi)
+    npt.assert_equal(sub.lon.values[[0, -1]], [206., 218.])
+
+
+def test_select_roi_curvilinear():
+    roi = [-150, -145, 58., 60.]
+    ds = make_curvilinear()
+    sub = model_tools.select_roi(ds.temp, roi)
+    inside = ((ds.lon_rho >= -150) & (ds.lon_rho <= -145) &
+              (ds.lat_rho >= 58) & (ds.lat_rho <= 60))
+    # every grid point in the roi survives the cut
+    assert int(inside.sum()) == int(((sub.lon_rho >= -150) & (sub.lon_rho <= -145) &
+                                     (sub.lat_rho >= 58) & (sub.lat_rho <= 60)).sum())
+    assert sub.sizes['xi_rho'] < ds.sizes['xi_rho']
+
+
+def test_dataset_pool(tmpdir):
+    paths = []
+    for k in range(3):
+        path = str(tmpdir.join('model%d.nc' % k))
+        make_regular().to_netcdf(path)
+        paths.append(path)
+
+    pool = model_tools.DatasetPool(maxsize=2)
+    first = pool.get(paths[0])
+    assert pool.get(paths[0]) is first
+    # data are not loaded until they are used
+    assert first.water_temp.chunks is not None
+    pool.get(paths[1])
+    pool.get(paths[2])
+    assert len(pool) == 2
+    assert paths[0] not in pool
+    pool.close()
+    assert len(pool) == 0
+
+
+def test_extract_points_regular():
+    ds = make_regular()
+    lon = np.array([-150., -147.1, -120.])
+    lat = np.array([59., 59.6, 59.])
+    time = pd.to_datetime(['2012-05-04 02:00', '2012-05-06 20:00', '2012-05-05 00:00'])
+    depth = [0., 1.9, 0.]
+    near = model_tools.extract_points(ds.water_temp, lon, lat, time=time, depth=depth)
+    npt.assert_equal(near.dims, ('station',))
+    npt.assert_equal(near.values[0], ds.water_temp.sel(lon=-150., lat=59.).values[0, 0])
+    npt.assert_equal(near.values[1], ds.water_temp.sel(lon=-147., lat=59.5).values[3, 1])
+    # off the grid
+    assert np.isnan(near.values[2])
+
+    lin = model_tools.extract_points(ds.water_temp.isel(time=0, depth=0), lon[:2], lat[:2],
+                                     method='bilinear')
+    expected = ds.water_temp.isel(time=0, depth=0).interp(
+        lon=xr.DataArray(lon[:2], dims='station'), lat=xr.DataArray(lat[:2], dims='station'))
+    npt.assert_almost_equal(lin.values, expected.values)
+
+
+def test_extract_points_curvilinear():
+    ds = make_curvilinear()
+    sst = ds.temp.isel(time=0, s_rho=-1)
+    # grid points come back exactly, and points half way between them are averaged
+    lon = np.array([ds.lon_rho.values[4, 7],
+                    ds.lon_rho.values[4:6, 7:9].mean()])
+    lat = np.array([ds.lat_rho.values[4, 7],
+                    ds.lat_rho.values[4:6, 7:9].mean()])
+    near = model_tools.extract_points(sst, lon, lat)
+    npt.assert_equal(near.values[0], sst.values[4, 7])
+    lin = model_tools.extract_points(sst, lon, lat, method='bilinear')
+    npt.assert_almost_equal(lin.values[0], sst.values[4, 7])
+    npt.assert_almost_equal(lin.values[1], sst.values[4:6, 7:9].mean())
+    # the locator is built once per grid
+    assert model_tools.grid_locator(ds.lon_rho.values, ds.lat_rho.values) is \
+        model_tools.grid_locator(ds.lon_rho.values, ds.lat_rho.values)
+
+
+
+def test_extract_points_roms_depth():
+    """
+    Station depths pick the s-level nearest them at each station's grid point.
+    """
+    ds = make_roms()
+    depth = model_tools.roms_depth(ds)
+    # with Cs_r equal to s_rho both transforms put the levels at -h * s_rho
+    npt.assert_almost_equal(depth.values[:, 4, 7], [170 * 5 / 6., 85., 170 / 6.])
+    npt.assert_almost_equal(model_tools.roms_depth(make_roms(vtransform=1)).values[:, 4, 7], depth.values[:, 4, 7])
+    assert model_tools.roms_depth(make_curvilinear()) is None
+
+    temp = model_tools.add_roms_depth(ds.temp.isel(time=0), ds)
+    lon = ds.lon_rho.values[[4, 4, 10], [7, 7, 20]]
+    lat = ds.lat_rho.values[[4, 4, 10], [7, 7, 20]]
+    near = model_tools.extract_points(temp, lon, lat, depth=[90., 0., 300.])
+    npt.assert_equal(near.values, [temp.values[1, 4, 7], temp.values[2, 4, 7], temp.values[0, 10, 20]])
+    lin = model_tools.extract_points(temp, lon[:1], lat[:1], depth=90., method='bilinear')
+    npt.assert_almost_equal(lin.values, [temp.values[1, 4, 7]])
+
+    # without the vertical grid there is nothing to match the depths to
+    with pytest.raises(ValueError):
+        model_tools.extract_points(make_curvilinear().temp.isel(time=0), lon, lat, depth=[90., 0., 300.])
+
+
+def test_regridder(tmpdir, monkeypatch):
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    lon, lat = model_tools.nga_grid(resolution=0.25)
+    npt.assert_equal(lon[[0, -1]], [-154., -142.])
+    npt.assert_equal(lat[[0, -1]], [58.5, 61.])
+
+    # regular source: agrees with xarray's own linear interpolation
+    sst = make_regular().water_temp.isel(depth=0)
+    regrid = model_tools.regridder(sst.lon.values, sst.lat.values, lon, lat)
+    out = regrid(sst.chunk({'time': 1}))
+    npt.assert_equal(out.dims, ('time', 'lat', 'lon'))
+    npt.assert_almost_equal(out.values, sst.interp(lon=lon, lat=lat).values)
+    # weights are reused, from memory and from disk
+    assert model_tools.regridder(sst.lon.values, sst.lat.values, lon, lat) is regrid
+    model_tools._regridders.clear()
+    again = model_tools.regridder(sst.lon.values, sst.lat.values, lon, lat)
+    npt.assert_equal((again.weights != regrid.weights).nnz, 0)
+
+    # curvilinear source with a land point
+    ds = make_curvilinear()
+    temp = ds.temp.isel(s_rho=-1).copy()
+    temp[:, 10, 10] = np.nan
+    out = model_tools.regridder(ds.lon_rho.values, ds.lat_rho.values, lon, lat)(temp)
+    npt.assert_equal(out.shape, (2, len(lat), len(lon)))
+    assert np.isfinite(out.values).sum() > 0
+
+
+def test_cached_slices(tmpdir, monkeypatch):
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    sst = make_regular().water_temp.isel(depth=0)
+    pulled = []
+
+    class Remote(object):
+        """ stands in for a remote selection and records what gets read """
+        def __init__(self, da):
+            self.da = da
+            self.name = da.name
+
+        @property
+        def coords(self):
+            return self.da.coords
+
+        def __getitem__(self, name):
+            return self.da[name]
+
+        def sel(self, time):
+            pulled.append(len(time))
+            return self.da.sel(time=time)
+
+    first = sst.isel(time=[0, 1])
+    out = model_tools.cached_slices(Remote(first), 'model.nc')
+    npt.assert_equal(out.values, first.values)
+
+    # only the new step is pulled when the dates are widened
+    wider = sst.isel(time=[0, 1, 2])
+    out = model_tools.cached_slices(Remote(wider), 'model.nc')
+    npt.assert_equal(pulled, [2, 1])
+    npt.assert_equal(out.values, wider.values)
+
+    # another level of the same model is stored apart
+    deeper = make_regular().water_temp.isel(depth=1, time=[0, 1])
+    out = model_tools.cached_slices(Remote(deeper), 'model.nc')
+    npt.assert_equal(pulled, [2, 1, 2])
+    npt.assert_equal(out.values, deeper.values)
+
+    # a forecast run rewrote the first step: once the ttl has passed it is pulled again
+    newer = wider.copy(data=wider.values + 1)
+    out = model_tools.cached_slices(Remote(newer.isel(time=[0])), 'model.nc', ttl=3600)
+    npt.assert_equal(out.values, wider.values[:1])
+    later = time.time() + 7200
+    monkeypatch.setattr(model_tools.time, 'time', lambda: later)
+    out = model_tools.cached_slices(Remote(newer.isel(time=[0])), 'model.nc', ttl=3600)
+    npt.assert_equal(pulled, [2, 1, 2, 1])
+    npt.assert_equal(out.values, newer.values[:1])
+    # the other steps are as old by now; once pulled again they are fresh
+    out = model_tools.cached_slices(Remote(newer), 'model.nc', ttl=3600)
+    out = model_tools.cached_slices(Remote(newer), 'model.nc', ttl=3600)
+    npt.assert_equal(pulled, [2, 1, 2, 1, 2])
+    npt.assert_equal(out.values, newer.values)
@@ -0,0 +1,182 @@
+from __future__ import absolute_import, division, print_function
+import os
+import time
+import numpy.testing as npt
+import pandas as pd
+from ohw_lter_vis import obs_store
+
+
+def T(s):
+    return pd.Timestamp(s)
+
+
+def test_intervals():
+    held = [(T('2016-01-10'), T('2016-01-20')), (T('2016-01-01'), T('2016-01-05')),
+            (T('2016-01-04'), T('2016-01-08'))]
+    npt.assert_equal(obs_store.merge_intervals(held),
+                     [(T('2016-01-01'), T('2016-01-08')), (T('2016-01-10'), T('2016-01-20'))])
+    gaps = obs_store.missing_intervals(T('2015-12-30'), T('2016-01-25'), held)
+    npt.assert_equal(gaps, [(T('2015-12-30'), T('2016-01-01')), (T('2016-01-08'), T('2016-01-10')),
+                            (T('2016-01-20'), T('2016-01-25'))])
+    assert obs_store.missing_intervals(T('2016-01-02'), T('2016-01-07'), held) == []
+
+
+def test_sos_keys():
+    url = ('https://sos.aoos.org/sos/sos/kvp?service=SOS&request=GetObservation&version=1.0.0'
+           '&observedProperty=http://mmisw.org/ont/cf/parameter/sea_water_temperature'
+           '&offering=urn:ioos:station:gaxsys:46080&responseFormat=text/csv'
+           '&eventTime=2016-04-19T00:00:00/2016-05-19T00:00:00')
+    npt.assert_equal(obs_store.sos_keys(url), ('urn:ioos:station:gaxsys:46080', 'sea_water_temperature'))
+    # without a station, urls get one of their own, whatever their time window
+    other = 'https://example.org/sos?request=GetObservation&observedProperty=sea_water_temperature&eventTime='
+    station, name = obs_store.sos_keys(other + '2016-01-01/2016-02-01')
+    assert station.startswith('url-') and name == 'sea_water_temperature'
+    npt.assert_equal(obs_store.sos_keys(other + 'latest'), (station, name))
+    assert obs_store.sos_keys(other.replace('example', 'example2'))[0] != station
+
+
+def test_observation_store(tmpdir, monkeypatch):
+    later = time.time() + 7200
+    store = obs_store.ObservationStore(str(tmpdir))
+    key = ('urn:ioos:station:x:1', 'sea_water_temperature')
+    assert store.gaps(*key, '2016-01-01', '2016-01-10') == [(T('2016-01-01'), T('2016-01-10'))]
+
+    def frame(start, periods):
+        index = pd.date_range(start, periods=periods, freq='D', tz='UTC', name='date_time')
+        return pd.DataFrame({'value': index.day}, index=index)
+
+    store.add(*key, frame('2016-01-01', 5), [(T('2016-01-01'), T('2016-01-05'))])
+    npt.assert_equal(store.gaps(*key, '2016-01-01', '2016-01-10'), [(T('2016-01-05'), T('2016-01-10'))])
+    # the boundary row comes back twice, but is stored once
+    store.add(*key, frame('2016-01-05', 6), [(T('2016-01-05'), T('2016-01-10'))])
+    assert store.gaps(*key, '2016-01-01', '2016-01-10') == []
+    df = store.read(*key, '2016-01-03', '2016-01-08')
+    npt.assert_equal(len(df), 6)
+    assert df.index.is_monotonic_increasing
+
+    # past the ttl the windows are due again, and what is fetched then replaces what was held
+    expired = obs_store.ObservationStore(str(tmpdir), ttl=3600)
+    assert expired.gaps(*key, '2016-01-01', '2016-01-10') == []
+    monkeypatch.setattr(obs_store.time, 'time', lambda: later)
+    npt.assert_equal(expired.gaps(*key, '2016-01-01', '2016-01-10'), [(T('2016-01-01'), T('2016-01-10'))])
+    fixed = frame('2016-01-01', 3)
+    fixed['value'] = -1
+    expired.add(*key, fixed, [(T('2016-01-01'), T('2016-01-03'))])
+    npt.assert_equal(expired.gaps(*key, '2016-01-01', '2016-01-10'), [(T('2016-01-03'), T('2016-01-10'))])
+    npt.assert_equal(expired.read(*key)['value'].values, [-1, -1, -1, 4, 5, 6, 7, 8, 9, 10])
+
+
+def test_interrupted_add(tmpdir, monkeypatch):
+    """
+    An add that fails while writing leaves the store as it was, with no coverage for what was lost.
+    """
+    store = obs_store.ObservationStore(str(tmpdir))
+    key = ('urn:ioos:station:x:1', 'sea_water_temperature')
+    index = pd.date_range('2016-01-01', periods=5, freq='D', tz='UTC', name='date_time')
+    store.add(*key, pd.DataFrame({'value': range(5)}, index=index), [(T('2016-01-01'), T('2016-01-05'))])
+
+    def broken(self, path, *args, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b'PAR1')
+        raise OSError('disk full')
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', broken)
+    later = pd.DataFrame({'value': [-1]}, index=index[-1:] + pd.Timedelta(days=3))
+    try:
+        store.add(*key, later, [(T('2016-01-05'), T('2016-01-10'))])
+    except OSError:
+        pass
+    else:
+        raise AssertionError('the failed write went unnoticed')
+    monkeypatch.undo()
+    npt.assert_equal(store.gaps(*key, '2016-01-01', '2016-01-10'), [(T('2016-01-05'), T('2016-01-10'))])
+    npt.assert_equal(store.read(*key)['value'].values, range(5))
+
+
+def test_plan_windows():
+    start, stop = T('2016-01-01'), T('2016-03-15')
+    windows = obs_store.plan_windows(start, stop, pd.Timedelta(days=30))
+    npt.assert_equal(len(windows), 3)
+    npt.assert_equal(windows[0][0], start)
+    npt.assert_equal(windows[-1][1], stop)
+    for (lo, hi), (nlo, nhi) in zip(windows[:-1], windows[1:]):
+        assert hi == nlo
+    assert obs_store.plan_windows(start, stop) == [(start, stop)]
+
+
+def test_combine_windows():
+    index = pd.date_range('2016-01-01', periods=10, freq='h', name='date_time')
+    df = pd.DataFrame({'value': range(10)}, index=index)
+    # out of order, overlapping on the boundary row
+    out = obs_store.combine_windows([df.iloc[4:], df.iloc[:5], None])
+    npt.assert_equal(out['value'].values, range(10))
+
+    # rows are told apart by their series; a row fetched again replaces the old one
+    two = pd.concat([df.assign(station_id='a'), df.assign(station_id='b')])
+    again = df.iloc[:2].assign(station_id='a', value=-1)
+    out = obs_store.combine_windows([two, again])
+    npt.assert_equal(len(out), 20)
+    npt.assert_equal(out[out['station_id'] == 'a']['value'].values[:3], [-1, -1, 2])
+    npt.assert_equal(out.index.name, 'date_time')
+
+
+def test_stream_to_sink(tmpdir):
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    index = pd.date_range('2016-01-01', periods=25, freq='h', tz='UTC', name='date_time')
+    body = pd.DataFrame({'station_id': 'x', 'value': range(25)}, index=index).to_csv().encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = 'http://127.0.0.1:%d/sos' % server.server_port
+        sink = obs_store.ParquetSink(str(tmpdir))
+        rows = obs_store.stream_sos_csv(url, sink, chunksize=10)
+    finally:
+        server.shutdown()
+    npt.assert_equal(rows, 25)
+    npt.assert_equal(len(sink.files), 3)
+    npt.assert_equal([len(c) for c in sink.iter_chunks(columns=['value'])], [10, 10, 5])
+    npt.assert_equal(sink.read()['value'].values, range(25))
+
+
+def test_parquet_sink(tmpdir, monkeypatch):
+    """
+    A url's chunks can be dropped, and a sink removes the directory it made when closed.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+    chunk = pd.DataFrame({'value': range(5)})
+    with obs_store.ParquetSink() as sink:
+        sink(chunk, 'http://a')
+        sink(chunk, 'http://b')
+        sink(chunk, 'http://b')
+        sink.discard('http://b')
+        sink(chunk, 'http://b')
+        npt.assert_equal(len(sink), 5)
+        npt.assert_equal(len(os.listdir(sink.path)), 1)
+        npt.assert_equal(sink.read(deduplicate=False)['value'].values, range(5))
+
+        # only the columns asked for are read, with the index, a few rows at a time
+        times = pd.date_range('2018-07-01', periods=5, freq='h', name='date_time')
+        sink(pd.DataFrame({'a': range(5), 'b': range(5)}, index=times), 'http://c')
+        chunks = list(sink.iter_chunks(columns=['b', 'missing'], batch_size=2))
+        npt.assert_equal([len(df) for df in chunks], [2, 2, 1])
+        npt.assert_equal(list(chunks[-1].columns), ['b'])
+        npt.assert_equal(chunks[-1].index.name, 'date_time')
+    assert not os.path.exists(sink.path)
+
+    # a directory that was given is left alone
+    sink = obs_store.ParquetSink(str(tmpdir.join('mine')))
+    sink(chunk, 'http://a')
+    sink.close()
+    npt.assert_equal(len(os.listdir(sink.path)), 1)
@@ -0,0 +1,59 @@
+from __future__ import absolute_import, division, print_function
+import asyncio
+import threading
+import time
+import numpy.testing as npt
+from ohw_lter_vis.pipeline import StagedPipeline
+
+
+def test_pipeline_routing():
+    """
+    Items go to the handler of their stage, repeated items are dropped, and
+    failures are reported instead of raised.
+    """
+    def fail(item):
+        raise ValueError(item['url'])
+
+    def route(item):
+        return item.get('stage')
+
+    async def produce(pipe):
+        for url, stage in [('http://a.org/1', 'up'), ('http://a.org/1', 'up'),
+                           ('http://b.org/2', 'bad'), ('http://c.org/3', None)]:
+            await pipe.put(dict(url=url, stage=stage))
+
+    pipe = StagedPipeline({'up': lambda item: item['url'].upper(), 'bad': fail},
+                          route, key=lambda item: item['url'], max_workers=2)
+    results = asyncio.run(pipe.run(produce))
+    npt.assert_equal([r['result'] for r in results['up']], ['HTTP://A.ORG/1'])
+    npt.assert_equal(len(results['bad']), 1)
+    assert isinstance(results['bad'][0]['error'], ValueError)
+
+
+def test_pipeline_per_host():
+    """
+    No host gets more than per_host requests at once, and a small queue holds
+    the producer back without losing anything.
+    """
+    lock = threading.Lock()
+    active = {}
+    peak = {}
+
+    def fetch(item):
+        host = item['url'].split('/')[2]
+        with lock:
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+        time.sleep(0.02)
+        with lock:
+            active[host] -= 1
+        return host
+
+    async def produce(pipe):
+        for i in range(12):
+            await pipe.put(dict(url='http://{}.org/{}'.format('ab'[i % 2], i)))
+
+    pipe = StagedPipeline({'get': fetch}, lambda item: 'get', max_workers=6, per_host=2, queue_size=1)
+    results = asyncio.run(pipe.run(produce))
+    npt.assert_equal(len(results['get']), 12)
+    assert max(peak.values()) <= 2
@@ -0,0 +1,60 @@
+from __future__ import absolute_import, division, print_function
+import numpy.testing as npt
+import pandas as pd
+import pytest
+from ohw_lter_vis.load_Seward_CTD import CRUISES, load_cruise
+from ohw_lter_vis.load_Seward_zooplankton import load_zooplankton
+from ohw_lter_vis.query import query, query_plan
+from ohw_lter_vis.synthetic import write_archive
+
+
+def _warm(tmpdir, monkeypatch):
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    files = write_archive(str(tmpdir.join('remote')), n_cruises=4, n_stations=40, max_depth=250, n_taxa=5)
+    for name, urls in zip(files['cruises'], files['ctd']):
+        monkeypatch.setitem(CRUISES, name, urls)
+    ctd = pd.concat([load_cruise(name) for name in files['cruises']], ignore_index=True)
+    return ctd, load_zooplankton(dataurl=files['zooplankton'])
+
+
+def _same_rows(result, expected, by):
+    result = result.sort_values(by).reset_index(drop=True)
+    expected = expected[result.columns].sort_values(by).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_query_matches_pandas(tmpdir, monkeypatch):
+    """
+    query gives the same rows and columns as filtering the loaded frames in pandas.
+    """
+    ctd, zoo = _warm(tmpdir, monkeypatch)
+    surface = query('ctd', pressure=0, variables=['temperature', 'salinity'])
+    npt.assert_equal(list(surface.columns), ['time', 'latitude', 'longitude', 'pressure', 'temperature', 'salinity'])
+    _same_rows(surface, ctd[ctd['pressure'] == 0], ['time'])
+
+    keep = ((ctd['time'] >= '2013-01-01') & (ctd['pressure'] <= 20) & (ctd['longitude'] <= -148.5)
+            & (ctd['latitude'] >= 59))
+    subset = query('ctd', bbox=(-180, -148.5, 59, 90), time=('2013-01-01', None), pressure=(None, 20))
+    _same_rows(subset, ctd[keep], ['time', 'pressure'])
+
+    tows = query('zooplankton', time=('2012-09-01', '2012-12-31'), variables=['Class', 'Abundance (no m-3)'])
+    keep = (zoo['time'] >= '2012-09-01') & (zoo['time'] <= '2012-12-31')
+    _same_rows(tows, zoo[keep], ['time', 'Class', 'Abundance (no m-3)'])
+    with pytest.raises(ValueError):
+        query('zooplankton', pressure=0)
+
+
+def test_query_pruning(tmpdir, monkeypatch):
+    """
+    Time ranges skip the files of other years and cruises, and surface slices skip the
+    deeper row groups.
+    """
+    _warm(tmpdir, monkeypatch)
+    everything = query_plan('ctd')
+    npt.assert_equal(everything['files_read'], 4)
+    npt.assert_equal(everything['row_groups_read'], everything['row_groups'])
+    one_cruise = query_plan('ctd', time=('2013-05-01', '2013-06-01'))
+    npt.assert_equal(one_cruise['files_read'], 1)
+    surface = query_plan('ctd', pressure=0)
+    npt.assert_equal(surface['row_groups_read'], 4)
+    npt.assert_equal(surface['row_groups'] > 4, True)
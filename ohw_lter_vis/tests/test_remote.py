@@ -0,0 +1,123 @@
+from __future__ import absolute_import, division, print_function
+import threading
+import time
+import numpy.testing as npt
+from ohw_lter_vis import remote
+
+
+def test_fetch_concurrently():
+    """
+    Results come back in the order of the urls, and failures are reported
+    instead of raised.
+    """
+    def fetch(url):
+        if url.endswith('bad'):
+            raise ValueError(url)
+        return [url] * 3
+
+    urls = ['http://a.org/1', 'http://b.org/bad', 'http://a.org/2']
+    results = remote.fetch_concurrently(fetch, urls, max_workers=3)
+    npt.assert_equal([r['url'] for r in results], urls)
+    npt.assert_equal(results[0]['result'], [urls[0]] * 3)
+    assert isinstance(results[1]['error'], ValueError)
+
+    report = remote.fetch_report(results)
+    npt.assert_equal(list(report['ok']), [True, False, True])
+    npt.assert_equal(list(report['host']), ['a.org', 'b.org', 'a.org'])
+    npt.assert_equal(report['rows'][0], 3)
+
+
+def test_fetch_concurrently_per_host():
+    """
+    No more than per_host requests run against a single host at once.
+    """
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def fetch(url):
+        with lock:
+            active.append(url)
+            peak.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.remove(url)
+
+    urls = ['http://a.org/%d' % i for i in range(8)]
+    remote.fetch_concurrently(fetch, urls, max_workers=8, per_host=2)
+    assert max(peak) <= 2
+
+
+def test_fetch_concurrently_timeout():
+    """
+    Urls that don't answer within the timeout are abandoned with a TimeoutError.
+    """
+    def fetch(url):
+        if url.endswith('slow'):
+            time.sleep(1)
+        return url
+
+    urls = ['http://a.org/fast', 'http://a.org/slow']
+    tic = time.perf_counter()
+    results = remote.fetch_concurrently(fetch, urls, timeout=0.2)
+    assert time.perf_counter() - tic < 0.9
+    npt.assert_equal(results[0]['result'], urls[0])
+    assert isinstance(results[1]['error'], TimeoutError)
+
+
+def test_canonical_url():
+    a = 'HTTPS://sos.aoos.org:443/sos/sos/kvp/?service=SOS&offering=urn:ioos:station:x:1&eventTime=2016-01-01/2016-02-01#top'
+    b = 'https://sos.aoos.org/sos/sos/kvp?offering=urn:ioos:station:x:1&service=SOS&eventTime=2017-01-01/2017-02-01'
+    npt.assert_equal(remote.canonical_url(a), remote.canonical_url(b))
+    npt.assert_equal(remote.canonical_url(b),
+                     'https://sos.aoos.org/sos/sos/kvp?offering=urn:ioos:station:x:1&service=SOS')
+    assert remote.canonical_url('http://a.org:8080/dodsC/x') == 'http://a.org:8080/dodsC/x'
+    assert remote.canonical_url(a, drop_params=()) != remote.canonical_url(b, drop_params=())
+
+
+def test_sessions():
+    """
+    Every host gets one shared session.
+    """
+    a = remote.get_session('http://a.org/1')
+    assert remote.get_session('http://A.org/2?x=1') is a
+    assert remote.get_session('http://b.org/1') is not a
+    remote.close_sessions()
+    assert remote.get_session('http://a.org/1') is not a
+
+
+def test_deadline():
+    """
+    Timeouts shrink as the deadline approaches, and nothing runs once it has passed.
+    """
+    unlimited = remote.Deadline()
+    npt.assert_equal(unlimited.timeout(), remote.TIMEOUT)
+    npt.assert_equal(unlimited.remaining(5), 5)
+
+    deadline = remote.Deadline(0.2)
+    connect, read = deadline.timeout((10, 60))
+    assert connect <= 0.2 and read <= 0.2
+    npt.assert_equal(deadline.call(lambda x: x + 1, 1), 2)
+    npt.assert_equal(deadline.call(lambda x, y=0: x + y, 1, y=2), 3)
+    try:
+        deadline.call(time.sleep, 1)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError('call did not time out')
+    assert deadline.expired
+    try:
+        remote.http_get('http://a.org/1', deadline=deadline)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError('request went ahead after the deadline')
+
+
+def test_read_text(tmpdir):
+    """
+    Local files are read directly.
+    """
+    path = tmpdir.join('a.txt')
+    path.write('one\ntwo\n')
+    npt.assert_equal(remote.read_text(str(path)), 'one\ntwo\n')
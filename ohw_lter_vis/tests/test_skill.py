@@ -0,0 +1,75 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pandas as pd
+import pytest
+import numpy.testing as npt
+import xarray as xr
+from ohw_lter_vis import model_tools, skill
+
+
+def test_skill_accumulator():
+    """
+    Adding values in batches gives the same statistics as computing them at once.
+    """
+    rng = np.random.RandomState(0)
+    obs = rng.rand(40) * 10
+    model = obs + 0.5 + rng.randn(40) * 0.1
+    acc = skill.SkillAccumulator()
+    for part in np.array_split(np.arange(40), 3):
+        acc.update('GAK1', 0., 'temp', model[part], obs[part])
+    # missing values are skipped
+    acc.update(['GAK1'], 0., 'temp', [np.nan], [1.])
+    res = acc.result().loc[('GAK1', 0., 'temp')]
+    npt.assert_equal(res['n'], 40)
+    npt.assert_almost_equal(res['bias'], np.mean(model - obs))
+    npt.assert_almost_equal(res['rmse'], np.sqrt(np.mean((model - obs) ** 2)))
+    npt.assert_almost_equal(res['corr'], np.corrcoef(model, obs)[0, 1])
+
+
+def test_evaluate_skill():
+    time = pd.date_range('2012-05-04', periods=5, freq='D')
+    lon = np.arange(-150., -144.)
+    lat = np.arange(58., 61.)
+    data = np.arange(5 * 3 * 6, dtype=float).reshape(5, 3, 6)
+    da = xr.DataArray(data, dims=('time', 'lat', 'lon'),
+                      coords={'time': time, 'lat': lat, 'lon': lon}, name='temp')
+    obs = pd.DataFrame({'station': ['GAK1', 'GAK1', 'GAK2', 'GAK2'],
+                        'time': pd.to_datetime(['2012-05-04 01:00', '2012-05-06 23:00',
+                                                '2012-05-05 00:00', '2012-05-20 00:00']),
+                        'longitude': [-150., -150., -147., -147.],
+                        'latitude': [58., 58., 60., 60.]})
+    obs['temperature'] = [0., 54., 36., 0.]
+    acc = skill.evaluate_skill(da, obs, 'temperature', variable='temp',
+                               time_tolerance=pd.Timedelta(hours=6))
+    res = acc.result()
+    # the last GAK2 cast is too far from any model time
+    npt.assert_equal(res['n'].values, [2, 1])
+    npt.assert_almost_equal(res['bias'].values, [0., -3.])
+
+
+def test_evaluate_skill_depths():
+    """
+    Depths are matched on ROMS s-levels, only the grid around the stations is used,
+    and a model without depths is refused rather than compared at one level.
+    """
+    eta, xi = np.mgrid[0:10, 0:12]
+    time = pd.date_range('2012-05-04', periods=2, freq='D')
+    data = np.arange(2 * 3 * 10 * 12, dtype=float).reshape(2, 3, 10, 12)
+    da = xr.DataArray(data, dims=('time', 's_rho', 'eta_rho', 'xi_rho'), name='temp',
+                      coords={'time': time, 'lon_rho': (('eta_rho', 'xi_rho'), -150. + 0.5 * xi),
+                              'lat_rho': (('eta_rho', 'xi_rho'), 58. + 0.25 * eta)})
+    obs = pd.DataFrame({'station': ['GAK1', 'GAK1'], 'time': time, 'longitude': [-148., -148.],
+                        'latitude': [59., 59.], 'depth': [5., 95.], 'temperature': [0., 0.]})
+    with pytest.raises(ValueError):
+        skill.evaluate_skill(da, obs, 'temperature', depth_col='depth')
+
+    depth_rho = xr.DataArray(np.broadcast_to([[[90.]], [[50.]], [[10.]]], (3, 10, 12)),
+                             dims=('s_rho', 'eta_rho', 'xi_rho'))
+    res = skill.evaluate_skill(da.assign_coords(depth_rho=depth_rho), obs, 'temperature',
+                               depth_col='depth').result()
+    # (time, s_rho, eta 4, xi 4): the top level on day one, the bottom one on day two
+    npt.assert_equal(res.loc[('GAK1', 5., 'temperature'), 'bias'], data[0, 2, 4, 4])
+    npt.assert_equal(res.loc[('GAK1', 95., 'temperature'), 'bias'], data[1, 0, 4, 4])
+
+    window = model_tools.station_window(da, obs['longitude'], obs['latitude'])
+    npt.assert_equal(window.shape, (2, 3, 3, 3))
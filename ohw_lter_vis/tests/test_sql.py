@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function
+import numpy.testing as npt
+import pandas as pd
+from ohw_lter_vis.load_Seward_CTD import CRUISES, load_cruise
+from ohw_lter_vis.load_Seward_zooplankton import load_zooplankton
+from ohw_lter_vis.obs_store import ObservationStore
+from ohw_lter_vis.sql import Database, connect
+from ohw_lter_vis.synthetic import write_archive
+
+
+def _warm(tmpdir, monkeypatch):
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    files = write_archive(str(tmpdir.join('remote')), n_cruises=3, n_stations=9, max_depth=30, n_taxa=4)
+    for name, urls in zip(files['cruises'], files['ctd']):
+        monkeypatch.setitem(CRUISES, name, urls)
+        load_cruise(name)
+    return pd.concat([load_cruise(name) for name in files['cruises']]), load_zooplankton(dataurl=files['zooplankton'])
+
+
+def test_views(tmpdir, monkeypatch):
+    """
+    Both engines give the same casts, and tow_cast matches the notebook's merge_asof within each cruise.
+    """
+    ctd, zoo = _warm(tmpdir, monkeypatch)
+    by_time = ctd.groupby(['cruise', 'time']).agg({'salinity': 'mean', 'temperature': 'mean'}).reset_index()
+    expected = pd.merge_asof(zoo.sort_values('time'), by_time.sort_values('time'), on='time',
+                             left_by='Cruise', right_by='cruise', direction='nearest')
+    expected = expected.groupby('Class')['temperature'].mean()
+    for engine in ('duckdb', 'sqlite'):
+        with connect(engine=engine) as db:
+            npt.assert_equal(db.tables(), ['casts', 'ctd', 'profiles', 'tow_cast', 'tows', 'zooplankton'])
+            casts = db.sql('SELECT cruise, count(*) AS n FROM casts GROUP BY cruise ORDER BY cruise')
+            npt.assert_equal(list(casts['n']), [9, 9, 9])
+            npt.assert_equal(db.sql('SELECT count(*) AS n FROM tow_cast')['n'][0], len(zoo))
+            joined = db.sql('SELECT class, avg(temperature) AS t FROM tow_cast GROUP BY class ORDER BY class')
+            npt.assert_almost_equal(joined['t'].values, expected.values)
+            # a tow is only matched to casts of its own cruise, and kept without one if there are none
+            db.register('zooplankton', zoo.assign(Cruise=zoo['Cruise'].where(zoo['Cruise'] != 'TXF12', 'TXF99')))
+            db.create_views()
+            matched = db.sql('SELECT cruise, count(cast_id) AS n, count(*) AS tows, min(cast_cruise = cruise) AS own '
+                             'FROM tow_cast GROUP BY cruise ORDER BY cruise')
+            npt.assert_equal(list(matched['cruise']), ['TXF99', 'TXS12', 'TXS13'])
+            npt.assert_equal(matched['n'].values, [0] + list(matched['tows'].values[1:]))
+            assert matched['own'].values[1:].all()
+            shallow = db.sql('SELECT count(*) AS n FROM profiles WHERE pressure <= ?', [5])['n'][0]
+            npt.assert_equal(shallow, (ctd['pressure'] <= 5).sum())
+
+
+def test_register(tmpdir, monkeypatch):
+    """
+    DataFrames and the observation store can be registered alongside the cache.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir.join('cache')))
+    times = pd.date_range('2018-07-01', periods=4, freq='h', name='date_time')
+    df = pd.DataFrame({'sea_water_temperature (C)': [1., 2., 3., 4.]}, index=times)
+    ObservationStore().add('urn:station:46076', 'sea_water_temperature', df, [(times[0], times[-1])])
+    for engine in ('duckdb', 'sqlite'):
+        with Database(engine=engine) as db:
+            npt.assert_equal(db.attach_cache(), ['observations'])
+            db.register('stations', pd.DataFrame({'station': ['urn_station_46076'], 'name': ['Cape Cleare']}))
+            result = db.sql('''SELECT name, standard_name, avg("sea_water_temperature (C)") AS t
+                               FROM observations JOIN stations USING (station) GROUP BY name, standard_name''')
+            npt.assert_equal(list(result.iloc[0]), ['Cape Cleare', 'sea_water_temperature', 2.5])
@@ -0,0 +1,66 @@
+from __future__ import absolute_import, division, print_function
+import numpy.testing as npt
+from ohw_lter_vis import standard_names
+
+
+def test_search():
+    """
+    Keywords, abbreviations and shorthands find ranked standard names.
+    """
+    index = standard_names.StandardNameIndex(['sea_water_temperature', 'air_temperature',
+                                              'sea_water_temperature_anomaly', 'sea_water_salinity',
+                                              'partial_pressure_of_carbon_dioxide_in_sea_water'])
+    npt.assert_equal(index.search('sea water temperature'),
+                     ['sea_water_temperature', 'sea_water_temperature_anomaly'])
+    npt.assert_equal(index.search('temp', limit=3),
+                     ['sea_water_temperature', 'sea_water_temperature_anomaly', 'air_temperature'])
+    npt.assert_equal(index.search('co2'), ['partial_pressure_of_carbon_dioxide_in_sea_water'])
+    npt.assert_equal(index.search('nitrate'), [])
+    npt.assert_equal(index.prefix('sea_water_t'), ['sea_water_temperature', 'sea_water_temperature_anomaly'])
+    assert 'air_temperature' in index
+
+
+def test_fetch_labels():
+    """
+    The bundled table still covers the keywords the notebooks use.
+    """
+    for keyword in ['temperature', 'salinity', 'oxygen', 'co2', 'methane']:
+        assert len(standard_names.fetch_labels(keyword)) > 0
+    assert 'sea_water_temperature' in standard_names.fetch_labels('temperature', limit=2)
+    npt.assert_equal(standard_names.fetch_labels('salinity', available=['sea_water_salinity']),
+                     ['sea_water_salinity'])
+    # only sea water and sea surface names, unless asked for all of them
+    temperature = standard_names.fetch_labels('temperature')
+    assert all('sea_water' in label or 'sea_surface' in label for label in temperature)
+    assert 'air_temperature' in standard_names.fetch_labels('temperature', phrases=None)
+    npt.assert_equal(standard_names.fetch_labels('air temperature', limit=1), ['air_temperature'])
+
+
+def test_narrow_labels(tmpdir, monkeypatch):
+    """
+    Labels the catalogue never had and labels covered by another wildcard are dropped.
+    """
+    monkeypatch.setenv('OHW_LTER_VIS_CACHE', str(tmpdir))
+
+    class Record():
+        subjects = ['sea_water_temperature']
+        title = 'CTD casts'
+        abstract = None
+
+    class XmlRecord():
+        # as the catalogue sees it: the whole record, in any case
+        xml = b'<csw:Record><dc:description>SEA_WATER_PRACTICAL_SALINITY</dc:description></csw:Record>'
+
+    labels = ['sea_water_temperature', 'sea_water_cox_salinity', 'sea_water_temperature_anomaly',
+              'sea_water_practical_salinity']
+    standard_names.remember_catalogue_names('gak', labels, {'a': Record(), 'b': XmlRecord()})
+    queried, found = standard_names.catalogue_names('gak')
+    npt.assert_equal(sorted(found), ['sea_water_practical_salinity', 'sea_water_temperature'])
+    # other searches have learned nothing yet
+    npt.assert_equal(standard_names.catalogue_names('elsewhere'), (set(), set()))
+    npt.assert_equal(standard_names.catalogue_names('gak', ttl=-1), (set(), set()))
+    labels = labels[:3]
+    npt.assert_equal(standard_names.narrow_labels(labels + ['sea_water_salinity'], queried, found),
+                     ['sea_water_temperature', 'sea_water_salinity'])
+    npt.assert_equal(standard_names.narrow_labels(['sea_water_cox_salinity'], queried, found),
+                     ['sea_water_cox_salinity'])
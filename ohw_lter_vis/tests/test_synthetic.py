@@ -0,0 +1,38 @@
+from __future__ import absolute_import, division, print_function
+import numpy.testing as npt
+import pandas as pd
+from ohw_lter_vis.load_Seward_CTD import make_CTD_dataframe
+from ohw_lter_vis.load_Seward_zooplankton import make_zooplankton_dataframe
+from ohw_lter_vis.synthetic import write_archive
+
+
+def test_synthetic_files_load(tmpdir):
+    """
+    Synthetic CTD pairs and zooplankton files go through the loaders, and tows
+    line up with casts.
+    """
+    files = write_archive(str(tmpdir), n_cruises=2, n_stations=12, max_depth=50, n_taxa=5, seed=3)
+    npt.assert_equal(files['cruises'], ['TXS12', 'TXF12'])
+    ctd = make_CTD_dataframe(*files['ctd'][1])
+    npt.assert_equal(ctd['id'].nunique(), 12)
+    npt.assert_equal(ctd['pressure'].max(), 50)
+    npt.assert_equal((ctd['cruise'] == 'TXF12').all(), True)
+    zoo = make_zooplankton_dataframe(dataurl=files['zooplankton'])
+    npt.assert_equal(len(zoo), 2 * 4 * 5)
+    npt.assert_equal(len(zoo.columns), 32)
+    casts = ctd.groupby('time').first().reset_index()
+    tows = zoo[zoo['Cruise'] == 'TXF12'].sort_values('time')
+    joined = pd.merge_asof(tows, casts[['time', 'station']], on='time', direction='nearest')
+    npt.assert_equal((joined['Station'] == joined['station']).all(), True)
+
+
+def test_synthetic_is_deterministic(tmpdir):
+    """
+    The same seed writes the same bytes; another seed doesn't.
+    """
+    def contents(folder, seed):
+        files = write_archive(str(tmpdir.join(folder)), n_stations=5, max_depth=20, n_taxa=3, seed=seed)
+        return [open(path).read() for path in list(files['ctd'][0]) + [files['zooplankton']]]
+
+    npt.assert_equal(contents('a', 1) == contents('b', 1), True)
+    npt.assert_equal(contents('c', 2) == contents('a', 1), False)
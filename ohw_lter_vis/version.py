@@ -23,6 +23,7 @@ CLASSIFIERS = ["Development Status :: 3 - Alpha",
                "License :: OSI Approved :: MIT License",
                "Operating System :: OS Independent",
                "Programming Language :: Python",
+               "Programming Language :: Python :: 3",
                "Topic :: Scientific/Engineering"]
 
 # Description should be a one-liner:
@@ -72,4 +73,11 @@ MINOR = _version_minor
 MICRO = _version_micro
 VERSION = __version__
 PACKAGE_DATA = {'ohw_lter_vis': [pjoin('data', '*')]}
-REQUIRES = ["numpy"]
+REQUIRES = ["numpy", "pandas>=1.3", "scipy", "xarray", "dask", "zarr", "pyarrow", "requests", "netCDF4"]
+# duckdb speeds up ohw_lter_vis.sql; ioos_lib and the notebooks need the geospatial stack
+EXTRAS_REQUIRE = {'sql': ["duckdb"],
+                  'ioos': ["altair", "cartopy", "folium", "geolinks", "geopandas", "gridgeo", "ioos_tools",
+                           "matplotlib", "owslib", "shapely"]}
+# ThreadPoolExecutor.shutdown(cancel_futures=...) and tracemalloc.reset_peak
+PYTHON_REQUIRES = ">=3.9"
+ENTRY_POINTS = {'console_scripts': ['ohw-lter-vis = ohw_lter_vis.cli:main']}
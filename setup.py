@@ -23,7 +23,9 @@ opts = dict(name=NAME,
             packages=PACKAGES,
             package_data=PACKAGE_DATA,
             install_requires=REQUIRES,
-            requires=REQUIRES)
+            extras_require=EXTRAS_REQUIRE,
+            python_requires=PYTHON_REQUIRES,
+            entry_points=ENTRY_POINTS)
 
 
 if __name__ == '__main__':